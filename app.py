@@ -1,12 +1,17 @@
 from flask import Flask, request, jsonify
 from twilio.twiml.messaging_response import MessagingResponse
-from twilio.rest import Client
 from config import Config
 from db import create_database_schema
 from ai import AIQueryProcessor
-from expiry_alert import setup_cron_job, send_expiry_alerts
+from expiry_alert import ExpiryAlertScheduler, send_expiry_alerts
+from outbox import get_outbox
+from voice_notes import VoiceNoteProcessor
+from invoice_photos import InvoicePhotoProcessor
+from extraction_jobs import JobQueueFull
+import os
 import logging
 import json
+import threading
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -15,12 +20,47 @@ logger = logging.getLogger(__name__)
 app = Flask(__name__)
 app.config.from_object(Config)
 
-# Initialize Twilio client
-twilio_client = Client(Config.TWILIO_ACCOUNT_SID, Config.TWILIO_AUTH_TOKEN)
+# Initialize outbound message outbox
+message_outbox = get_outbox()
+
+# Initialize in-process expiry alert scheduler
+expiry_scheduler = ExpiryAlertScheduler()
 
 # Initialize AI processor
 ai_processor = AIQueryProcessor()
 
+# Initialize voice note pipeline; answers are sent through the outbox
+voice_notes = VoiceNoteProcessor(ai_processor, message_outbox)
+
+# Initialize invoice photo ingestion; extracted totals are sent through the outbox
+invoice_photos = InvoicePhotoProcessor(message_outbox)
+
+# Process that started the background workers, so a forked worker starts its own
+_workers_pid = None
+_workers_lock = threading.Lock()
+
+def start_background_workers():
+    """Start the outbox sender and expiry alert scheduler once per process"""
+    global _workers_pid
+    if not Config.BACKGROUND_WORKERS:
+        return
+    with _workers_lock:
+        if _workers_pid == os.getpid():
+            return
+        _workers_pid = os.getpid()
+        
+        # Start the background sender for queued messages
+        message_outbox.start()
+        
+        # Start the expiry alert scheduler
+        expiry_scheduler.start()
+        logger.info("Background workers started")
+
+# Under gunicorn or `flask run` the module is imported, so start the workers here;
+# `python app.py` starts them below once the database exists
+if __name__ != '__main__':
+    start_background_workers()
+
 # In-memory storage for user language preferences (in production, use a database)
 user_languages = {}
 
@@ -49,6 +89,10 @@ Type 'help' anytime for this message.
 Type 'language' to change language.""",
         'language_changed': "✅ Language changed to English!",
         'processing': "Processing your query...",
+        'voice_processing': "🎤 Got your voice note! I'll send the answer in a moment.",
+        'voice_error': "Sorry, I couldn't understand that voice note. Please try again or type your question.",
+        'invoice_processing': "🧾 Got your invoice! I'll send the totals once it's read.",
+        'invoice_busy': "I'm reading a lot of invoices right now. Please send this one again in a few minutes.",
         'error': "Sorry, I encountered an error. Please try again."
     },
     'hi': {
@@ -74,6 +118,10 @@ Type 'language' to change language.""",
 भाषा बदलने के लिए 'language' टाइप करें।""",
         'language_changed': "✅ भाषा हिंदी में बदल दी गई!",
         'processing': "आपका सवाल प्रोसेस हो रहा है...",
+        'voice_processing': "🎤 आपका वॉइस नोट मिल गया! जवाब थोड़ी देर में भेजा जाएगा।",
+        'voice_error': "माफ़ करें, वॉइस नोट समझ नहीं आया। कृपया फिर से कोशिश करें या अपना सवाल टाइप करें।",
+        'invoice_processing': "🧾 आपका बिल मिल गया! पढ़ने के बाद कुल रकम भेजी जाएगी।",
+        'invoice_busy': "अभी बहुत सारे बिल पढ़े जा रहे हैं। कृपया कुछ मिनट बाद यह बिल फिर से भेजें।",
         'error': "माफ़ करें, एक त्रुटि आई। कृपया फिर से कोशिश करें।"
     }
 }
@@ -130,6 +178,33 @@ def whatsapp_webhook():
         # Get user's language preference
         user_lang = get_user_language(phone_number)
         
+        # Voice notes are transcribed and answered in the background, so acknowledge straight away
+        media_type = request.values.get('MediaContentType0', '')
+        if request.values.get('NumMedia', '0') != '0' and media_type.startswith('audio/'):
+            voice_notes.submit(
+                phone_number,
+                request.values.get('MediaUrl0'),
+                media_type,
+                user_lang,
+                error_message=get_message('voice_error', user_lang)
+            )
+            msg.body(get_message('voice_processing', user_lang))
+            return str(resp)
+        
+        # Invoice photos are extracted as a background job; the totals follow through the outbox
+        if request.values.get('NumMedia', '0') != '0' and media_type.startswith('image/'):
+            try:
+                invoice_photos.submit(
+                    phone_number,
+                    request.values.get('MediaUrl0'),
+                    user_lang,
+                    message_sid=request.values.get('MessageSid')
+                )
+                msg.body(get_message('invoice_processing', user_lang))
+            except JobQueueFull:
+                msg.body(get_message('invoice_busy', user_lang))
+            return str(resp)
+        
         # Handle different types of messages
         if not incoming_msg:
             msg.body(get_message('welcome', user_lang))
@@ -196,7 +271,7 @@ def whatsapp_webhook():
 
 @app.route('/send-message', methods=['POST'])
 def send_message():
-    """Send a message to a WhatsApp number (for testing)"""
+    """Queue a message to a WhatsApp number (for testing)"""
     try:
         data = request.get_json()
         to_number = data.get('to')
@@ -205,18 +280,14 @@ def send_message():
         if not to_number or not message:
             return jsonify({"error": "Missing 'to' or 'message' parameter"}), 400
         
-        # Send message via Twilio
-        message = twilio_client.messages.create(
-            from_=f'whatsapp:{Config.TWILIO_WHATSAPP_NUMBER}',
-            body=message,
-            to=f'whatsapp:{to_number}'
-        )
+        # Hand the message to the outbox; the background sender delivers it
+        message_id = message_outbox.enqueue(to_number, message)
         
         return jsonify({
             "success": True,
-            "message_sid": message.sid,
-            "status": message.status
-        })
+            "message_id": message_id,
+            "status": "queued"
+        }), 202
         
     except Exception as e:
         logger.error(f"Error sending message: {str(e)}")
@@ -227,8 +298,9 @@ if __name__ == '__main__':
     create_database_schema()
     logger.info("Database schema initialized")
     
-    # Set up cron job for expiry alerts
-    setup_cron_job()
+    # Only the serving process runs background workers, not the debug reloader's parent
+    if not Config.DEBUG or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_background_workers()
     
     # Run the Flask app
     app.run(
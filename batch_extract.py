@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+Batch Invoice Extraction
+Extracts every invoice image in a directory or zip archive and stores the results.
+Re-run with the same --batch-id to resume an interrupted batch.
+"""
+
+import json
+import argparse
+from invoice_extractor import InvoiceDataExtractor
+
+def print_file_result(result):
+    """Print one file's extraction outcome"""
+    if result['status'] == 'completed':
+        print(f"✅ {result['file']} -> {result.get('invoice_id') or 'extracted'} ({result['duration_seconds']}s)")
+    else:
+        print(f"❌ {result['file']}: {result['error']} ({result['duration_seconds']}s)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract invoice data from a directory or zip archive of images")
+    parser.add_argument('path', help="Directory or .zip archive of invoice images")
+    parser.add_argument('--batch-id', help="Batch identifier used for resume (default: directory or archive name)")
+    parser.add_argument('--workers', type=int, help="Maximum concurrent extractions")
+    parser.add_argument('--group-size', type=int, help="Results persisted per transaction")
+    parser.add_argument('--no-save', action='store_true', help="Extract only, do not save invoices")
+    parser.add_argument('--json', action='store_true', help="Print the summary as JSON")
+    args = parser.parse_args()
+
+    print(f"=== BATCH INVOICE EXTRACTION: {args.path} ===")
+    print()
+
+    extractor = InvoiceDataExtractor()
+    summary = extractor.extract_batch(
+        args.path,
+        batch_id=args.batch_id,
+        max_workers=args.workers,
+        save=not args.no_save,
+        group_size=args.group_size,
+        progress=print_file_result
+    )
+
+    print()
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        print(f"📦 Batch: {summary['batch_id']}")
+        print(f"📄 Files: {summary['files']} ({summary['skipped']} already done)")
+        print(f"✅ Completed: {summary['completed']}")
+        print(f"❌ Failed: {summary['failed']}")
+        print(f"⏱️  {summary['elapsed_seconds']}s, {summary['files_per_second']} files/s")
@@ -12,6 +12,46 @@ class Config:
     TWILIO_ACCOUNT_SID = os.getenv('TWILIO_ACCOUNT_SID')
     TWILIO_AUTH_TOKEN = os.getenv('TWILIO_AUTH_TOKEN')
     TWILIO_WHATSAPP_NUMBER = os.getenv('TWILIO_WHATSAPP_NUMBER')
+    TWILIO_API_BASE_URL = os.getenv('TWILIO_API_BASE_URL', 'https://api.twilio.com')
+    TWILIO_MAX_MESSAGES_PER_SECOND = float(os.getenv('TWILIO_MAX_MESSAGES_PER_SECOND', '10'))
+    
+    # Fake Twilio Server Configuration (fake_twilio.py, for load testing)
+    FAKE_TWILIO_LATENCY_MS = float(os.getenv('FAKE_TWILIO_LATENCY_MS', '150'))
+    FAKE_TWILIO_JITTER_MS = float(os.getenv('FAKE_TWILIO_JITTER_MS', '50'))
+    FAKE_TWILIO_ERROR_RATE = float(os.getenv('FAKE_TWILIO_ERROR_RATE', '0.0'))
+    
+    # Sarvam Speech-to-Text Configuration
+    SARVAM_API_KEY = os.getenv('SARVAM_API_KEY')
+    SARVAM_API_BASE_URL = os.getenv('SARVAM_API_BASE_URL', 'https://api.sarvam.ai')
+    SARVAM_STT_MODEL = os.getenv('SARVAM_STT_MODEL', 'saarika:v1')
+    
+    # Fake Speech-to-Text Server Configuration (fake_stt.py, for tests)
+    FAKE_STT_LATENCY_MS = float(os.getenv('FAKE_STT_LATENCY_MS', '300'))
+    FAKE_STT_JITTER_MS = float(os.getenv('FAKE_STT_JITTER_MS', '100'))
+    FAKE_STT_ERROR_RATE = float(os.getenv('FAKE_STT_ERROR_RATE', '0.0'))
+    
+    # Voice Note Configuration
+    VOICE_NOTE_DATABASE_FILE = os.getenv('VOICE_NOTE_DATABASE_FILE', 'voice_notes.db')
+    VOICE_NOTE_WORKERS = int(os.getenv('VOICE_NOTE_WORKERS', '4'))
+    VOICE_NOTE_STT_CONCURRENCY = int(os.getenv('VOICE_NOTE_STT_CONCURRENCY', '4'))
+    VOICE_NOTE_CHUNK_SECONDS = float(os.getenv('VOICE_NOTE_CHUNK_SECONDS', '25'))
+    VOICE_NOTE_MAX_BYTES = int(os.getenv('VOICE_NOTE_MAX_BYTES', str(16 * 1024 * 1024)))
+    VOICE_NOTE_DOWNLOAD_TIMEOUT = float(os.getenv('VOICE_NOTE_DOWNLOAD_TIMEOUT', '30'))
+    VOICE_NOTE_TRANSCODE_TIMEOUT = float(os.getenv('VOICE_NOTE_TRANSCODE_TIMEOUT', '60'))
+    VOICE_NOTE_STT_TIMEOUT = float(os.getenv('VOICE_NOTE_STT_TIMEOUT', '60'))
+    FFMPEG_BINARY = os.getenv('FFMPEG_BINARY', 'ffmpeg')
+    
+    # WhatsApp Invoice Photo Configuration
+    WHATSAPP_INVOICE_RECONCILE = os.getenv('WHATSAPP_INVOICE_RECONCILE', 'False').lower() == 'true'  # opt in: apply line items to stock
+    
+    # Outbound Message Outbox Configuration
+    OUTBOX_DATABASE_FILE = os.getenv('OUTBOX_DATABASE_FILE', 'outbox.db')
+    OUTBOX_MAX_WORKERS = int(os.getenv('OUTBOX_MAX_WORKERS', '4'))
+    OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', '5'))
+    OUTBOX_BACKOFF_BASE = float(os.getenv('OUTBOX_BACKOFF_BASE', '2'))
+    OUTBOX_BACKOFF_MAX = float(os.getenv('OUTBOX_BACKOFF_MAX', '300'))
+    OUTBOX_POLL_INTERVAL = float(os.getenv('OUTBOX_POLL_INTERVAL', '5'))
+    OUTBOX_REQUEST_TIMEOUT = float(os.getenv('OUTBOX_REQUEST_TIMEOUT', '10'))
     
     # OpenAI Configuration
     OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
@@ -19,12 +59,82 @@ class Config:
     # Gemini Configuration
     GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
     
+    # Invoice Extraction Provider Configuration
+    EXTRACTION_MODE = os.getenv('EXTRACTION_MODE', 'fallback')  # 'fallback' or 'hedged'
+    EXTRACTION_PRIMARY_PROVIDER = os.getenv('EXTRACTION_PRIMARY_PROVIDER', 'gemini')
+    EXTRACTION_HEDGE_DELAY_SECONDS = float(os.getenv('EXTRACTION_HEDGE_DELAY_SECONDS', '8'))
+    EXTRACTION_HEDGE_MAX_WORKERS = int(os.getenv('EXTRACTION_HEDGE_MAX_WORKERS', '8'))
+    EXTRACTION_STRUCTURED_OUTPUT = os.getenv('EXTRACTION_STRUCTURED_OUTPUT', 'True').lower() == 'true'
+    
+    # Background Extraction Job Configuration
+    EXTRACTION_JOB_WORKERS = int(os.getenv('EXTRACTION_JOB_WORKERS', '4'))
+    EXTRACTION_JOB_MAX_PENDING = int(os.getenv('EXTRACTION_JOB_MAX_PENDING', '100'))
+    EXTRACTION_JOB_RETENTION_SECONDS = int(os.getenv('EXTRACTION_JOB_RETENTION_SECONDS', '3600'))
+    EXTRACTION_JOB_MAX_WAIT_SECONDS = float(os.getenv('EXTRACTION_JOB_MAX_WAIT_SECONDS', '30'))
+    
+    # Invoice Natural Language Query Configuration
+    INVOICE_QUERY_MAX_ROWS = int(os.getenv('INVOICE_QUERY_MAX_ROWS', '500'))
+    INVOICE_QUERY_TIMEOUT_SECONDS = float(os.getenv('INVOICE_QUERY_TIMEOUT_SECONDS', '5'))
+    INVOICE_QUERY_SQL_CACHE_SIZE = int(os.getenv('INVOICE_QUERY_SQL_CACHE_SIZE', '256'))
+    INVOICE_QUERY_PAGE_SIZE = int(os.getenv('INVOICE_QUERY_PAGE_SIZE', '100'))
+    INVOICE_EXPORT_BATCH_ROWS = int(os.getenv('INVOICE_EXPORT_BATCH_ROWS', '500'))
+    
+    # Invoice Item Reconciliation Configuration
+    RECONCILE_MIN_SCORE = float(os.getenv('RECONCILE_MIN_SCORE', '0.6'))  # trigram Dice similarity, 0-1
+    RECONCILE_CREATE_MISSING = os.getenv('RECONCILE_CREATE_MISSING', 'True').lower() == 'true'
+    
+    # Invoice Validation Configuration
+    INVOICE_VALIDATION_TOLERANCE = float(os.getenv('INVOICE_VALIDATION_TOLERANCE', '0.05'))  # absolute, in invoice currency
+    INVOICE_VALIDATION_RELATIVE_TOLERANCE = float(os.getenv('INVOICE_VALIDATION_RELATIVE_TOLERANCE', '0.005'))
+    INVOICE_FIELD_REEXTRACTION = os.getenv('INVOICE_FIELD_REEXTRACTION', 'True').lower() == 'true'
+    
+    # Invoice Extraction Cache Configuration
+    EXTRACTION_CACHE_MAX_ENTRIES = int(os.getenv('EXTRACTION_CACHE_MAX_ENTRIES', '5000'))
+    EXTRACTION_CACHE_TTL_DAYS = int(os.getenv('EXTRACTION_CACHE_TTL_DAYS', '90'))
+    EXTRACTION_CACHE_EVICT_INTERVAL = int(os.getenv('EXTRACTION_CACHE_EVICT_INTERVAL', '50'))  # cache writes between eviction passes
+    
+    # Extraction Payload Storage Configuration
+    EXTRACTION_PAYLOAD_CODEC = os.getenv('EXTRACTION_PAYLOAD_CODEC', 'zlib')  # 'zlib', 'zstd' (needs zstandard) or 'none'
+    EXTRACTION_PAYLOAD_COMPRESSION_LEVEL = int(os.getenv('EXTRACTION_PAYLOAD_COMPRESSION_LEVEL', '6'))
+    
+    # Invoice Upload Configuration
+    MAX_CONTENT_LENGTH = int(os.getenv('MAX_CONTENT_LENGTH', str(16 * 1024 * 1024)))
+    UPLOAD_SPOOL_MAX_BYTES = int(os.getenv('UPLOAD_SPOOL_MAX_BYTES', str(16 * 1024 * 1024)))
+    UPLOAD_STORE_DIR = os.getenv('UPLOAD_STORE_DIR', 'uploads')
+    UPLOAD_STORE_MAX_BYTES = int(os.getenv('UPLOAD_STORE_MAX_BYTES', str(2 * 1024 * 1024 * 1024)))
+    UPLOAD_RETENTION_DAYS = int(os.getenv('UPLOAD_RETENTION_DAYS', '90'))
+    UPLOAD_GC_GRACE_SECONDS = int(os.getenv('UPLOAD_GC_GRACE_SECONDS', '3600'))
+    UPLOAD_GC_INTERVAL_SECONDS = int(os.getenv('UPLOAD_GC_INTERVAL_SECONDS', '3600'))
+    
+    # Invoice Image Preprocessing Configuration
+    INVOICE_IMAGE_PREPROCESS = os.getenv('INVOICE_IMAGE_PREPROCESS', 'True').lower() == 'true'
+    INVOICE_IMAGE_MAX_EDGE = int(os.getenv('INVOICE_IMAGE_MAX_EDGE', '1600'))
+    INVOICE_IMAGE_FORMAT = os.getenv('INVOICE_IMAGE_FORMAT', 'JPEG')
+    INVOICE_IMAGE_QUALITY = int(os.getenv('INVOICE_IMAGE_QUALITY', '80'))
+    INVOICE_IMAGE_GRAYSCALE = os.getenv('INVOICE_IMAGE_GRAYSCALE', 'True').lower() == 'true'
+    
+    # Batch Invoice Extraction Configuration
+    BATCH_MAX_WORKERS = int(os.getenv('BATCH_MAX_WORKERS', '4'))
+    BATCH_GROUP_SIZE = int(os.getenv('BATCH_GROUP_SIZE', '25'))
+    
+    # Bulk Invoice Upload Configuration
+    BULK_UPLOAD_MAX_CONTENT_LENGTH = int(os.getenv('BULK_UPLOAD_MAX_CONTENT_LENGTH', str(256 * 1024 * 1024)))
+    BULK_UPLOAD_MAX_FILES = int(os.getenv('BULK_UPLOAD_MAX_FILES', '500'))
+    BULK_UPLOAD_GROUP_SIZE = int(os.getenv('BULK_UPLOAD_GROUP_SIZE', '5'))  # invoices saved per transaction
+    BULK_UPLOAD_KEEPALIVE_SECONDS = float(os.getenv('BULK_UPLOAD_KEEPALIVE_SECONDS', '15'))
+    
     # Database Configuration
     DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite:///sales.db')
     
     # Expiry Alert Configuration
     EXPIRY_ALERT_DAYS = int(os.getenv('EXPIRY_ALERT_DAYS', '3'))
+    EXPIRY_ALERT_THRESHOLDS = [int(days) for days in os.getenv('EXPIRY_ALERT_THRESHOLDS', '3,1,0').split(',')]
+    EXPIRY_ALERT_MAX_WORKERS = int(os.getenv('EXPIRY_ALERT_MAX_WORKERS', '8'))
+    EXPIRY_ALERT_TIME = os.getenv('EXPIRY_ALERT_TIME', '09:00')
+    EXPIRY_ALERT_TIMEZONE = os.getenv('EXPIRY_ALERT_TIMEZONE', 'UTC')
+    EXPIRY_SCHEDULER_REFRESH_SECONDS = float(os.getenv('EXPIRY_SCHEDULER_REFRESH_SECONDS', '3600'))
     
     # Flask Configuration
     SECRET_KEY = os.getenv('SECRET_KEY', 'your-secret-key-here')
-    DEBUG = os.getenv('DEBUG', 'True').lower() == 'true'
\ No newline at end of file
+    DEBUG = os.getenv('DEBUG', 'True').lower() == 'true'
+    BACKGROUND_WORKERS = os.getenv('BACKGROUND_WORKERS', 'True').lower() == 'true'  # outbox sender and expiry scheduler in the app process
\ No newline at end of file
@@ -23,10 +23,15 @@ def create_database():
             CREATE TABLE IF NOT EXISTS shops (
                 id TEXT PRIMARY KEY,
                 name TEXT,
-                owner_phone TEXT UNIQUE
+                owner_phone TEXT UNIQUE,
+                alert_time TEXT,
+                timezone TEXT
             )
         ''')
         
+        # Older databases were created before per-shop alert settings existed
+        add_missing_columns(cursor, 'shops', {'alert_time': 'TEXT', 'timezone': 'TEXT'})
+        
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS items (
                 id TEXT PRIMARY KEY,
@@ -34,10 +39,14 @@ def create_database():
                 name TEXT,
                 cost_price REAL,
                 selling_price REAL,
-                expiry_date TEXT
+                expiry_date TEXT,
+                stock_quantity REAL
             )
         ''')
         
+        # Stock levels were added for invoice reconciliation
+        add_missing_columns(cursor, 'items', {'stock_quantity': 'REAL'})
+        
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS sales (
                 id TEXT PRIMARY KEY,
@@ -48,7 +57,48 @@ def create_database():
             )
         ''')
         
+        # Ledger of expiry alerts already sent, one row per item and threshold
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS expiry_alert_ledger (
+                item_id TEXT REFERENCES items(id),
+                threshold_days INTEGER,
+                sent_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (item_id, threshold_days)
+            ) WITHOUT ROWID
+        ''')
+        
+        # Expiry-ordered access path for alerts and the scheduler
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_items_shop_expiry ON items (shop_id, expiry_date)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_items_expiry ON items (expiry_date)')
+        cursor.execute('''
+            CREATE VIEW IF NOT EXISTS shop_expiry_schedule AS
+            SELECT s.id AS shop_id, s.name AS shop_name, s.owner_phone, s.alert_time, s.timezone,
+                   i.expiry_date
+            FROM shops s
+            JOIN items i ON i.shop_id = s.id
+            ORDER BY i.expiry_date
+        ''')
+        
+        # Invoice line items already applied to each shop's catalog, so re-running reconciliation is safe
+        cursor.execute('PRAGMA table_info(invoice_item_matches)')
+        if [row[1] for row in cursor.fetchall() if row[5]] == ['invoice_item_id']:
+            # Older ledgers were keyed by invoice line alone and dropped other shops' rows
+            cursor.execute('DROP TABLE invoice_item_matches')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS invoice_item_matches (
+                shop_id TEXT REFERENCES shops(id),
+                invoice_item_id TEXT,
+                item_id TEXT REFERENCES items(id),
+                score REAL,
+                matched_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (shop_id, invoice_item_id)
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_items_shop_name ON items (shop_id, name)')
+        
         # Clear existing data
+        cursor.execute('DELETE FROM invoice_item_matches')
+        cursor.execute('DELETE FROM expiry_alert_ledger')
         cursor.execute('DELETE FROM sales')
         cursor.execute('DELETE FROM items')
         cursor.execute('DELETE FROM shops')
@@ -65,18 +115,26 @@ def create_database():
         logger.error(f"Error creating database: {str(e)}")
         return False
 
+def add_missing_columns(cursor, table, columns):
+    """Add any of the given columns that an existing table does not have yet"""
+    cursor.execute(f'PRAGMA table_info({table})')
+    existing = {row[1] for row in cursor.fetchall()}
+    for name, column_type in columns.items():
+        if name not in existing:
+            cursor.execute(f'ALTER TABLE {table} ADD COLUMN {name} {column_type}')
+
 def populate_sample_data_sqlite(cursor):
     """Populate the SQLite database with sample data"""
     try:
         # Sample shop data
         shops = [
-            (str(uuid.uuid4()), "Grocery Store", "+1234567890"),
-            (str(uuid.uuid4()), "Convenience Store", "+9876543210"),
-            (str(uuid.uuid4()), "Supermarket", "+1122334455")
+            (str(uuid.uuid4()), "Grocery Store", "+1234567890", None, None),
+            (str(uuid.uuid4()), "Convenience Store", "+9876543210", "08:00", "Asia/Kolkata"),
+            (str(uuid.uuid4()), "Supermarket", "+1122334455", "18:30", "Asia/Kolkata")
         ]
         
         # Insert shops
-        cursor.executemany('INSERT INTO shops (id, name, owner_phone) VALUES (?, ?, ?)', shops)
+        cursor.executemany('INSERT INTO shops (id, name, owner_phone, alert_time, timezone) VALUES (?, ?, ?, ?, ?)', shops)
         
         # Sample items
         items = []
@@ -86,7 +144,7 @@ def populate_sample_data_sqlite(cursor):
         ]
         
         # Create items for each shop
-        for shop_id, shop_name, _ in shops:
+        for shop_id, shop_name, *_ in shops:
             for item_name in item_names:
                 item_id = str(uuid.uuid4())
                 cost_price = round(float(f"{(2 + (hash(item_name) % 5)):.2f}"), 2)
@@ -169,7 +227,7 @@ def execute_query(query, params=None, phone_number=None):
         logger.error(f"Error executing query: {str(e)}")
         raise e
 
-def get_expiring_items(days=3):
+def get_expiring_items(days=3, shop_ids=None):
     """Get items that will expire within the specified number of days"""
     try:
         conn = sqlite3.connect(DATABASE_FILE)
@@ -179,13 +237,21 @@ def get_expiring_items(days=3):
         threshold_date = (datetime.now() + timedelta(days=days)).strftime('%Y-%m-%d')
         current_date = datetime.now().strftime('%Y-%m-%d')
         
+        # Optionally restrict to a subset of shops
+        shop_filter = ''
+        params = [threshold_date, current_date]
+        if shop_ids:
+            shop_filter = f"AND i.shop_id IN ({', '.join('?' for _ in shop_ids)})"
+            params.extend(shop_ids)
+        
         # Query items that will expire soon
-        cursor.execute('''
+        cursor.execute(f'''
             SELECT i.*, s.name as shop_name, s.owner_phone 
             FROM items i 
             JOIN shops s ON i.shop_id = s.id 
-            WHERE i.expiry_date <= ? AND i.expiry_date >= ?
-        ''', (threshold_date, current_date))
+            WHERE i.expiry_date <= ? AND i.expiry_date >= ? {shop_filter}
+            ORDER BY i.shop_id, i.expiry_date
+        ''', params)
         
         results = cursor.fetchall()
         conn.close()
@@ -198,6 +264,232 @@ def get_expiring_items(days=3):
         logger.error(f"Error getting expiring items: {str(e)}")
         return []
 
+def get_unalerted_expiring_items(days=3, thresholds=(3, 1, 0), shop_ids=None, today=None, timezones=None):
+    """Get expiring items that have not been alerted at their current threshold yet.
+
+    Each item falls into the smallest alert threshold that is at least its
+    days left. It is returned only when the ledger has no entry for it at
+    that threshold or a lower one, so an item is alerted once per threshold
+    and again only when it escalates.
+
+    Days left are counted from `today` (a date, default the server's), so
+    pass each shop's local date, and `timezones` to limit the query to
+    shops whose shops.timezone is one of them ('' matches shops without one).
+    """
+    try:
+        conn = sqlite3.connect(DATABASE_FILE)
+        cursor = conn.cursor()
+        
+        today = today or datetime.now().date()
+        current_date = today.strftime('%Y-%m-%d')
+        threshold_date = (today + timedelta(days=days)).strftime('%Y-%m-%d')
+        thresholds = sorted(set(t for t in thresholds if t <= days) | {days})
+        
+        # Map days left to the smallest threshold that covers it
+        bucket_sql = 'CASE ' + ' '.join('WHEN days_left <= ? THEN ?' for _ in thresholds) + ' END'
+        bucket_params = [value for t in thresholds for value in (t, t)]
+        
+        shop_filter = ''
+        shop_params = []
+        if shop_ids:
+            shop_filter = f"AND i.shop_id IN ({', '.join('?' for _ in shop_ids)})"
+            shop_params = list(shop_ids)
+        if timezones is not None:
+            shop_filter += f" AND COALESCE(s.timezone, '') IN ({', '.join('?' for _ in timezones)})"
+            shop_params += list(timezones)
+        
+        cursor.execute(f'''
+            SELECT * FROM (
+                SELECT e.*, {bucket_sql} AS alert_threshold
+                FROM (
+                    SELECT i.*, s.name AS shop_name, s.owner_phone,
+                           CAST(julianday(i.expiry_date) - julianday(?) AS INTEGER) AS days_left
+                    FROM items i
+                    JOIN shops s ON i.shop_id = s.id
+                    WHERE i.expiry_date <= ? AND i.expiry_date >= ? {shop_filter}
+                ) e
+            ) a
+            WHERE NOT EXISTS (
+                SELECT 1 FROM expiry_alert_ledger l
+                WHERE l.item_id = a.id AND l.threshold_days <= a.alert_threshold
+            )
+            ORDER BY a.shop_id, a.expiry_date
+        ''', bucket_params + [current_date, threshold_date, current_date] + shop_params)
+        
+        results = cursor.fetchall()
+        columns = [description[0] for description in cursor.description]
+        conn.close()
+        
+        return [dict(zip(columns, row)) for row in results]
+        
+    except Exception as e:
+        logger.error(f"Error getting unalerted expiring items: {str(e)}")
+        return []
+
+def claim_expiry_alerts(entries):
+    """Record (item_id, threshold_days) pairs in the expiry alert ledger and return the pairs this call added.
+
+    Alerts are claimed before they are sent. Scheduler processes racing on
+    the same shop insert the same ledger keys, so each pair is claimed by
+    exactly one of them and the others skip it.
+    """
+    try:
+        conn = sqlite3.connect(DATABASE_FILE, timeout=30)
+        cursor = conn.cursor()
+        
+        cursor.execute('BEGIN IMMEDIATE')
+        claimed = []
+        for entry in entries:
+            cursor.execute('INSERT OR IGNORE INTO expiry_alert_ledger (item_id, threshold_days) VALUES (?, ?)', entry)
+            if cursor.rowcount == 1:
+                claimed.append(tuple(entry))
+        
+        conn.commit()
+        conn.close()
+        return claimed
+        
+    except Exception as e:
+        logger.error(f"Error claiming expiry alerts: {str(e)}")
+        return []
+
+def release_expiry_alerts(entries):
+    """Remove claimed (item_id, threshold_days) pairs whose alert could not be sent"""
+    try:
+        conn = sqlite3.connect(DATABASE_FILE, timeout=30)
+        cursor = conn.cursor()
+        
+        cursor.executemany('DELETE FROM expiry_alert_ledger WHERE item_id = ? AND threshold_days = ?', entries)
+        
+        conn.commit()
+        conn.close()
+        return True
+        
+    except Exception as e:
+        logger.error(f"Error releasing expiry alerts: {str(e)}")
+        return False
+
+def get_shop_timezones():
+    """Get the distinct shops.timezone values, with '' for shops that have none"""
+    try:
+        conn = sqlite3.connect(DATABASE_FILE)
+        cursor = conn.cursor()
+        
+        cursor.execute("SELECT DISTINCT COALESCE(timezone, '') FROM shops")
+        results = [row[0] for row in cursor.fetchall()]
+        
+        conn.close()
+        return results
+        
+    except Exception as e:
+        logger.error(f"Error getting shop timezones: {str(e)}")
+        return []
+
+def get_shop_alert_schedule(from_date):
+    """Get each shop's alert settings and earliest expiry date on or after from_date"""
+    try:
+        conn = sqlite3.connect(DATABASE_FILE)
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            SELECT shop_id, shop_name, owner_phone, alert_time, timezone,
+                   MIN(expiry_date) AS next_expiry_date
+            FROM shop_expiry_schedule
+            WHERE expiry_date >= ?
+            GROUP BY shop_id
+        ''', (from_date,))
+        
+        results = cursor.fetchall()
+        columns = [description[0] for description in cursor.description]
+        conn.close()
+        
+        return [dict(zip(columns, row)) for row in results]
+        
+    except Exception as e:
+        logger.error(f"Error getting shop alert schedule: {str(e)}")
+        return []
+
+def get_shop_catalog(shop_id):
+    """Get (item_id, name) for every catalog item of a shop"""
+    try:
+        conn = sqlite3.connect(DATABASE_FILE)
+        cursor = conn.cursor()
+        
+        cursor.execute('SELECT id, name FROM items WHERE shop_id = ?', (shop_id,))
+        results = cursor.fetchall()
+        
+        conn.close()
+        return results
+    
+    except Exception as e:
+        logger.error(f"Error getting shop catalog: {str(e)}")
+        return []
+
+def get_reconciled_invoice_item_ids(shop_id):
+    """Get the ids of invoice line items already applied to a shop's catalog"""
+    try:
+        conn = sqlite3.connect(DATABASE_FILE)
+        cursor = conn.cursor()
+        
+        cursor.execute('SELECT invoice_item_id FROM invoice_item_matches WHERE shop_id = ?', (shop_id,))
+        results = {row[0] for row in cursor.fetchall()}
+        
+        conn.close()
+        return results
+    
+    except Exception as e:
+        logger.error(f"Error getting reconciled invoice items: {str(e)}")
+        return set()
+
+def apply_catalog_updates(shop_id, new_items, lines):
+    """Apply invoice reconciliation to a shop's catalog in one transaction.
+    
+    new_items are (item_id, name) catalog items to create for unmatched
+    lines, and lines are (invoice_item_id, item_id, score, cost_price,
+    quantity) matches. Each line is first recorded in the ledger, and only
+    lines whose ledger row was actually inserted add their quantity and
+    cost, so a line applied concurrently by another run is not counted
+    twice. New items no applied line refers to are not created. Returns
+    the ids of the applied invoice lines, or None if the update failed.
+    """
+    try:
+        conn = sqlite3.connect(DATABASE_FILE, timeout=30)
+        cursor = conn.cursor()
+        
+        cursor.execute('BEGIN IMMEDIATE')
+        applied = []
+        totals = {}
+        for invoice_item_id, item_id, score, cost_price, quantity in lines:
+            cursor.execute(
+                'INSERT OR IGNORE INTO invoice_item_matches (invoice_item_id, shop_id, item_id, score) VALUES (?, ?, ?, ?)',
+                (invoice_item_id, shop_id, item_id, score)
+            )
+            if cursor.rowcount != 1:
+                continue
+            applied.append(invoice_item_id)
+            # Several lines for one item: add quantities, keep the last known cost
+            total = totals.setdefault(item_id, [None, 0.0])
+            total[0] = cost_price if cost_price is not None else total[0]
+            total[1] += quantity
+        
+        cursor.executemany(
+            'INSERT INTO items (id, shop_id, name, cost_price, stock_quantity) VALUES (?, ?, ?, ?, 0)',
+            [(item_id, shop_id, name, totals[item_id][0]) for item_id, name in new_items if item_id in totals]
+        )
+        cursor.executemany('''
+            UPDATE items
+            SET cost_price = COALESCE(?, cost_price),
+                stock_quantity = COALESCE(stock_quantity, 0) + ?
+            WHERE id = ?
+        ''', [(cost_price, quantity, item_id) for item_id, (cost_price, quantity) in totals.items()])
+        
+        conn.commit()
+        conn.close()
+        return applied
+    
+    except Exception as e:
+        logger.error(f"Error applying catalog updates: {str(e)}")
+        return None
+
 def get_database_schema_info():
     """Get the database schema information for AI prompts"""
     schema_info = """
@@ -213,7 +505,8 @@ def get_database_schema_info():
         name TEXT,
         cost_price REAL,
         selling_price REAL,
-        expiry_date TEXT
+        expiry_date TEXT,
+        stock_quantity REAL
     );
     
     CREATE TABLE sales (
@@ -1,86 +1,309 @@
-import os
+import time
+import heapq
 import logging
-from datetime import datetime
-from twilio.rest import Client
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
 from config import Config
-from db import get_expiring_items
+from db import (
+    get_unalerted_expiring_items, claim_expiry_alerts, release_expiry_alerts, get_shop_alert_schedule, get_shop_timezones
+)
+from outbox import get_outbox
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Initialize Twilio client
-twilio_client = Client(Config.TWILIO_ACCOUNT_SID, Config.TWILIO_AUTH_TOKEN)
 
-def send_expiry_alerts():
-    """Send WhatsApp alerts for items expiring soon"""
+def group_items_by_shop(expiring_items):
+    """Group flat expiring item rows by shop"""
+    shops = {}
+    for item in expiring_items:
+        shop = shops.setdefault(item['shop_id'], {
+            'shop_id': item['shop_id'],
+            'shop_name': item['shop_name'],
+            'owner_phone': item['owner_phone'],
+            'items': []
+        })
+        shop['items'].append(item)
+    return list(shops.values())
+
+def shop_local_date(timezone_name, now=None):
+    """Today's date in a shop's timezone, falling back to EXPIRY_ALERT_TIMEZONE"""
+    try:
+        tz = ZoneInfo(timezone_name or Config.EXPIRY_ALERT_TIMEZONE)
+    except Exception:
+        logger.error(f"Invalid shop timezone {timezone_name!r}; using {Config.EXPIRY_ALERT_TIMEZONE}")
+        tz = ZoneInfo(Config.EXPIRY_ALERT_TIMEZONE)
+    return (now or datetime.now(timezone.utc)).astimezone(tz).date()
+
+def format_expiry_alert(items, days=None):
+    """Format the expiry alert message for one shop"""
+    days = days if days is not None else Config.EXPIRY_ALERT_DAYS
+    today = datetime.now().date()
+    
+    message = f"⚠️ *EXPIRY ALERT* ⚠️\n\nThe following items in your shop will expire within {days} days:\n\n"
+    
+    for item in sorted(items, key=lambda item: item['expiry_date']):
+        # days_left comes from the query, counted from the shop's local date
+        days_left = item.get('days_left')
+        if days_left is None:
+            days_left = (datetime.strptime(item['expiry_date'], '%Y-%m-%d').date() - today).days
+        message += f"• {item['name']} - Expires in {days_left} days ({item['expiry_date']})\n"
+    
+    message += "\nConsider discounting these items or planning promotions to reduce waste."
+    return message
+
+def send_shop_expiry_alert(shop):
+    """Send the expiry alert for a single shop and return the outcome.
+
+    The shop's items are claimed in the ledger before sending, so when
+    several app processes run the scheduler only one of them alerts each
+    item. Claims are released again if the message is rejected or cannot
+    be queued, so a later run retries them.
+    """
+    result = {
+        'shop_id': shop['shop_id'],
+        'owner_phone': shop['owner_phone'],
+        'items': len(shop['items']),
+        'status': 'failed',
+        'error': None
+    }
+    claimed = []
     try:
-        # Get items expiring within the configured days
-        expiring_items = get_expiring_items(days=Config.EXPIRY_ALERT_DAYS)
+        if not shop['owner_phone']:
+            raise ValueError("Shop has no owner phone number")
         
-        if not expiring_items:
-            logger.info("No items expiring soon. No alerts sent.")
-            return
+        claimed = claim_expiry_alerts([(item['id'], item['alert_threshold']) for item in shop['items']])
+        claimed_keys = set(claimed)
+        items = [item for item in shop['items'] if (item['id'], item['alert_threshold']) in claimed_keys]
+        result['items'] = len(items)
+        if not items:
+            # Another process already alerted these items
+            result['status'] = 'skipped'
+            return result
         
-        # Group items by shop owner
-        shop_items = {}
-        for item in expiring_items:
-            owner_phone = item['shops']['owner_phone']
-            if owner_phone not in shop_items:
-                shop_items[owner_phone] = []
-            shop_items[owner_phone].append(item)
+        message = format_expiry_alert(items)
+        outbox = get_outbox()
+        message_id, status = outbox.send_now(shop['owner_phone'], message)
+        result['message_id'] = message_id
         
-        # Send alerts to each shop owner
-        for owner_phone, items in shop_items.items():
-            # Format the message
-            message = f"⚠️ *EXPIRY ALERT* ⚠️\n\nThe following items in your shop will expire within {Config.EXPIRY_ALERT_DAYS} days:\n\n"
-            
-            for item in items:
-                days_left = (datetime.strptime(item['expiry_date'], '%Y-%m-%d') - datetime.now()).days
-                message += f"• {item['name']} - Expires in {days_left} days ({item['expiry_date']})\n"
-            
-            message += "\nConsider discounting these items or planning promotions to reduce waste."
-            
-            # Send WhatsApp message
-            twilio_message = twilio_client.messages.create(
-                from_=f'whatsapp:{Config.TWILIO_WHATSAPP_NUMBER}',
-                body=message,
-                to=f'whatsapp:{owner_phone}'
-            )
-            
-            logger.info(f"Sent expiry alert to {owner_phone} (SID: {twilio_message.sid})")
+        if status == 'dead':
+            # Rejected outright (e.g. an invalid number); release the items so a later run retries them
+            result['error'] = (outbox.get_message(message_id) or {}).get('last_error') or "Message was dead-lettered"
+            release_expiry_alerts(claimed)
+            return result
         
-        return True
+        # Queued messages stay in the outbox and are retried in the background, so their claims stand
+        result['status'] = 'sent' if status == 'sent' else 'retrying'
     except Exception as e:
-        logger.error(f"Error sending expiry alerts: {str(e)}")
-        return False
+        logger.error(f"Error sending expiry alert to shop {shop['shop_id']}: {str(e)}")
+        result['error'] = str(e)
+        if claimed and 'message_id' not in result:
+            release_expiry_alerts(claimed)
+    return result
+
+def send_expiry_alerts(max_workers=None, shop_ids=None):
+    """Send WhatsApp alerts for items expiring soon, fanning out across shops.
+
+    Only items that are new to the alert window, or have escalated to a
+    lower threshold since their last alert, are included. The window is
+    counted from each shop's local date, so shops are queried in groups
+    of timezones that share the same date.
 
-def setup_cron_job():
-    """Set up a cron job to run the expiry alert function daily"""
+    Each shop is handled by its own task on a bounded thread pool, so a
+    failure for one shop does not affect the others. Provider rate limits
+    are enforced by the shared outbox. Pass shop_ids to alert only those
+    shops. Returns a run summary.
+    """
+    max_workers = max_workers or Config.EXPIRY_ALERT_MAX_WORKERS
+    started = time.monotonic()
+    summary = {
+        'shops': 0,
+        'items': 0,
+        'sent': 0,
+        'retrying': 0,
+        'failed': 0,
+        'skipped': 0,
+        'elapsed_seconds': 0.0,
+        'shops_per_second': 0.0,
+        'failures': []
+    }
     try:
-        from crontab import CronTab
+        # Group shop timezones by their current local date
+        now = datetime.now(timezone.utc)
+        timezones_by_date = defaultdict(list)
+        for timezone_name in get_shop_timezones():
+            timezones_by_date[shop_local_date(timezone_name, now)].append(timezone_name)
         
-        # Get the current user's crontab
-        cron = CronTab(user=True)
+        # Get expiring items not yet alerted at their current threshold
+        expiring_items = []
+        for today, timezone_names in sorted(timezones_by_date.items()):
+            expiring_items += get_unalerted_expiring_items(
+                days=Config.EXPIRY_ALERT_DAYS,
+                thresholds=Config.EXPIRY_ALERT_THRESHOLDS,
+                shop_ids=shop_ids,
+                today=today,
+                timezones=timezone_names
+            )
+        
+        if not expiring_items:
+            logger.info("No new or escalated expiring items. No alerts sent.")
+            return summary
         
-        # Remove any existing jobs with the same comment
-        for job in cron.find_comment('whatsapp_expiry_alert'):
-            cron.remove(job)
+        shops = group_items_by_shop(expiring_items)
+        summary['shops'] = len(shops)
+        summary['items'] = len(expiring_items)
         
-        # Create a new job that runs daily at 9 AM
-        job = cron.new(command=f'cd {os.getcwd()} && python -c "from expiry_alert import send_expiry_alerts; send_expiry_alerts()"')
-        job.setall('0 9 * * *')  # Run at 9:00 AM every day
-        job.set_comment('whatsapp_expiry_alert')
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='expiry-alert') as executor:
+            for result in executor.map(send_shop_expiry_alert, shops):
+                summary[result['status']] += 1
+                if result['status'] == 'failed':
+                    summary['failures'].append({'shop_id': result['shop_id'], 'error': result['error']})
         
-        # Write the crontab
-        cron.write()
+        elapsed = time.monotonic() - started
+        summary['elapsed_seconds'] = round(elapsed, 3)
+        summary['shops_per_second'] = round(len(shops) / elapsed, 2) if elapsed > 0 else 0.0
         
-        logger.info("Cron job for expiry alerts set up successfully")
-        return True
+        logger.info(
+            f"Expiry alert run finished: {summary['shops']} shops, {summary['items']} items, "
+            f"{summary['sent']} sent, {summary['retrying']} retrying, {summary['failed']} failed, {summary['skipped']} skipped "
+            f"in {summary['elapsed_seconds']}s ({summary['shops_per_second']} shops/s)"
+        )
+        return summary
     except Exception as e:
-        logger.error(f"Error setting up cron job: {str(e)}")
-        return False
+        logger.error(f"Error sending expiry alerts: {str(e)}")
+        summary['elapsed_seconds'] = round(time.monotonic() - started, 3)
+        summary['failures'].append({'shop_id': None, 'error': str(e)})
+        return summary
+
+def next_alert_time(shop, now=None, catch_up=False):
+    """Compute the next UTC time an expiry alert is due for a shop.
+
+    The alert fires at the shop's local alert time on the first day its
+    earliest upcoming expiry falls inside the alert window, and never
+    earlier than the next occurrence of that local time. With `catch_up`,
+    a shop whose alert time already passed today is due `now` instead of
+    tomorrow, so a restart after the alert time does not skip the day.
+    """
+    tz = ZoneInfo(shop.get('timezone') or Config.EXPIRY_ALERT_TIMEZONE)
+    hour, minute = (int(part) for part in (shop.get('alert_time') or Config.EXPIRY_ALERT_TIME).split(':'))
+    
+    now_local = (now or datetime.now(timezone.utc)).astimezone(tz)
+    next_expiry = datetime.strptime(shop['next_expiry_date'], '%Y-%m-%d').date()
+    
+    alert_date = max(now_local.date(), next_expiry - timedelta(days=Config.EXPIRY_ALERT_DAYS))
+    alert_at = datetime(alert_date.year, alert_date.month, alert_date.day, hour, minute, tzinfo=tz)
+    if alert_at <= now_local:
+        if catch_up and alert_date == now_local.date():
+            return now_local.astimezone(timezone.utc)
+        alert_at += timedelta(days=1)
+    
+    return alert_at.astimezone(timezone.utc)
+
+class ExpiryAlertScheduler:
+    """In-process scheduler that sends each shop's expiry alert when it is due.
+
+    The schedule is rebuilt from the shop_expiry_schedule view into a heap
+    of (due time, shop id) entries, and the scheduler thread sleeps until
+    the earliest one. Shops with nothing close to expiring are scheduled
+    for the day their first item enters the alert window rather than
+    being checked every day.
+    """
+    
+    def __init__(self, refresh_interval=None):
+        self.refresh_interval = refresh_interval or Config.EXPIRY_SCHEDULER_REFRESH_SECONDS
+        self._heap = []
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+    
+    def rebuild(self, now=None, catch_up=False):
+        """Recompute the next alert time for every shop.
+
+        The first rebuild after start uses `catch_up`, so alerts whose
+        time passed while the app was down run straight away; the ledger
+        keeps shops that were already alerted from being alerted twice.
+        """
+        now = now or datetime.now(timezone.utc)
+        # One day of slack covers shops whose local date is behind UTC
+        from_date = (now - timedelta(days=1)).strftime('%Y-%m-%d')
+        
+        heap = []
+        for shop in get_shop_alert_schedule(from_date):
+            try:
+                heap.append((next_alert_time(shop, now, catch_up), shop['shop_id']))
+            except Exception as e:
+                logger.error(f"Invalid alert settings for shop {shop['shop_id']}: {str(e)}")
+        heapq.heapify(heap)
+        self._heap = heap
+        
+        if heap:
+            logger.info(f"Expiry schedule rebuilt: {len(heap)} shops, next alert at {heap[0][0].isoformat()}")
+        return heap
+    
+    def refresh(self):
+        """Ask the scheduler to rebuild its schedule, e.g. after items change"""
+        self._wakeup.set()
+    
+    def run_due(self, now=None):
+        """Send alerts for every shop whose alert time has passed"""
+        now = now or datetime.now(timezone.utc)
+        due_shop_ids = []
+        while self._heap and self._heap[0][0] <= now:
+            due_shop_ids.append(heapq.heappop(self._heap)[1])
+        
+        if due_shop_ids:
+            logger.info(f"Running expiry alerts for {len(due_shop_ids)} shops")
+            send_expiry_alerts(shop_ids=due_shop_ids)
+        return due_shop_ids
+    
+    def _run(self):
+        """Scheduler loop"""
+        logger.info("Expiry alert scheduler started")
+        try:
+            self.rebuild(catch_up=True)
+        except Exception as e:
+            logger.error(f"Error building expiry schedule: {str(e)}")
+        
+        while not self._stopping.is_set():
+            wait = self.refresh_interval
+            if self._heap:
+                wait = min(wait, max(0.0, (self._heap[0][0] - datetime.now(timezone.utc)).total_seconds()))
+            self._wakeup.wait(wait)
+            self._wakeup.clear()
+            if self._stopping.is_set():
+                break
+            
+            try:
+                # Use one timestamp so a shop is either fired now or kept for later
+                now = datetime.now(timezone.utc)
+                self.run_due(now)
+                self.rebuild(now)
+            except Exception as e:
+                logger.error(f"Error in expiry alert scheduler: {str(e)}")
+        logger.info("Expiry alert scheduler stopped")
+    
+    def start(self):
+        """Start the scheduler thread"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name='expiry-scheduler', daemon=True)
+        self._thread.start()
+    
+    def stop(self, timeout=10):
+        """Stop the scheduler thread"""
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
 
 # For testing purposes
 if __name__ == "__main__":
-    send_expiry_alerts()
\ No newline at end of file
+    send_expiry_alerts()
+    # Deliver the queued alerts before the process exits
+    get_outbox().drain()
\ No newline at end of file
@@ -0,0 +1,144 @@
+import time
+import uuid
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+from config import Config
+from latency_stats import percentile
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Job states; succeeded and failed are final
+FINAL_STATUSES = ('succeeded', 'failed')
+
+class JobQueueFull(Exception):
+    """Raised when a job is submitted while EXTRACTION_JOB_MAX_PENDING jobs are waiting"""
+
+class ExtractionJobQueue:
+    """Bounded pool running extraction jobs in the background.
+
+    Jobs live in memory: submit() returns a job id straight away and the
+    caller polls get() or blocks in wait() for the result. Finished jobs
+    are kept for EXTRACTION_JOB_RETENTION_SECONDS. Queue wait and run
+    times of recent jobs are kept for stats().
+    """
+
+    def __init__(self, max_workers: int = None, max_pending: int = None):
+        self.max_workers = max_workers or Config.EXTRACTION_JOB_WORKERS
+        self.max_pending = max_pending or Config.EXTRACTION_JOB_MAX_PENDING
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='extract-job')
+        self._jobs = {}
+        self._changed = threading.Condition()
+        self._counts = {'submitted': 0, 'succeeded': 0, 'failed': 0, 'rejected': 0}
+        self._wait_times = deque(maxlen=1000)
+        self._run_times = deque(maxlen=1000)
+
+    def submit(self, task: Callable[[], Dict], description: str = None,
+               on_complete: Callable[[Dict], None] = None) -> str:
+        """Queue `task` and return its job id; raises JobQueueFull when the queue is full"""
+        with self._changed:
+            self._prune()
+            if self._count('queued') >= self.max_pending:
+                self._counts['rejected'] += 1
+                raise JobQueueFull(f"{self.max_pending} extraction jobs already waiting")
+
+            job_id = uuid.uuid4().hex
+            self._jobs[job_id] = {
+                'job_id': job_id,
+                'status': 'queued',
+                'description': description,
+                'created_at': time.time(),
+                'started_at': None,
+                'finished_at': None,
+                'result': None,
+                'error': None
+            }
+            self._counts['submitted'] += 1
+
+        self._executor.submit(self._run, job_id, task, on_complete)
+        return job_id
+
+    def _run(self, job_id: str, task: Callable[[], Dict], on_complete: Optional[Callable[[Dict], None]]):
+        """Run one job on a worker thread and record its outcome"""
+        self._update(job_id, status='running', started_at=time.time())
+
+        try:
+            result = task()
+            job = self._update(job_id, status='succeeded', result=result, finished_at=time.time())
+        except Exception as e:
+            logger.error(f"Extraction job {job_id} failed: {str(e)}")
+            job = self._update(job_id, status='failed', error=str(e), finished_at=time.time())
+
+        with self._changed:
+            self._counts[job['status']] += 1
+            self._wait_times.append(job['started_at'] - job['created_at'])
+            self._run_times.append(job['finished_at'] - job['started_at'])
+
+        if on_complete:
+            try:
+                on_complete(job)
+            except Exception as e:
+                logger.error(f"Error in completion callback for job {job_id}: {str(e)}")
+
+    def _update(self, job_id: str, **fields) -> Dict:
+        """Update a job and wake up anyone waiting on it"""
+        with self._changed:
+            job = self._jobs[job_id]
+            job.update(fields)
+            self._changed.notify_all()
+            return dict(job)
+
+    def _count(self, status: str) -> int:
+        return sum(1 for job in self._jobs.values() if job['status'] == status)
+
+    def _prune(self):
+        """Forget finished jobs older than the retention period; caller holds the lock"""
+        cutoff = time.time() - Config.EXTRACTION_JOB_RETENTION_SECONDS
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job['status'] in FINAL_STATUSES and job['finished_at'] < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        """Return a snapshot of a job, or None if it is unknown or expired"""
+        with self._changed:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def wait(self, job_id: str, timeout: float) -> Optional[Dict]:
+        """Block until a job finishes or `timeout` seconds pass, then return its snapshot"""
+        deadline = time.monotonic() + timeout
+        with self._changed:
+            while True:
+                job = self._jobs.get(job_id)
+                remaining = deadline - time.monotonic()
+                if job is None or job['status'] in FINAL_STATUSES or remaining <= 0:
+                    return dict(job) if job else None
+                self._changed.wait(remaining)
+
+    def stats(self) -> Dict:
+        """Queue depth, job counts and wait/run time percentiles of recent jobs"""
+        with self._changed:
+            wait_times = list(self._wait_times)
+            run_times = list(self._run_times)
+            return {
+                'workers': self.max_workers,
+                'max_pending': self.max_pending,
+                'queued': self._count('queued'),
+                'running': self._count('running'),
+                **self._counts,
+                'queue_wait_seconds': {
+                    'p50': round(percentile(wait_times, 50), 3),
+                    'p95': round(percentile(wait_times, 95), 3),
+                    'max': round(max(wait_times), 3) if wait_times else 0.0
+                },
+                'run_seconds': {
+                    'p50': round(percentile(run_times, 50), 3),
+                    'p95': round(percentile(run_times, 95), 3),
+                    'max': round(max(run_times), 3) if run_times else 0.0
+                }
+            }
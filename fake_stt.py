@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Fake Speech-to-Text Server
+Local stand-in for the Sarvam speech-to-text API used for offline voice note tests.
+
+Point the app at it with SARVAM_API_BASE_URL=http://localhost:5004 SARVAM_API_KEY=test
+"""
+
+import time
+import wave
+import random
+import argparse
+import logging
+import threading
+from flask import Flask, request, jsonify
+from config import Config
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+app = Flask(__name__)
+
+# Recorded transcriptions and counters, shared by all request threads
+requests_seen = []
+stats = {"transcribed": 0, "errors": 0}
+state_lock = threading.Lock()
+
+# Injected behaviour, overridable from the command line
+settings = {
+    "latency_ms": Config.FAKE_STT_LATENCY_MS,
+    "jitter_ms": Config.FAKE_STT_JITTER_MS,
+    "error_rate": Config.FAKE_STT_ERROR_RATE,
+    "transcript": "Which item sold the most last week?"
+}
+
+def inject_latency():
+    """Sleep for the configured latency plus random jitter"""
+    delay_ms = settings["latency_ms"] + random.uniform(0, settings["jitter_ms"])
+    if delay_ms > 0:
+        time.sleep(delay_ms / 1000.0)
+
+def wav_duration(audio_file):
+    """Duration in seconds of an uploaded WAV file, or None if it is not WAV"""
+    try:
+        with wave.open(audio_file, 'rb') as audio:
+            return round(audio.getnframes() / audio.getframerate(), 2)
+    except (wave.Error, EOFError):
+        return None
+
+@app.route('/speech-to-text', methods=['POST'])
+def speech_to_text():
+    """Return the configured transcript like Sarvam's speech-to-text API"""
+    if not request.headers.get('api-subscription-key'):
+        return jsonify({"error": {"message": "Missing api-subscription-key header"}}), 403
+
+    audio_file = request.files.get('file')
+    if audio_file is None:
+        return jsonify({"error": {"message": "A 'file' part is required"}}), 400
+
+    inject_latency()
+
+    # Randomly fail with the errors the real API returns under load
+    if random.random() < settings["error_rate"]:
+        with state_lock:
+            stats["errors"] += 1
+        status_code = random.choice([429, 500, 503])
+        return jsonify({"error": {"message": "Injected failure from fake speech-to-text server"}}), status_code
+
+    language_code = request.form.get('language_code', 'unknown')
+    duration = wav_duration(audio_file.stream)
+    with state_lock:
+        requests_seen.append({
+            "file": audio_file.filename,
+            "model": request.form.get('model'),
+            "language_code": language_code,
+            "duration_seconds": duration
+        })
+        stats["transcribed"] += 1
+
+    return jsonify({
+        "transcript": settings["transcript"],
+        "language_code": language_code,
+        "timestamps": None
+    })
+
+@app.route('/stats')
+def get_stats():
+    """Counters and recent requests for the current test"""
+    with state_lock:
+        return jsonify({**stats, "recent": requests_seen[-20:], "settings": settings})
+
+@app.route('/reset', methods=['POST'])
+def reset():
+    """Clear recorded requests and counters"""
+    with state_lock:
+        requests_seen.clear()
+        stats.update({"transcribed": 0, "errors": 0})
+    return jsonify({"success": True})
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run a local fake Sarvam speech-to-text API")
+    parser.add_argument('--port', type=int, default=5004)
+    parser.add_argument('--latency-ms', type=float, default=settings["latency_ms"])
+    parser.add_argument('--jitter-ms', type=float, default=settings["jitter_ms"])
+    parser.add_argument('--error-rate', type=float, default=settings["error_rate"])
+    parser.add_argument('--transcript', default=settings["transcript"], help="Text returned for every chunk")
+    args = parser.parse_args()
+
+    settings.update({
+        "latency_ms": args.latency_ms,
+        "jitter_ms": args.jitter_ms,
+        "error_rate": args.error_rate,
+        "transcript": args.transcript
+    })
+    logger.info(f"Fake speech-to-text server settings: {settings}")
+
+    app.run(host='0.0.0.0', port=args.port, threaded=True)
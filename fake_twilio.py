@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Fake Twilio Server
+Local stand-in for the Twilio Messages REST API used for offline load testing.
+
+Point the app at it with TWILIO_API_BASE_URL=http://localhost:5003
+"""
+
+import time
+import uuid
+import random
+import argparse
+import logging
+import threading
+from datetime import datetime, timezone
+from flask import Flask, request, jsonify
+from config import Config
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+app = Flask(__name__)
+
+# Recorded messages and counters, shared by all request threads
+messages = []
+stats = {"accepted": 0, "errors": 0}
+state_lock = threading.Lock()
+
+# Injected behaviour, overridable from the command line
+settings = {
+    "latency_ms": Config.FAKE_TWILIO_LATENCY_MS,
+    "jitter_ms": Config.FAKE_TWILIO_JITTER_MS,
+    "error_rate": Config.FAKE_TWILIO_ERROR_RATE
+}
+
+def inject_latency():
+    """Sleep for the configured latency plus random jitter"""
+    delay_ms = settings["latency_ms"] + random.uniform(0, settings["jitter_ms"])
+    if delay_ms > 0:
+        time.sleep(delay_ms / 1000.0)
+
+@app.route('/2010-04-01/Accounts/<account_sid>/Messages.json', methods=['POST'])
+def create_message(account_sid):
+    """Record an outbound message like Twilio's Messages API"""
+    inject_latency()
+
+    # Randomly fail with the errors Twilio returns under load
+    if random.random() < settings["error_rate"]:
+        with state_lock:
+            stats["errors"] += 1
+        status_code = random.choice([429, 500, 503])
+        return jsonify({
+            "code": 20429 if status_code == 429 else 20500,
+            "message": "Injected failure from fake Twilio server",
+            "status": status_code
+        }), status_code
+
+    to_number = request.form.get('To')
+    body = request.form.get('Body')
+    if not to_number or not body:
+        return jsonify({
+            "code": 21604,
+            "message": "A 'To' and 'Body' parameter is required",
+            "status": 400
+        }), 400
+
+    message = {
+        "sid": f"SM{uuid.uuid4().hex}",
+        "account_sid": account_sid,
+        "from": request.form.get('From'),
+        "to": to_number,
+        "body": body,
+        "status": "queued",
+        "date_created": datetime.now(timezone.utc).isoformat()
+    }
+    with state_lock:
+        messages.append(message)
+        stats["accepted"] += 1
+
+    return jsonify(message), 201
+
+@app.route('/2010-04-01/Accounts/<account_sid>/Messages.json', methods=['GET'])
+def list_messages(account_sid):
+    """List recorded messages, newest first"""
+    limit = request.args.get('PageSize', 50, type=int)
+    with state_lock:
+        recorded = [m for m in messages if m["account_sid"] == account_sid][-limit:]
+    return jsonify({"messages": list(reversed(recorded))})
+
+@app.route('/stats')
+def get_stats():
+    """Counters for the current load test"""
+    with state_lock:
+        return jsonify({**stats, "recorded": len(messages), "settings": settings})
+
+@app.route('/reset', methods=['POST'])
+def reset():
+    """Clear recorded messages and counters"""
+    with state_lock:
+        messages.clear()
+        stats.update({"accepted": 0, "errors": 0})
+    return jsonify({"success": True})
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run a local fake Twilio Messages API")
+    parser.add_argument('--port', type=int, default=5003)
+    parser.add_argument('--latency-ms', type=float, default=settings["latency_ms"])
+    parser.add_argument('--jitter-ms', type=float, default=settings["jitter_ms"])
+    parser.add_argument('--error-rate', type=float, default=settings["error_rate"])
+    args = parser.parse_args()
+
+    settings.update({
+        "latency_ms": args.latency_ms,
+        "jitter_ms": args.jitter_ms,
+        "error_rate": args.error_rate
+    })
+    logger.info(f"Fake Twilio server settings: {settings}")
+
+    app.run(host='0.0.0.0', port=args.port, threaded=True)
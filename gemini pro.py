@@ -1,7 +1,7 @@
 import google.generativeai as genai
 import json
 import os
-import re
+from invoice_schema import parse_model_json
 
 # --- Configuration ---
 # Configure the API key securely.
@@ -50,16 +50,16 @@ else:
 
     # --- Generate Content ---
     print("Sending request to Gemini...")
-    response = model.generate_content([prompt, uploaded_file])
+    response = model.generate_content(
+        [prompt, uploaded_file],
+        generation_config={'response_mime_type': 'application/json'}
+    )
             
     # --- Process the Response ---
     print("\n--- Gemini Response ---")
     try:
-        # Clean up the response text by removing markdown backticks and 'json' label
-        clean_json_str = re.sub(r'json\s*|\s*', '', response.text.strip(), flags=re.IGNORECASE)
-
-        # Parse the cleaned string into a Python dictionary
-        invoice_data = json.loads(clean_json_str)
+        # Parse the response, repairing markdown fences or truncated output locally
+        invoice_data = parse_model_json(response.text)
 
         print(json.dumps(invoice_data, indent=2))
 
@@ -67,7 +67,7 @@ else:
         print(f"\nSuccessfully extracted Invoice ID: {invoice_data.get('invoice_id')}")
         print(f"Total Amount Due: {invoice_data.get('total_amount')} {invoice_data.get('currency')}")
 
-    except (json.JSONDecodeError, AttributeError) as e:
+    except (ValueError, AttributeError) as e:
         print(f"Error parsing JSON from response: {e}")
         print("Raw response text:")
         print(response.text)
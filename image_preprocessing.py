@@ -0,0 +1,96 @@
+import io
+import math
+import logging
+from typing import Dict, Tuple
+from PIL import Image, ImageOps
+from config import Config
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Output formats supported for re-encoding
+OUTPUT_MIME_TYPES = {
+    'JPEG': 'image/jpeg',
+    'WEBP': 'image/webp'
+}
+
+def preprocessing_signature() -> str:
+    """Describe the active preprocessing settings, used to version cached extractions"""
+    if not Config.INVOICE_IMAGE_PREPROCESS:
+        return 'off'
+    return (
+        f"{Config.INVOICE_IMAGE_MAX_EDGE}:{Config.INVOICE_IMAGE_FORMAT}:"
+        f"{Config.INVOICE_IMAGE_QUALITY}:{int(Config.INVOICE_IMAGE_GRAYSCALE)}"
+    )
+
+def preprocess_invoice_image(image_bytes: bytes, max_edge: int = None, image_format: str = None,
+                             quality: int = None, grayscale: bool = None) -> Tuple[bytes, str, Dict]:
+    """Shrink an invoice photo before it is sent to a vision provider.
+
+    Applies EXIF rotation, downscales so the long edge is at most
+    `max_edge` (decoding JPEGs at reduced scale where possible), then
+    optionally converts to auto-contrasted grayscale, and
+    re-encodes as JPEG or WebP. Returns (bytes, mime_type, stats). The
+    original bytes are returned unchanged if the image cannot be decoded
+    or re-encoding would make it larger.
+    """
+    max_edge = max_edge or Config.INVOICE_IMAGE_MAX_EDGE
+    image_format = (image_format or Config.INVOICE_IMAGE_FORMAT).upper()
+    quality = quality or Config.INVOICE_IMAGE_QUALITY
+    grayscale = Config.INVOICE_IMAGE_GRAYSCALE if grayscale is None else grayscale
+
+    stats = {
+        'original_bytes': len(image_bytes),
+        'processed_bytes': len(image_bytes),
+        'original_size': None,
+        'processed_size': None,
+        'format': None
+    }
+
+    try:
+        if image_format not in OUTPUT_MIME_TYPES:
+            raise ValueError(f"Unsupported output format: {image_format}")
+
+        image = Image.open(io.BytesIO(image_bytes))
+        stats['original_size'] = image.size
+        original_mime = Image.MIME.get(image.format, 'image/jpeg')
+
+        # JPEGs can be decoded at 1/2, 1/4 or 1/8 scale (and straight to grayscale),
+        # so a 12 MP photo is never fully decoded just to be shrunk
+        if image.format == 'JPEG':
+            scale = min(1.0, max_edge / max(image.size))
+            image.draft('L' if grayscale else 'RGB', (math.ceil(image.width * scale), math.ceil(image.height * scale)))
+
+        # Phone cameras store orientation in EXIF instead of rotating pixels
+        image = ImageOps.exif_transpose(image)
+
+        # Palette and alpha images cannot be resampled smoothly, so convert those before resizing
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('L' if grayscale else 'RGB')
+
+        # Downscale first so the grayscale pass only touches the output pixels
+        image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+        if grayscale:
+            image = ImageOps.autocontrast(image.convert('L'), cutoff=1)
+        stats['processed_size'] = image.size
+
+        output = io.BytesIO()
+        if image_format == 'JPEG':
+            image.save(output, format='JPEG', quality=quality, optimize=True)
+        else:
+            image.save(output, format='WEBP', quality=quality, method=4)
+        processed = output.getvalue()
+
+        if len(processed) >= len(image_bytes):
+            # Already compact (e.g. a small scanned PNG); keep the original
+            stats['format'] = 'original'
+            return image_bytes, original_mime, stats
+
+        stats['processed_bytes'] = len(processed)
+        stats['format'] = image_format
+        return processed, OUTPUT_MIME_TYPES[image_format], stats
+
+    except Exception as e:
+        logger.warning(f"Image preprocessing skipped: {str(e)}")
+        return image_bytes, None, stats
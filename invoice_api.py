@@ -1,34 +1,206 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Request, Response, request, jsonify, stream_with_context
+from werkzeug.exceptions import RequestEntityTooLarge
 from werkzeug.utils import secure_filename
-import os
+from tempfile import SpooledTemporaryFile
+import io
+import csv
+import json
+import uuid
+import queue
 import logging
+import threading
+import zipfile
 from config import Config
-from invoice_extractor import InvoiceDataExtractor
+from invoice_extractor import InvoiceDataExtractor, SEARCH_MAX_PER_PAGE
+from extraction_jobs import ExtractionJobQueue, JobQueueFull
+from upload_store import UploadStore
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+class SpooledUploadRequest(Request):
+    """Request that keeps uploaded files in memory up to UPLOAD_SPOOL_MAX_BYTES"""
+    
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return SpooledTemporaryFile(max_size=Config.UPLOAD_SPOOL_MAX_BYTES, mode='rb+')
+    
+    @property
+    def max_content_length(self):
+        # Bulk uploads carry many invoices in one request
+        if self.path == '/upload-invoices':
+            return Config.BULK_UPLOAD_MAX_CONTENT_LENGTH
+        return super().max_content_length
+
 app = Flask(__name__)
+app.request_class = SpooledUploadRequest
 app.config.from_object(Config)
 
 # Configure upload folder
-UPLOAD_FOLDER = 'uploads'
-ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'bmp', 'tiff'}
-
-if not os.path.exists(UPLOAD_FOLDER):
-    os.makedirs(UPLOAD_FOLDER)
+ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'bmp', 'tiff', 'webp'}
 
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+app.config['UPLOAD_FOLDER'] = Config.UPLOAD_STORE_DIR
 
-# Initialize invoice extractor
+# Initialize invoice extractor, the background job pool and the archived upload store
 invoice_extractor = InvoiceDataExtractor()
+extraction_jobs = ExtractionJobQueue()
+upload_store = UploadStore(db_file=invoice_extractor.db_file)
 
 def allowed_file(filename):
     """Check if file extension is allowed"""
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def wants_async():
+    """Check if the caller asked for a background job instead of waiting for extraction"""
+    value = request.values.get('async', '')
+    return value.lower() in ('1', 'true', 'yes')
+
+def wants_archive():
+    """Check if the caller asked for the uploaded file to be kept on disk"""
+    value = request.values.get('archive', '')
+    return value.lower() in ('1', 'true', 'yes')
+
+def read_upload(file, archive=False):
+    """Read an uploaded file from the request buffer.
+
+    Returns (bytes, source_file). The file is only written to disk when
+    archive is requested, under its content hash in the upload store, so
+    duplicates are stored once and same-name uploads never collide.
+    """
+    filename = secure_filename(file.filename)
+    image_bytes = file.stream.read()
+    
+    if not archive:
+        return image_bytes, f"upload:{filename}"
+    
+    return image_bytes, upload_store.store(image_bytes)
+
+def collect_bulk_sources(files):
+    """Build (name, loader) sources from uploaded images and zip archives.
+
+    Returns (sources, ignored). Loaders read from the request's spooled
+    files on demand, so they must run before the request is closed.
+    Names are made unique within the upload. Zip members larger than
+    MAX_CONTENT_LENGTH uncompressed are ignored, so a small archive
+    cannot expand into an unbounded read.
+    """
+    sources = []
+    ignored = []
+    names = set()
+    
+    def unique_name(name):
+        candidate, counter = name, 1
+        while candidate in names:
+            counter += 1
+            candidate = f"{name}~{counter}"
+        names.add(candidate)
+        return candidate
+    
+    def make_upload_loader(stream):
+        def load():
+            stream.seek(0)
+            return stream.read()
+        return load
+    
+    def make_zip_loader(stream, lock, member):
+        def load():
+            # Members of one archive share its stream, so reads take turns
+            with lock:
+                stream.seek(0)
+                with zipfile.ZipFile(stream) as archive, archive.open(member) as member_file:
+                    # Cap the read too, in case the member's header understates its size
+                    data = member_file.read(Config.MAX_CONTENT_LENGTH + 1)
+            if len(data) > Config.MAX_CONTENT_LENGTH:
+                raise ValueError(f"{member} is larger than {Config.MAX_CONTENT_LENGTH} bytes uncompressed")
+            return data
+        return load
+    
+    for file in files:
+        filename = secure_filename(file.filename) or 'upload'
+        
+        if zipfile.is_zipfile(file.stream):
+            lock = threading.Lock()
+            file.stream.seek(0)
+            with zipfile.ZipFile(file.stream) as archive:
+                for info in archive.infolist():
+                    if info.is_dir():
+                        continue
+                    if info.file_size > Config.MAX_CONTENT_LENGTH:
+                        ignored.append(f"{filename}/{info.filename}")
+                    elif allowed_file(info.filename):
+                        name = unique_name(f"{filename}/{info.filename}")
+                        sources.append((name, make_zip_loader(file.stream, lock, info.filename)))
+                    else:
+                        ignored.append(f"{filename}/{info.filename}")
+        elif allowed_file(filename):
+            sources.append((unique_name(filename), make_upload_loader(file.stream)))
+        else:
+            ignored.append(filename)
+    
+    return sources, ignored
+
+def sse_event(event, data):
+    """Format one server-sent event with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+def stream_ndjson(columns, batches):
+    """Yield query rows as newline-delimited JSON, one chunk per batch"""
+    try:
+        for rows in batches:
+            yield ''.join(json.dumps(dict(zip(columns, row)), default=str) + '\n' for row in rows)
+    except Exception as e:
+        logger.error(f"Error streaming invoice export: {str(e)}")
+        yield json.dumps({"error": str(e)}) + '\n'
+
+def stream_csv(columns, batches):
+    """Yield query rows as CSV with a header row, one chunk per batch"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    try:
+        for rows in batches:
+            writer.writerows(rows)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+    except Exception as e:
+        # A CSV body has no way to carry the error; the export just ends early
+        logger.error(f"Error streaming invoice export: {str(e)}")
+    if buffer.tell():
+        yield buffer.getvalue()
+
+EXPORT_FORMATS = {
+    'ndjson': ('application/x-ndjson', stream_ndjson),
+    'csv': ('text/csv', stream_csv)
+}
+
+def process_invoice_upload(image_bytes, source_file):
+    """Extract an uploaded invoice and save it with its extraction record"""
+    extraction = invoice_extractor.extract_record(image_bytes, source_file)
+    invoice_data = extraction['processed_data'] if extraction else None
+    
+    if not invoice_data:
+        raise Exception("Failed to extract invoice data")
+    
+    # Save the invoice and its extraction record in one transaction
+    invoice_id = invoice_extractor.save_invoice_bundle(invoice_data, extraction)
+    
+    if not invoice_id:
+        raise Exception("Failed to save invoice to database")
+    
+    return {
+        "invoice_id": invoice_id,
+        "extracted_data": invoice_data,
+        "confidence": extraction.get('confidence'),
+        "validation_issues": extraction.get('validation_issues') or []
+    }
+
+@app.errorhandler(RequestEntityTooLarge)
+def upload_too_large(e):
+    """Return a JSON error when an upload exceeds MAX_CONTENT_LENGTH"""
+    return jsonify({"error": f"File too large (limit {request.max_content_length} bytes)"}), 413
+
 @app.route('/')
 def home():
     """Home page with API information"""
@@ -37,8 +209,15 @@ def home():
         "status": "running",
         "endpoints": {
             "upload": "/upload-invoice",
+            "bulk_upload": "/upload-invoices",
             "query": "/query-invoices",
+            "export": "/export-invoices?format=ndjson|csv&query=...|table=...",
+            "search": "/search-invoices?q=...",
             "summary": "/invoice-summary",
+            "provider_stats": "/provider-stats",
+            "jobs": "/jobs/<job_id>?wait=<seconds>",
+            "job_stats": "/job-stats",
+            "upload_store": "/upload-store-stats",
             "health": "/health"
         }
     })
@@ -66,61 +245,219 @@ def upload_invoice():
         if not allowed_file(file.filename):
             return jsonify({"error": "File type not allowed"}), 400
         
-        # Save file
-        filename = secure_filename(file.filename)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
+        # Read the upload from memory; only archive to disk on request
+        image_bytes, source_file = read_upload(file, archive=wants_archive())
         
-        logger.info(f"File uploaded: {filename}")
+        logger.info(f"File uploaded: {source_file} ({len(image_bytes)} bytes)")
         
-        # Extract invoice data
-        invoice_data = invoice_extractor.extract_from_image(filepath)
+        # Job mode: hand extraction to the worker pool and return straight away
+        if wants_async():
+            job_id = extraction_jobs.submit(
+                lambda: process_invoice_upload(image_bytes, source_file),
+                description=source_file
+            )
+            return jsonify({
+                "success": True,
+                "message": "Invoice accepted for extraction",
+                "job_id": job_id,
+                "status": "queued",
+                "status_url": f"/jobs/{job_id}"
+            }), 202
         
-        if not invoice_data:
-            return jsonify({"error": "Failed to extract invoice data"}), 500
-        
-        # Save to database
-        invoice_id = invoice_extractor.save_invoice_to_database(invoice_data)
-        
-        if not invoice_id:
-            return jsonify({"error": "Failed to save invoice to database"}), 500
+        result = process_invoice_upload(image_bytes, source_file)
         
         return jsonify({
             "success": True,
             "message": "Invoice data extracted and saved successfully",
-            "invoice_id": invoice_id,
-            "extracted_data": invoice_data
+            **result
         })
         
+    except JobQueueFull as e:
+        return jsonify({"error": str(e)}), 503
+    except RequestEntityTooLarge:
+        raise
     except Exception as e:
         logger.error(f"Error processing invoice upload: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/upload-invoices', methods=['POST'])
+def upload_invoices():
+    """Upload many invoice images or zip archives and stream per-file progress.
+
+    Files are extracted concurrently and saved in small groups. The
+    response is a text/event-stream: a `start` event, an `extracted`
+    event as each file's extraction finishes, a `saved` event once its
+    invoice is stored, then `done` with the batch summary. Posting again
+    with the same batch_id skips files that already completed.
+    """
+    try:
+        files = [file for file in request.files.getlist('files') + request.files.getlist('file') if file.filename]
+        
+        if not files:
+            return jsonify({"error": "No files provided"}), 400
+        
+        sources, ignored = collect_bulk_sources(files)
+        
+        if not sources:
+            return jsonify({"error": "No invoice images found", "ignored": ignored}), 400
+        
+        if len(sources) > Config.BULK_UPLOAD_MAX_FILES:
+            return jsonify({"error": f"Too many files ({len(sources)}, limit {Config.BULK_UPLOAD_MAX_FILES})"}), 400
+        
+        batch_id = secure_filename(request.values.get('batch_id', '')) or f"upload-{uuid.uuid4().hex}"
+        archive = wants_archive()
+        
+    except RequestEntityTooLarge:
+        raise
+    except Exception as e:
+        logger.error(f"Error reading bulk invoice upload: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+    
+    logger.info(f"Bulk upload {batch_id}: {len(sources)} images, {len(ignored)} ignored")
+    events = queue.Queue()
+    
+    def run_batch():
+        try:
+            summary = invoice_extractor.extract_sources(
+                sources,
+                batch_id,
+                group_size=Config.BULK_UPLOAD_GROUP_SIZE,
+                progress=lambda result: events.put(('saved', result)),
+                on_extracted=lambda result: events.put(('extracted', result)),
+                source_file=(lambda name, image_bytes: upload_store.store(image_bytes)) if archive else None
+            )
+            summary.pop('results', None)
+            events.put(('done', summary))
+        except Exception as e:
+            logger.error(f"Error processing bulk upload {batch_id}: {str(e)}")
+            events.put(('error', {"error": str(e)}))
+        finally:
+            events.put(None)
+    
+    def generate():
+        worker = threading.Thread(target=run_batch, name=f"bulk-upload-{batch_id}", daemon=True)
+        worker.start()
+        try:
+            yield sse_event('start', {"batch_id": batch_id, "files": len(sources), "ignored": ignored})
+            while True:
+                try:
+                    event = events.get(timeout=Config.BULK_UPLOAD_KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    # Comment line keeps proxies from timing out an idle stream
+                    yield ": keepalive\n\n"
+                    continue
+                if event is None:
+                    break
+                yield sse_event(*event)
+        finally:
+            # The loaders read the request's files, so keep it open until the batch
+            # finishes, even if the client disconnected
+            worker.join()
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 @app.route('/query-invoices', methods=['POST'])
 def query_invoices():
-    """Query invoice data using natural language"""
+    """Query invoice data using natural language, one page at a time.
+
+    Pass the returned next_cursor (with or without the query) to fetch the
+    next page; it is null on the last page.
+    """
     try:
         data = request.get_json()
-        if not data or 'query' not in data:
+        if not data or not (data.get('query') or data.get('cursor')):
             return jsonify({"error": "Missing 'query' parameter"}), 400
         
-        query = data['query']
+        query = data.get('query')
         logger.info(f"Processing query: {query}")
         
+        per_page = data.get('per_page')
+        if per_page is not None:
+            try:
+                per_page = int(per_page)
+            except (TypeError, ValueError):
+                return jsonify({"error": "'per_page' must be an integer"}), 400
+        
         # Query invoice data
-        results = invoice_extractor.query_invoice_data(query)
+        page = invoice_extractor.query_invoice_page(
+            query,
+            cursor=data.get('cursor'),
+            per_page=per_page
+        )
         
         return jsonify({
             "success": True,
             "query": query,
-            "results": results,
-            "count": len(results)
+            **page
         })
         
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         logger.error(f"Error querying invoices: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/export-invoices', methods=['GET', 'POST'])
+def export_invoices():
+    """Stream all rows of a natural language query or a table as NDJSON or CSV"""
+    try:
+        values = request.get_json(silent=True) or request.values
+        export_format = values.get('format', 'ndjson').lower()
+        query = values.get('query')
+        table = values.get('table')
+        
+        if export_format not in EXPORT_FORMATS:
+            return jsonify({"error": f"Unsupported format: {export_format}"}), 400
+        
+        if not (query or table):
+            return jsonify({"error": "Missing 'query' or 'table' parameter"}), 400
+        
+        logger.info(f"Exporting invoices as {export_format}: {query or table}")
+        
+        columns, batches = invoice_extractor.export_invoice_rows(query=query, table=table)
+        mimetype, stream = EXPORT_FORMATS[export_format]
+        
+        return Response(
+            stream(columns, batches),
+            mimetype=mimetype,
+            headers={
+                'Content-Disposition': f'attachment; filename="{secure_filename(table or "invoice-query")}.{export_format}"',
+                'X-Accel-Buffering': 'no'
+            }
+        )
+        
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error exporting invoices: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/search-invoices')
+def search_invoices():
+    """Full-text search over invoices and line items, ranked and paginated"""
+    try:
+        query = request.args.get('q', '').strip()
+        if not query:
+            return jsonify({"error": "Missing 'q' parameter"}), 400
+        
+        page = max(request.args.get('page', 1, type=int), 1)
+        per_page = min(max(request.args.get('per_page', 20, type=int), 1), SEARCH_MAX_PER_PAGE)
+        
+        results = invoice_extractor.search_invoices(query, page=page, per_page=per_page)
+        
+        return jsonify({
+            "success": True,
+            **results
+        })
+        
+    except Exception as e:
+        logger.error(f"Error searching invoices: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/invoice-summary')
 def invoice_summary():
     """Get invoice summary statistics"""
@@ -136,6 +473,51 @@ def invoice_summary():
         logger.error(f"Error getting invoice summary: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/provider-stats')
+def provider_stats():
+    """Get extraction win/loss and latency statistics per provider"""
+    try:
+        return jsonify({
+            "success": True,
+            "mode": Config.EXTRACTION_MODE,
+            "hedge_delay_seconds": Config.EXTRACTION_HEDGE_DELAY_SECONDS,
+            "providers": invoice_extractor.get_provider_stats()
+        })
+        
+    except Exception as e:
+        logger.error(f"Error getting provider stats: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/jobs/<job_id>')
+def get_job(job_id):
+    """Get an extraction job's status and result, optionally waiting for it to finish"""
+    wait = min(request.args.get('wait', 0, type=float), Config.EXTRACTION_JOB_MAX_WAIT_SECONDS)
+    
+    if wait > 0:
+        job = extraction_jobs.wait(job_id, wait)
+    else:
+        job = extraction_jobs.get(job_id)
+    
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    
+    return jsonify({"success": True, **job})
+
+@app.route('/job-stats')
+def job_stats():
+    """Get extraction job queue depth and latency statistics"""
+    return jsonify({"success": True, "jobs": extraction_jobs.stats()})
+
+@app.route('/upload-store-stats')
+def upload_store_stats():
+    """Get archived upload store size and reference statistics"""
+    try:
+        return jsonify({"success": True, "upload_store": upload_store.stats()})
+        
+    except Exception as e:
+        logger.error(f"Error getting upload store stats: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/extract-text', methods=['POST'])
 def extract_text():
     """Extract text from image without saving to database"""
@@ -154,18 +536,13 @@ def extract_text():
         if not allowed_file(file.filename):
             return jsonify({"error": "File type not allowed"}), 400
         
-        # Save file temporarily
-        filename = secure_filename(file.filename)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
+        # Read the upload from memory; only archive to disk on request
+        image_bytes, source_file = read_upload(file, archive=wants_archive())
         
-        logger.info(f"Extracting text from: {filename}")
+        logger.info(f"Extracting text from: {source_file}")
         
         # Extract invoice data (without saving to database)
-        invoice_data = invoice_extractor.extract_from_image(filepath)
-        
-        # Clean up temporary file
-        os.remove(filepath)
+        invoice_data = invoice_extractor.extract_from_bytes(image_bytes, source_file)
         
         if not invoice_data:
             return jsonify({"error": "Failed to extract invoice data"}), 500
@@ -176,6 +553,8 @@ def extract_text():
             "extracted_data": invoice_data
         })
         
+    except RequestEntityTooLarge:
+        raise
     except Exception as e:
         logger.error(f"Error extracting text: {str(e)}")
         return jsonify({"error": str(e)}), 500
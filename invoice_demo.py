@@ -83,9 +83,14 @@ def demo_invoice_extraction():
     # Demo 4: Show API endpoints
     print("4. Available API Endpoints:")
     print("   POST /upload-invoice - Upload and extract invoice")
-    print("   POST /query-invoices - Query with natural language")
+    print("   POST /upload-invoices - Upload many invoices or a zip, with streamed progress")
+    print("   POST /query-invoices - Query with natural language (paginated)")
+    print("   GET  /export-invoices?format=csv&table=invoices - Stream a full export")
     print("   GET  /invoice-summary - Get summary statistics")
     print("   POST /extract-text - Extract without saving")
+    print("   GET  /search-invoices?q=... - Full-text search")
+    print("   GET  /jobs/<job_id>?wait=30 - Background extraction job status")
+    print("   GET  /job-stats - Job queue depth and latency")
     print()
     
     # Demo 5: Show query examples
@@ -163,6 +168,30 @@ def demo_api_usage():
     print("   curl -X POST http://localhost:5002/extract-text \\")
     print("     -F 'file=@invoice.jpg'")
     print()
+    
+    print("5. Keep the Uploaded Image on Disk:")
+    print("   curl -X POST http://localhost:5002/upload-invoice \\")
+    print("     -F 'file=@invoice.jpg' -F 'archive=true'")
+    print()
+    
+    print("6. Extract in the Background and Poll the Job:")
+    print("   curl -X POST http://localhost:5002/upload-invoice \\")
+    print("     -F 'file=@invoice.jpg' -F 'async=true'")
+    print("   curl 'http://localhost:5002/jobs/<job_id>?wait=30'")
+    print()
+    
+    print("7. Upload Many Invoices and Stream Progress:")
+    print("   curl -N -X POST http://localhost:5002/upload-invoices \\")
+    print("     -F 'files=@invoice1.jpg' -F 'files=@invoice2.jpg' -F 'files=@invoices.zip'")
+    print()
+    
+    print("8. Page Through Query Results and Export Them:")
+    print("   curl -X POST http://localhost:5002/query-invoices \\")
+    print("     -H 'Content-Type: application/json' \\")
+    print("     -d '{\"cursor\": \"<next_cursor from the previous page>\"}'")
+    print("   curl -G http://localhost:5002/export-invoices \\")
+    print("     --data-urlencode 'format=csv' --data-urlencode 'query=All unpaid invoices' -o unpaid.csv")
+    print()
 
 if __name__ == "__main__":
     demo_invoice_extraction()
@@ -1,17 +1,175 @@
 import os
+import re
 import json
+import time
+import uuid
+import hmac
+import base64
+import hashlib
 import logging
 import sqlite3
-from datetime import datetime
-from typing import Dict, List, Optional
+import zipfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
 import google.generativeai as genai
 from openai import OpenAI
 from config import Config
+from image_preprocessing import preprocess_invoice_image, preprocessing_signature
+from invoice_schema import (
+    EXTRACTION_PROMPT, invoice_gemini_schema, openai_response_format, parse_model_json, normalize_invoice_shape
+)
+from invoice_validation import validate_invoice, build_field_prompt, apply_field_corrections
+from payload_codec import compress_payload, decompress_payload, is_compressed_payload, load_json_payload
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Models used for extraction
+GEMINI_MODEL_NAME = 'gemini-pro'
+OPENAI_MODEL_NAME = 'gpt-4o-mini'
+
+# Bump whenever the prompt or expected output changes so cached extractions are not reused
+PROMPT_VERSION = '3'
+EXTRACTION_VERSION = f"{PROMPT_VERSION}:{GEMINI_MODEL_NAME}:{OPENAI_MODEL_NAME}"
+
+# Gemini 1.0 models reject response_schema and JSON response mode
+GEMINI_STRUCTURED_OUTPUT = GEMINI_MODEL_NAME not in ('gemini-pro', 'gemini-pro-vision') and '1.0' not in GEMINI_MODEL_NAME
+
+def gemini_generation_config(schema: bool = True) -> Optional[Dict]:
+    """Generation config asking Gemini for JSON (schema-shaped if `schema`), when the model supports it"""
+    if not (Config.EXTRACTION_STRUCTURED_OUTPUT and GEMINI_STRUCTURED_OUTPUT):
+        return None
+    if not schema:
+        return {'response_mime_type': 'application/json'}
+    return {'response_mime_type': 'application/json', 'response_schema': invoice_gemini_schema()}
+
+# Columns of the invoice_search full-text index and their bm25 weights
+SEARCH_COLUMN_WEIGHTS = {
+    'customer_name': 10.0,
+    'customer_address': 2.0,
+    'notes': 1.0,
+    'item_names': 5.0,
+    'item_descriptions': 1.0
+}
+SEARCH_COLUMNS = list(SEARCH_COLUMN_WEIGHTS)
+SEARCH_TERM_PATTERN = re.compile(r"\w+", re.UNICODE)
+SEARCH_MAX_PER_PAGE = 100
+
+# Tables and columns described to the model for natural language queries
+QUERYABLE_TABLES = ['invoices', 'invoice_items', 'extracted_data']
+QUERY_HIDDEN_COLUMNS = {'raw_data', 'processed_data', 'cache_key', 'content_hash', 'last_accessed'}
+
+# Generated SQL must be a single read statement
+READ_QUERY_PATTERN = re.compile(r"^\s*(SELECT|WITH)\b[^;]*;?\s*$", re.IGNORECASE)
+
+# Ids bound per IN (...) list, below SQLite's 999 variable limit on older builds
+SQLITE_MAX_BOUND_IDS = 500
+
+def normalize_question(question: str) -> str:
+    """Normalize a question for the SQL cache: lowercase, single spaces, no trailing punctuation"""
+    return ' '.join(question.lower().split()).rstrip('?.! ')
+
+def clean_generated_sql(text: str) -> str:
+    """Strip markdown fences and whitespace from model-generated SQL"""
+    text = text.strip()
+    if text.startswith('```'):
+        text = text.split('\n', 1)[1] if '\n' in text else ''
+        text = text.rsplit('```', 1)[0]
+    return text.strip()
+
+def encode_query_cursor(sql_query: str, offset: int) -> str:
+    """Opaque, signed cursor for the next page of a generated query.
+
+    The cursor carries the SQL itself, so later pages never regenerate it,
+    and the signature stops clients from running SQL of their own.
+    """
+    payload = json.dumps({'sql': sql_query, 'offset': offset}, separators=(',', ':')).encode()
+    signature = hmac.new(Config.SECRET_KEY.encode(), payload, hashlib.sha256).digest()[:16]
+    return base64.urlsafe_b64encode(signature + payload).decode().rstrip('=')
+
+def decode_query_cursor(cursor: str) -> Tuple[str, int]:
+    """Return (sql_query, offset) from a cursor; raises ValueError if it is invalid"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        signature, payload = raw[:16], raw[16:]
+        expected = hmac.new(Config.SECRET_KEY.encode(), payload, hashlib.sha256).digest()[:16]
+        if not hmac.compare_digest(signature, expected):
+            raise ValueError("bad signature")
+        data = json.loads(payload)
+        return data['sql'], int(data['offset'])
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {str(e)}")
+
+def guess_image_mime_type(image_bytes: bytes) -> str:
+    """Guess an image MIME type from its leading bytes"""
+    if image_bytes.startswith(b'\x89PNG'):
+        return 'image/png'
+    if image_bytes.startswith(b'GIF8'):
+        return 'image/gif'
+    if image_bytes.startswith(b'BM'):
+        return 'image/bmp'
+    if image_bytes[:4] in (b'II*\x00', b'MM\x00*'):
+        return 'image/tiff'
+    if image_bytes[:4] == b'RIFF' and image_bytes[8:12] == b'WEBP':
+        return 'image/webp'
+    return 'image/jpeg'
+
+# Image types accepted for extraction
+IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'bmp', 'tiff', 'webp'}
+
+def is_invoice_image(filename: str) -> bool:
+    """Check if a file name has an accepted image extension"""
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in IMAGE_EXTENSIONS
+
+def list_invoice_images(path: str) -> List[Tuple[str, Callable[[], bytes]]]:
+    """List (name, loader) pairs for invoice images in a directory or zip archive.
+
+    Loaders read the bytes on demand so a large batch is never held in
+    memory at once.
+    """
+    sources = []
+    
+    if zipfile.is_zipfile(path):
+        def make_zip_loader(member):
+            def load():
+                # Separate handle per read so loaders can run on worker threads
+                with zipfile.ZipFile(path) as archive:
+                    return archive.read(member)
+            return load
+        
+        with zipfile.ZipFile(path) as archive:
+            for info in archive.infolist():
+                if not info.is_dir() and is_invoice_image(info.filename):
+                    sources.append((info.filename, make_zip_loader(info.filename)))
+    
+    elif os.path.isdir(path):
+        def make_file_loader(file_path):
+            def load():
+                with open(file_path, 'rb') as image_file:
+                    return image_file.read()
+            return load
+        
+        for root, _, files in os.walk(path):
+            for filename in files:
+                if is_invoice_image(filename):
+                    file_path = os.path.join(root, filename)
+                    sources.append((os.path.relpath(file_path, path), make_file_loader(file_path)))
+    
+    else:
+        raise ValueError(f"{path} is neither a directory nor a zip archive")
+    
+    return sorted(sources, key=lambda source: source[0])
+
+def compute_cache_key(image_bytes: bytes) -> str:
+    """Cache key for an image: SHA-256 of its bytes plus the prompt, model and preprocessing versions"""
+    digest = hashlib.sha256(image_bytes)
+    digest.update(b'\0' + f"{EXTRACTION_VERSION}:{preprocessing_signature()}".encode('utf-8'))
+    return digest.hexdigest()
+
 class InvoiceDataExtractor:
     def __init__(self):
         self.gemini_api_key = Config.GEMINI_API_KEY
@@ -20,15 +178,30 @@ class InvoiceDataExtractor:
         # Initialize Gemini
         if self.gemini_api_key:
             genai.configure(api_key=self.gemini_api_key)
-            self.gemini_model = genai.GenerativeModel('gemini-pro')
+            self.gemini_model = genai.GenerativeModel(GEMINI_MODEL_NAME)
         else:
             self.gemini_model = None
             
         # Initialize OpenAI
         self.openai_client = OpenAI(api_key=self.openai_api_key) if self.openai_api_key else None
         
-        # Database file
+        # Threads for hedged provider calls
+        self._hedge_executor = ThreadPoolExecutor(
+            max_workers=Config.EXTRACTION_HEDGE_MAX_WORKERS, thread_name_prefix='extract-hedge'
+        )
+        
+        # Database file and the connection reused for writes
         self.db_file = 'invoice_data.db'
+        self._conn = None
+        self._db_lock = threading.RLock()
+        self._cache_writes = 0
+        self.search_enabled = False
+        
+        # Natural language query state: schema text, SQL per question and read-only connections per thread
+        self._query_schema = None
+        self._sql_cache = OrderedDict()
+        self._sql_cache_lock = threading.Lock()
+        self._read_local = threading.local()
         self.create_invoice_database()
     
     def create_invoice_database(self):
@@ -37,6 +210,9 @@ class InvoiceDataExtractor:
             conn = sqlite3.connect(self.db_file)
             cursor = conn.cursor()
             
+            # WAL lets extraction workers write while batches and queries run
+            cursor.execute('PRAGMA journal_mode=WAL')
+            
             # Create invoices table
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS invoices (
@@ -76,7 +252,8 @@ class InvoiceDataExtractor:
                 )
             ''')
             
-            # Create extracted_data table for raw extraction results
+            # Create extracted_data table for raw extraction results; raw_data and
+            # processed_data hold compressed blobs (see payload_codec), or text in older rows
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS extracted_data (
                     id TEXT PRIMARY KEY,
@@ -86,7 +263,88 @@ class InvoiceDataExtractor:
                     processed_data TEXT,
                     confidence_score REAL,
                     extraction_date TEXT DEFAULT CURRENT_TIMESTAMP,
-                    status TEXT DEFAULT 'pending'
+                    status TEXT DEFAULT 'pending',
+                    content_hash TEXT,
+                    cache_key TEXT,
+                    last_accessed TEXT,
+                    original_bytes INTEGER,
+                    uploaded_bytes INTEGER,
+                    latency_ms REAL,
+                    hedge_outcome TEXT,
+                    validation_issues TEXT
+                )
+            ''')
+            
+            # Databases created before the cache, upload, latency and validation columns existed lack them
+            self._add_missing_columns(cursor, 'extracted_data', {
+                'content_hash': 'TEXT',
+                'cache_key': 'TEXT',
+                'last_accessed': 'TEXT',
+                'original_bytes': 'INTEGER',
+                'uploaded_bytes': 'INTEGER',
+                'latency_ms': 'REAL',
+                'hedge_outcome': 'TEXT',
+                'validation_issues': 'TEXT'
+            })
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_extracted_data_cache_key ON extracted_data (cache_key)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_extracted_data_source_file ON extracted_data (source_file)')
+            # Lets eviction walk cache entries in recency order instead of sorting the table
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_extracted_data_cache_recency
+                ON extracted_data (COALESCE(last_accessed, extraction_date))
+                WHERE cache_key IS NOT NULL
+            ''')
+            
+            # Summary counters, kept current by _insert_invoices in the same transaction
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS invoice_summary (
+                    id INTEGER PRIMARY KEY CHECK (id = 1),
+                    total_invoices INTEGER NOT NULL DEFAULT 0,
+                    total_amount REAL NOT NULL DEFAULT 0
+                )
+            ''')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS invoice_status_counts (
+                    payment_status TEXT PRIMARY KEY,
+                    invoice_count INTEGER NOT NULL DEFAULT 0
+                ) WITHOUT ROWID
+            ''')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_invoices_invoice_date ON invoices (invoice_date)')
+            
+            # Databases created before the summary tables existed need one full scan to seed them
+            cursor.execute("SELECT 1 FROM invoice_summary WHERE id = 1")
+            if cursor.fetchone() is None:
+                self.rebuild_invoice_summary(cursor)
+            
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_invoice_items_invoice_id ON invoice_items (invoice_id)')
+            
+            # Full-text index with one document per invoice, kept current by _insert_invoices
+            try:
+                cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'invoice_search'")
+                search_exists = cursor.fetchone() is not None
+                cursor.execute(f'''
+                    CREATE VIRTUAL TABLE IF NOT EXISTS invoice_search USING fts5(
+                        invoice_id UNINDEXED, {', '.join(SEARCH_COLUMNS)},
+                        tokenize = 'unicode61 remove_diacritics 2'
+                    )
+                ''')
+                if not search_exists:
+                    self.rebuild_search_index(cursor)
+                self.search_enabled = True
+            except sqlite3.OperationalError as e:
+                logger.warning(f"Invoice search disabled, SQLite FTS5 is unavailable: {str(e)}")
+            
+            # Create batch_files table to track batch extraction progress for resume
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS batch_files (
+                    batch_id TEXT,
+                    file_name TEXT,
+                    status TEXT,
+                    invoice_id TEXT REFERENCES invoices(id),
+                    error TEXT,
+                    duration_seconds REAL,
+                    processed_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (batch_id, file_name)
                 )
             ''')
             
@@ -97,183 +355,499 @@ class InvoiceDataExtractor:
         except Exception as e:
             logger.error(f"Error creating invoice database: {str(e)}")
     
+    def _add_missing_columns(self, cursor, table: str, columns: Dict[str, str]):
+        """Add any of the given columns that an existing table does not have yet"""
+        cursor.execute(f'PRAGMA table_info({table})')
+        existing = {row[1] for row in cursor.fetchall()}
+        for name, column_type in columns.items():
+            if name not in existing:
+                cursor.execute(f'ALTER TABLE {table} ADD COLUMN {name} {column_type}')
+    
     def extract_from_image(self, image_path: str) -> Dict:
-        """Extract invoice data from image using Gemini"""
+        """Extract invoice data from an image file"""
         try:
-            if not self.gemini_model:
-                raise Exception("Gemini API key not configured")
-            
-            # Load image
-            image = genai.types.Image.from_file(image_path)
-            
-            # Create prompt for invoice extraction
-            prompt = """
-            Extract invoice data from this image and return it in the following JSON format:
-            {
-                "invoice_number": "string",
-                "invoice_date": "YYYY-MM-DD",
-                "due_date": "YYYY-MM-DD",
-                "customer_name": "string",
-                "customer_email": "string",
-                "customer_phone": "string",
-                "customer_address": "string",
-                "total_amount": number,
-                "tax_amount": number,
-                "discount_amount": number,
-                "subtotal": number,
-                "currency": "string",
-                "payment_status": "string",
-                "payment_method": "string",
-                "notes": "string",
-                "items": [
-                    {
-                        "item_name": "string",
-                        "description": "string",
-                        "quantity": number,
-                        "unit_price": number,
-                        "total_price": number,
-                        "tax_rate": number,
-                        "discount_rate": number
-                    }
-                ]
-            }
-            
-            Extract all available information. If any field is not found, use null or empty string.
-            """
+            with open(image_path, 'rb') as image_file:
+                image_bytes = image_file.read()
+        except Exception as e:
+            logger.error(f"Error reading invoice image {image_path}: {str(e)}")
+            return {}
+        
+        return self.extract_from_bytes(image_bytes, image_path)
+    
+    def extract_from_bytes(self, image_bytes: bytes, source_file: str = None) -> Dict:
+        """Extract invoice data from image bytes and store the extraction record"""
+        record = self.extract_record(image_bytes, source_file)
+        if record is None:
+            return {}
+        
+        self.store_extraction_record(record)
+        return record['processed_data']
+    
+    def extract_record(self, image_bytes: bytes, source_file: str = None) -> Optional[Dict]:
+        """Extract invoice data without persisting it.
+
+        Returns an extraction record (the store_extracted_data fields) that
+        can be saved together with its invoice by save_invoices, or None if
+        every provider failed. Cache hits are marked with 'cached'.
+        """
+        cache_key = compute_cache_key(image_bytes)
+        content_hash = hashlib.sha256(image_bytes).hexdigest()
+        
+        cached = self.get_cached_extraction(cache_key)
+        if cached is not None:
+            logger.info(f"Extraction cache hit for {source_file or content_hash[:12]}")
+            return {'cached': True, 'source_file': source_file, 'processed_data': cached, 'cache_key': cache_key}
+        
+        # Shrink the image once; both providers receive the same payload
+        upload_bytes, mime_type = self.prepare_image(image_bytes, source_file)
+        
+        record_info = {
+            'source_file': source_file,
+            'cache_key': cache_key,
+            'content_hash': content_hash,
+            'original_bytes': len(image_bytes),
+            'uploaded_bytes': len(upload_bytes)
+        }
+        providers = self._available_providers()
+        if Config.EXTRACTION_MODE == 'hedged' and len(providers) > 1:
+            result = self._extract_hedged(providers, upload_bytes, mime_type, source_file)
+        else:
+            result = self._extract_sequential(providers, upload_bytes, mime_type)
+        
+        if result is None:
+            return None
+        result = self.validate_result(result, upload_bytes, mime_type, source_file)
+        return {**record_info, **result}
+    
+    def validate_result(self, result: Dict, image_bytes: bytes, mime_type: str, source_file: str = None) -> Dict:
+        """Check a provider result's arithmetic, score it and re-read only the failing fields.
+
+        The confidence score comes from validate_invoice. If a check fails
+        and INVOICE_FIELD_REEXTRACTION is on, the same provider is asked for
+        just the implicated fields with a short prompt; the corrections are
+        kept only if they raise the score. Remaining issues are attached as
+        'validation_issues'.
+        """
+        report = validate_invoice(result['processed_data'])
+        
+        if report['failed_fields'] and Config.INVOICE_FIELD_REEXTRACTION:
+            logger.info(f"Validation failed for {source_file or 'extraction'}: {report['issues']}; "
+                        f"re-reading {report['failed_fields']}")
+            try:
+                prompt = build_field_prompt(result['processed_data'], report['failed_fields'], report['issues'])
+                extract = self._extract_with_gemini if result['method'] == 'gemini' else self._extract_with_openai
+                corrections = extract(image_bytes, mime_type, prompt=prompt)['processed_data']
+                
+                corrected = apply_field_corrections(result['processed_data'], corrections, report['failed_fields'])
+                corrected_report = validate_invoice(corrected)
+                if corrected_report['confidence'] > report['confidence']:
+                    result = {**result, 'processed_data': corrected}
+                    report = corrected_report
+                    
+            except Exception as e:
+                logger.error(f"Error re-extracting fields with {result['method']}: {str(e)}")
+        
+        result = {**result, 'confidence': report['confidence']}
+        result['validation_issues'] = report['issues'] or None
+        return result
+    
+    def _available_providers(self) -> List[Tuple[str, Callable]]:
+        """Configured providers, primary first"""
+        providers = []
+        if self.gemini_model:
+            providers.append(('gemini', self._extract_with_gemini))
+        if self.openai_client:
+            providers.append(('openai', self._extract_with_openai))
+        
+        if Config.EXTRACTION_PRIMARY_PROVIDER == 'openai':
+            providers.reverse()
+        return providers
+    
+    def _run_provider(self, name: str, extract: Callable, image_bytes: bytes, mime_type: str) -> Dict:
+        """Run one provider and time it; failures are returned with an 'error' key.
+
+        A response that is not an invoice object counts as a failure, and
+        non-object line items are dropped, so everything downstream of
+        extract_record can rely on a dict with a list of item dicts.
+        """
+        started = time.monotonic()
+        try:
+            result = extract(image_bytes, mime_type)
+            result['processed_data'] = normalize_invoice_shape(result['processed_data'])
+        except Exception as e:
+            result = {'method': name, 'error': str(e)}
+        result['latency_ms'] = round((time.monotonic() - started) * 1000, 1)
+        return result
+    
+    def _extract_sequential(self, providers: List[Tuple[str, Callable]], image_bytes: bytes, mime_type: str) -> Optional[Dict]:
+        """Try each provider in turn until one succeeds"""
+        if not providers:
+            logger.error("No extraction provider configured (set GEMINI_API_KEY or OPENAI_API_KEY)")
+        
+        for name, extract in providers:
+            result = self._run_provider(name, extract, image_bytes, mime_type)
+            if 'error' not in result:
+                result['hedge_outcome'] = 'solo'
+                return result
+            logger.error(f"Error extracting with {name}: {result['error']}")
+        return None
+    
+    def _extract_hedged(self, providers: List[Tuple[str, Callable]], image_bytes: bytes, mime_type: str,
+                        source_file: str) -> Optional[Dict]:
+        """Start the primary provider and hedge with the secondary if it is slow.
+
+        The secondary is launched once EXTRACTION_HEDGE_DELAY_SECONDS pass
+        without an answer, or as soon as the primary fails. The first valid
+        result wins. The other call is cancelled if it has not started;
+        otherwise its outcome is recorded as 'lost' when it finishes.
+        """
+        (primary_name, primary), (secondary_name, secondary) = providers[:2]
+        
+        futures = {self._hedge_executor.submit(self._run_provider, primary_name, primary, image_bytes, mime_type): primary_name}
+        done, _ = wait(futures, timeout=Config.EXTRACTION_HEDGE_DELAY_SECONDS)
+        
+        hedged = False
+        primary_future = next(iter(futures))
+        if not done or 'error' in primary_future.result():
+            hedged = True
+            logger.info(f"Hedging {source_file or 'extraction'} with {secondary_name}")
+            futures[self._hedge_executor.submit(self._run_provider, secondary_name, secondary, image_bytes, mime_type)] = secondary_name
+        
+        winner = None
+        pending = set(futures)
+        failures = []
+        while pending and winner is None:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                result = future.result()
+                if 'error' in result:
+                    logger.error(f"Error extracting with {result['method']}: {result['error']}")
+                    failures.append(result)
+                elif winner is None:
+                    winner = result
+                    winner['hedge_outcome'] = 'won' if hedged else 'solo'
+                else:
+                    failures.append(result)
+        
+        # Losers that already finished are recorded now, the rest when they complete
+        for result in failures:
+            self._record_hedge_loser(result, source_file)
+        for future in pending:
+            if not future.cancel():
+                future.add_done_callback(lambda f: self._record_hedge_loser(f.result(), source_file))
+        
+        return winner
+    
+    def _record_hedge_loser(self, result: Dict, source_file: str):
+        """Record a provider call that lost the hedge or failed, for latency stats"""
+        self.store_extraction_record({
+            'source_file': source_file,
+            'method': result['method'],
+            'raw_data': result.get('raw_data') or result.get('error'),
+            'processed_data': result.get('processed_data'),
+            'confidence': result.get('confidence'),
+            'latency_ms': result['latency_ms'],
+            'hedge_outcome': 'lost',
+            'status': 'failed' if 'error' in result else 'discarded'
+        })
+    
+    def get_provider_stats(self) -> Dict:
+        """Win/loss counts and latency percentiles per provider from extracted_data"""
+        try:
+            conn = sqlite3.connect(self.db_file)
+            cursor = conn.cursor()
             
-            # Generate response
-            response = self.gemini_model.generate_content([prompt, image])
+            cursor.execute('''
+                SELECT extraction_method, hedge_outcome, status, latency_ms
+                FROM extracted_data
+                WHERE latency_ms IS NOT NULL
+            ''')
+            rows = cursor.fetchall()
+            conn.close()
             
-            # Parse JSON response
-            extracted_data = json.loads(response.text)
+            stats = {}
+            for method, outcome, status, latency_ms in rows:
+                provider = stats.setdefault(method, {'calls': 0, 'won': 0, 'solo': 0, 'lost': 0, 'failed': 0, 'latencies': []})
+                provider['calls'] += 1
+                provider['failed' if status == 'failed' else (outcome or 'solo')] += 1
+                if status != 'failed':
+                    provider['latencies'].append(latency_ms)
             
-            # Store raw extraction
-            self.store_extracted_data(image_path, "gemini", response.text, extracted_data, 0.9)
+            for provider in stats.values():
+                latencies = sorted(provider.pop('latencies'))
+                provider['p50_latency_ms'] = latencies[int(0.50 * (len(latencies) - 1))] if latencies else None
+                provider['p95_latency_ms'] = latencies[int(0.95 * (len(latencies) - 1))] if latencies else None
             
-            return extracted_data
+            return stats
             
         except Exception as e:
-            logger.error(f"Error extracting from image with Gemini: {str(e)}")
-            # Fallback to OpenAI if Gemini fails
-            return self.extract_with_openai_fallback(image_path)
+            logger.error(f"Error getting provider stats: {str(e)}")
+            return {}
     
     def extract_with_openai_fallback(self, image_path: str) -> Dict:
         """Extract invoice data using OpenAI as fallback"""
         try:
-            if not self.openai_client:
-                raise Exception("OpenAI API key not configured")
-            
-            # Read image as base64
-            import base64
-            with open(image_path, "rb") as image_file:
-                image_data = base64.b64encode(image_file.read()).decode('utf-8')
-            
-            # Create prompt for OpenAI
-            prompt = """
-            Extract invoice data from this image and return it in the following JSON format:
-            {
-                "invoice_number": "string",
-                "invoice_date": "YYYY-MM-DD",
-                "due_date": "YYYY-MM-DD",
-                "customer_name": "string",
-                "customer_email": "string",
-                "customer_phone": "string",
-                "customer_address": "string",
-                "total_amount": number,
-                "tax_amount": number,
-                "discount_amount": number,
-                "subtotal": number,
-                "currency": "string",
-                "payment_status": "string",
-                "payment_method": "string",
-                "notes": "string",
-                "items": [
-                    {
-                        "item_name": "string",
-                        "description": "string",
-                        "quantity": number,
-                        "unit_price": number,
-                        "total_price": number,
-                        "tax_rate": number,
-                        "discount_rate": number
-                    }
-                ]
-            }
+            with open(image_path, 'rb') as image_file:
+                image_bytes = image_file.read()
             
-            Extract all available information. If any field is not found, use null or empty string.
-            """
-            
-            # Call OpenAI API
-            response = self.openai_client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {"role": "system", "content": "You are an expert at extracting invoice data from images. Return only valid JSON."},
-                    {"role": "user", "content": [
-                        {"type": "text", "text": prompt},
-                        {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{image_data}"}}
-                    ]}
-                ],
-                max_tokens=2000,
-                temperature=0.1
-            )
-            
-            # Parse JSON response
-            extracted_data = json.loads(response.choices[0].message.content)
-            
-            # Store raw extraction
-            self.store_extracted_data(image_path, "openai", response.choices[0].message.content, extracted_data, 0.8)
+            upload_bytes, mime_type = self.prepare_image(image_bytes, image_path)
+            # Go through _run_provider so a malformed response is rejected before it can be cached
+            result = self._run_provider('openai', self._extract_with_openai, upload_bytes, mime_type)
+            if 'error' in result:
+                raise Exception(result['error'])
+            result = self.validate_result(result, upload_bytes, mime_type, image_path)
+            record = {
+                'source_file': image_path,
+                'cache_key': compute_cache_key(image_bytes),
+                'content_hash': hashlib.sha256(image_bytes).hexdigest(),
+                'original_bytes': len(image_bytes),
+                'uploaded_bytes': len(upload_bytes),
+                **result
+            }
             
-            return extracted_data
+            self.store_extraction_record(record)
+            return record['processed_data']
             
         except Exception as e:
             logger.error(f"Error extracting with OpenAI: {str(e)}")
             return {}
     
-    def store_extracted_data(self, source_file: str, method: str, raw_data: str, processed_data: Dict, confidence: float):
-        """Store extracted data in database"""
+    def prepare_image(self, image_bytes: bytes, source_file: str = None) -> Tuple[bytes, str]:
+        """Preprocess an image for upload and return (bytes, mime_type)"""
+        if not Config.INVOICE_IMAGE_PREPROCESS:
+            return image_bytes, guess_image_mime_type(image_bytes)
+        
+        processed, mime_type, stats = preprocess_invoice_image(image_bytes)
+        logger.info(
+            f"Preprocessed {source_file or 'image'}: {stats['original_bytes']} -> {stats['processed_bytes']} bytes "
+            f"({stats['original_size']} -> {stats['processed_size']})"
+        )
+        return processed, mime_type or guess_image_mime_type(processed)
+    
+    def _extract_with_gemini(self, image_bytes: bytes, mime_type: str, prompt: str = EXTRACTION_PROMPT) -> Dict:
+        """Run a Gemini extraction and return method, raw data and parsed data"""
+        if not self.gemini_model:
+            raise Exception("Gemini API key not configured")
+        
+        # Generate response
+        response = self.gemini_model.generate_content([
+            prompt,
+            {'mime_type': mime_type, 'data': image_bytes}
+        ], generation_config=gemini_generation_config(schema=prompt is EXTRACTION_PROMPT))
+        
+        # Parse JSON response, repairing fences or truncation locally
+        extracted_data = parse_model_json(response.text)
+        
+        return {'method': 'gemini', 'raw_data': response.text, 'processed_data': extracted_data}
+    
+    def _extract_with_openai(self, image_bytes: bytes, mime_type: str, prompt: str = EXTRACTION_PROMPT) -> Dict:
+        """Run an OpenAI extraction and return method, raw data and parsed data"""
+        if not self.openai_client:
+            raise Exception("OpenAI API key not configured")
+        
+        # Encode image as base64
+        image_data = base64.b64encode(image_bytes).decode('utf-8')
+        
+        # Ask for schema-shaped JSON unless structured output is disabled; field re-reads only need a JSON object
+        full_extraction = prompt is EXTRACTION_PROMPT
+        extra_args = {}
+        if Config.EXTRACTION_STRUCTURED_OUTPUT:
+            extra_args['response_format'] = openai_response_format() if full_extraction else {'type': 'json_object'}
+        
+        # Call OpenAI API
+        response = self.openai_client.chat.completions.create(
+            model=OPENAI_MODEL_NAME,
+            messages=[
+                {"role": "system", "content": "You are an expert at extracting invoice data from images. Return only valid JSON."},
+                {"role": "user", "content": [
+                    {"type": "text", "text": prompt},
+                    {"type": "image_url", "image_url": {"url": f"data:{mime_type};base64,{image_data}"}}
+                ]}
+            ],
+            max_tokens=2000 if full_extraction else 400,
+            temperature=0.1,
+            **extra_args
+        )
+        
+        # Parse JSON response, repairing fences or truncation locally
+        raw_text = response.choices[0].message.content
+        extracted_data = parse_model_json(raw_text)
+        
+        return {'method': 'openai', 'raw_data': raw_text, 'processed_data': extracted_data}
+    
+    def get_cached_extraction(self, cache_key: str) -> Optional[Dict]:
+        """Return a previously stored extraction for this cache key, if any"""
         try:
             conn = sqlite3.connect(self.db_file)
             cursor = conn.cursor()
             
-            import uuid
-            extraction_id = str(uuid.uuid4())
-            
             cursor.execute('''
-                INSERT INTO extracted_data (id, source_file, extraction_method, raw_data, processed_data, confidence_score)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (
-                extraction_id,
-                source_file,
-                method,
-                raw_data,
-                json.dumps(processed_data),
-                confidence
-            ))
+                SELECT id, processed_data FROM extracted_data
+                WHERE cache_key = ?
+                ORDER BY extraction_date DESC
+                LIMIT 1
+            ''', (cache_key,))
+            row = cursor.fetchone()
+            
+            if row:
+                cursor.execute(
+                    "UPDATE extracted_data SET last_accessed = strftime('%Y-%m-%d %H:%M:%f', 'now') WHERE id = ?",
+                    (row[0],)
+                )
+                conn.commit()
             
-            conn.commit()
             conn.close()
-            logger.info(f"Extracted data stored with ID: {extraction_id}")
+            # Entries cached before shapes were checked may hold a list; reading them fails and is a miss
+            return normalize_invoice_shape(load_json_payload(row[1])) if row else None
             
         except Exception as e:
-            logger.error(f"Error storing extracted data: {str(e)}")
+            logger.error(f"Error reading extraction cache: {str(e)}")
+            return None
     
-    def save_invoice_to_database(self, invoice_data: Dict) -> str:
-        """Save extracted invoice data to database"""
+    def evict_extraction_cache(self, cursor=None) -> int:
+        """Drop cache entries past their TTL or beyond the size limit, least recently used first.
+
+        Evicted rows stay in extracted_data as the extraction history; only
+        their cache_key is cleared.
+        """
+        own_connection = cursor is None
         try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            
-            import uuid
-            invoice_id = str(uuid.uuid4())
+            if own_connection:
+                conn = sqlite3.connect(self.db_file)
+                cursor = conn.cursor()
             
-            # Insert invoice
+            cutoff = (datetime.utcnow() - timedelta(days=Config.EXTRACTION_CACHE_TTL_DAYS)).strftime('%Y-%m-%d %H:%M:%S')
             cursor.execute('''
-                INSERT INTO invoices (
-                    id, invoice_number, invoice_date, due_date, customer_name, customer_email,
-                    customer_phone, customer_address, total_amount, tax_amount, discount_amount,
-                    subtotal, currency, payment_status, payment_method, notes
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
+                UPDATE extracted_data SET cache_key = NULL
+                WHERE cache_key IS NOT NULL AND (
+                    COALESCE(last_accessed, extraction_date) < ?
+                    OR id IN (
+                        SELECT id FROM extracted_data
+                        WHERE cache_key IS NOT NULL
+                        ORDER BY COALESCE(last_accessed, extraction_date) DESC, rowid DESC
+                        LIMIT -1 OFFSET ?
+                    )
+                )
+            ''', (cutoff, Config.EXTRACTION_CACHE_MAX_ENTRIES))
+            evicted = cursor.rowcount
+            
+            if own_connection:
+                conn.commit()
+                conn.close()
+            if evicted:
+                logger.info(f"Evicted {evicted} extraction cache entries")
+            return evicted
+            
+        except Exception as e:
+            logger.error(f"Error evicting extraction cache: {str(e)}")
+            return 0
+    
+    def _evict_after_cache_writes(self, cursor, count: int = 1):
+        """Count new cache entries and evict once EXTRACTION_CACHE_EVICT_INTERVAL have been written.
+
+        Callers must hold self._db_lock.
+        """
+        self._cache_writes += count
+        if self._cache_writes >= Config.EXTRACTION_CACHE_EVICT_INTERVAL:
+            self._cache_writes = 0
+            self.evict_extraction_cache(cursor)
+    
+    def _get_connection(self):
+        """Get the extractor's shared write connection, opening it on first use.
+
+        Callers must hold self._db_lock while using it.
+        """
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.db_file, timeout=30, check_same_thread=False)
+        return self._conn
+    
+    def _insert_extraction(self, cursor, record: Dict) -> str:
+        """Insert an extraction record using an existing cursor"""
+        extraction_id = str(uuid.uuid4())
+        
+        cursor.execute('''
+            INSERT INTO extracted_data (
+                id, source_file, extraction_method, raw_data, processed_data, confidence_score,
+                content_hash, cache_key, original_bytes, uploaded_bytes, latency_ms, hedge_outcome,
+                validation_issues, status, last_accessed
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, strftime('%Y-%m-%d %H:%M:%f', 'now'))
+        ''', (
+            extraction_id,
+            record.get('source_file'),
+            record.get('method'),
+            compress_payload(record.get('raw_data')),
+            compress_payload(json.dumps(record.get('processed_data'))),
+            record.get('confidence'),
+            record.get('content_hash'),
+            record.get('cache_key'),
+            record.get('original_bytes'),
+            record.get('uploaded_bytes'),
+            record.get('latency_ms'),
+            record.get('hedge_outcome'),
+            json.dumps(record['validation_issues']) if record.get('validation_issues') else None,
+            record.get('status', 'pending')
+        ))
+        
+        return extraction_id
+    
+    def _insert_record(self, cursor, record: Dict) -> str:
+        """Insert an extract_record result using an existing cursor.
+
+        Cache hits are stored as a 'cache' row without a cache key, which
+        still records their source so archived uploads stay referenced.
+        """
+        if record.get('cached'):
+            return self._insert_extraction(cursor, {
+                'source_file': record.get('source_file'),
+                'method': 'cache',
+                'processed_data': record['processed_data'],
+                'status': 'cached'
+            })
+        return self._insert_extraction(cursor, record)
+    
+    def store_extraction_record(self, record: Dict) -> Optional[str]:
+        """Store an extraction record returned by extract_record"""
+        try:
+            with self._db_lock:
+                conn = self._get_connection()
+                with conn:
+                    cursor = conn.cursor()
+                    extraction_id = self._insert_record(cursor, record)
+                    if record.get('cache_key') and not record.get('cached'):
+                        self._evict_after_cache_writes(cursor)
+            
+            logger.info(f"Extracted data stored with ID: {extraction_id}")
+            return extraction_id
+            
+        except Exception as e:
+            logger.error(f"Error storing extracted data: {str(e)}")
+            return None
+    
+    def store_extracted_data(self, source_file: str, method: str, raw_data: str, processed_data: Dict, confidence: float,
+                             cache_key: str = None, content_hash: str = None, original_bytes: int = None,
+                             uploaded_bytes: int = None):
+        """Store extracted data in database"""
+        return self.store_extraction_record({
+            'source_file': source_file,
+            'method': method,
+            'raw_data': raw_data,
+            'processed_data': processed_data,
+            'confidence': confidence,
+            'cache_key': cache_key,
+            'content_hash': content_hash,
+            'original_bytes': original_bytes,
+            'uploaded_bytes': uploaded_bytes
+        })
+    
+    def _insert_invoices(self, cursor, invoices: List[Dict]) -> List[str]:
+        """Insert invoices and all their items with two executemany calls"""
+        invoice_rows = []
+        item_rows = []
+        search_rows = []
+        
+        for invoice_data in invoices:
+            invoice_id = str(uuid.uuid4())
+            invoice_rows.append((
                 invoice_id,
                 invoice_data.get('invoice_number'),
                 invoice_data.get('invoice_date'),
@@ -292,17 +866,11 @@ class InvoiceDataExtractor:
                 invoice_data.get('notes')
             ))
             
-            # Insert invoice items
-            items = invoice_data.get('items', [])
+            # Items are normally normalized at extraction; invoices saved directly may still hold stray values
+            items = [item for item in invoice_data.get('items') or [] if isinstance(item, dict)]
             for item in items:
-                item_id = str(uuid.uuid4())
-                cursor.execute('''
-                    INSERT INTO invoice_items (
-                        id, invoice_id, item_name, description, quantity, unit_price,
-                        total_price, tax_rate, discount_rate
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    item_id,
+                item_rows.append((
+                    str(uuid.uuid4()),
                     invoice_id,
                     item.get('item_name'),
                     item.get('description'),
@@ -313,96 +881,601 @@ class InvoiceDataExtractor:
                     item.get('discount_rate', 0)
                 ))
             
+            search_rows.append((
+                invoice_id,
+                invoice_data.get('customer_name'),
+                invoice_data.get('customer_address'),
+                invoice_data.get('notes'),
+                ' '.join(str(item['item_name']) for item in items if item.get('item_name')),
+                ' '.join(str(item['description']) for item in items if item.get('description'))
+            ))
+        
+        # Insert invoices
+        cursor.executemany('''
+            INSERT INTO invoices (
+                id, invoice_number, invoice_date, due_date, customer_name, customer_email,
+                customer_phone, customer_address, total_amount, tax_amount, discount_amount,
+                subtotal, currency, payment_status, payment_method, notes
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', invoice_rows)
+        
+        self._update_invoice_summary(cursor, [row[0] for row in invoice_rows])
+        
+        # Insert invoice items
+        cursor.executemany('''
+            INSERT INTO invoice_items (
+                id, invoice_id, item_name, description, quantity, unit_price,
+                total_price, tax_rate, discount_rate
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', item_rows)
+        
+        if self.search_enabled:
+            cursor.executemany(f'''
+                INSERT INTO invoice_search (invoice_id, {', '.join(SEARCH_COLUMNS)}) VALUES (?, ?, ?, ?, ?, ?)
+            ''', search_rows)
+        
+        return [row[0] for row in invoice_rows]
+    
+    def _update_invoice_summary(self, cursor, invoice_ids: List[str]):
+        """Add newly inserted invoices to the summary counters using an existing cursor"""
+        # Large saves are added in chunks so no statement binds more ids than SQLite allows
+        for start in range(0, len(invoice_ids), SQLITE_MAX_BOUND_IDS):
+            chunk = invoice_ids[start:start + SQLITE_MAX_BOUND_IDS]
+            placeholders = ', '.join('?' * len(chunk))
+            
+            # Aggregate the stored rows so amounts get the same REAL conversion a full SUM would
+            cursor.execute(f'''
+                UPDATE invoice_summary
+                SET total_invoices = total_invoices + ?,
+                    total_amount = total_amount + (
+                        SELECT COALESCE(SUM(total_amount), 0) FROM invoices WHERE id IN ({placeholders})
+                    )
+                WHERE id = 1
+            ''', [len(chunk)] + chunk)
+            
+            cursor.execute(f'''
+                INSERT INTO invoice_status_counts (payment_status, invoice_count)
+                SELECT COALESCE(payment_status, 'unknown'), COUNT(*) FROM invoices
+                WHERE id IN ({placeholders})
+                GROUP BY 1
+                ON CONFLICT (payment_status) DO UPDATE SET invoice_count = invoice_count + excluded.invoice_count
+            ''', chunk)
+    
+    def rebuild_search_index(self, cursor=None):
+        """Rebuild the full-text search index from the invoices and invoice_items tables"""
+        conn = None
+        if cursor is None:
+            conn = sqlite3.connect(self.db_file)
+            cursor = conn.cursor()
+        
+        cursor.execute("DELETE FROM invoice_search")
+        cursor.execute(f'''
+            INSERT INTO invoice_search (invoice_id, {', '.join(SEARCH_COLUMNS)})
+            SELECT i.id, i.customer_name, i.customer_address, i.notes,
+                   (SELECT group_concat(item_name, ' ') FROM invoice_items WHERE invoice_id = i.id),
+                   (SELECT group_concat(description, ' ') FROM invoice_items WHERE invoice_id = i.id)
+            FROM invoices i
+        ''')
+        
+        if conn is not None:
             conn.commit()
             conn.close()
-            logger.info(f"Invoice saved to database with ID: {invoice_id}")
-            return invoice_id
+    
+    def rebuild_invoice_summary(self, cursor=None):
+        """Recompute the summary counters from the invoices table"""
+        conn = None
+        if cursor is None:
+            conn = sqlite3.connect(self.db_file)
+            cursor = conn.cursor()
+        
+        cursor.execute("DELETE FROM invoice_status_counts")
+        cursor.execute('''
+            INSERT OR REPLACE INTO invoice_summary (id, total_invoices, total_amount)
+            SELECT 1, COUNT(*), COALESCE(SUM(total_amount), 0) FROM invoices
+        ''')
+        cursor.execute('''
+            INSERT INTO invoice_status_counts (payment_status, invoice_count)
+            SELECT COALESCE(payment_status, 'unknown'), COUNT(*) FROM invoices GROUP BY 1
+        ''')
+        
+        if conn is not None:
+            conn.commit()
+            conn.close()
+    
+    def _insert_bundles(self, cursor, bundles: List[Tuple[Dict, Optional[Dict]]]) -> List[str]:
+        """Insert (invoice, extraction record) pairs using an existing cursor"""
+        cache_writes = 0
+        for _, extraction in bundles:
+            if extraction:
+                self._insert_record(cursor, extraction)
+                cache_writes += bool(extraction.get('cache_key') and not extraction.get('cached'))
+        
+        invoice_ids = self._insert_invoices(cursor, [invoice_data for invoice_data, _ in bundles])
+        
+        if cache_writes:
+            self._evict_after_cache_writes(cursor, cache_writes)
+        return invoice_ids
+    
+    def save_invoices(self, invoices: List) -> List[str]:
+        """Save many invoices in one transaction on the shared connection.
+
+        Each entry is an invoice dict or an (invoice dict, extraction record)
+        tuple; extraction records from extract_record are written in the
+        same transaction. Returns the new invoice ids, or [] on failure.
+        """
+        bundles = [entry if isinstance(entry, tuple) else (entry, None) for entry in invoices]
+        try:
+            with self._db_lock:
+                conn = self._get_connection()
+                with conn:
+                    invoice_ids = self._insert_bundles(conn.cursor(), bundles)
+            
+            logger.info(f"Saved {len(invoice_ids)} invoices in one transaction")
+            return invoice_ids
             
         except Exception as e:
-            logger.error(f"Error saving invoice to database: {str(e)}")
-            return None
+            logger.error(f"Error saving invoices to database: {str(e)}")
+            return []
     
-    def query_invoice_data(self, query: str) -> List[Dict]:
-        """Query invoice data using natural language"""
+    def save_invoice_bundle(self, invoice_data: Dict, extraction: Dict = None) -> Optional[str]:
+        """Save an invoice together with its extraction record in one transaction"""
+        invoice_ids = self.save_invoices([(invoice_data, extraction)])
+        return invoice_ids[0] if invoice_ids else None
+    
+    def save_invoice_to_database(self, invoice_data: Dict) -> str:
+        """Save extracted invoice data to database"""
+        invoice_id = self.save_invoice_bundle(invoice_data)
+        if invoice_id:
+            logger.info(f"Invoice saved to database with ID: {invoice_id}")
+        return invoice_id
+    
+    def _persist_batch_group(self, batch_id: str, results: List[Dict], save: bool):
+        """Write a group of batch results in a single transaction.
+
+        Files extracted without saving are recorded as 'extracted' rather
+        than 'completed', so a later saving run still saves them.
+        """
+        with self._db_lock:
+            conn = self._get_connection()
+            with conn:
+                cursor = conn.cursor()
+                
+                completed = [result for result in results if result['status'] == 'completed']
+                if save:
+                    bundles = [(result['record']['processed_data'], result['record']) for result in completed]
+                    for result, invoice_id in zip(completed, self._insert_bundles(cursor, bundles)):
+                        result['invoice_id'] = invoice_id
+                else:
+                    for result in completed:
+                        if not result['record'].get('cached'):
+                            self._insert_extraction(cursor, result['record'])
+                
+                cursor.executemany('''
+                    INSERT OR REPLACE INTO batch_files (
+                        batch_id, file_name, status, invoice_id, error, duration_seconds
+                    ) VALUES (?, ?, ?, ?, ?, ?)
+                ''', [
+                    (batch_id, result['file'],
+                     'extracted' if result['status'] == 'completed' and not save else result['status'],
+                     result.get('invoice_id'), result.get('error'), result['duration_seconds'])
+                    for result in results
+                ])
+        
+        for result in results:
+            result.pop('record', None)
+    
+    def get_completed_batch_files(self, batch_id: str, save: bool = True) -> set:
+        """Get the files of a batch that a run with the given `save` can skip.
+
+        A saving run only skips files that were saved; an extract-only run
+        also skips files that were extracted without saving.
+        """
+        statuses = ('completed',) if save else ('completed', 'extracted')
+        conn = sqlite3.connect(self.db_file)
         try:
-            if not self.openai_client:
-                raise Exception("OpenAI API key not configured")
-            
-            # Get database schema
+            cursor = conn.cursor()
+            cursor.execute(
+                f"SELECT file_name FROM batch_files WHERE batch_id = ? AND status IN ({', '.join('?' * len(statuses))})",
+                (batch_id, *statuses)
+            )
+            return {row[0] for row in cursor.fetchall()}
+        finally:
+            conn.close()
+    
+    def extract_batch(self, path: str, batch_id: str = None, max_workers: int = None, save: bool = True,
+                      group_size: int = None, progress: Callable[[Dict], None] = None) -> Dict:
+        """Extract every invoice image in a directory or zip archive.
+
+        Extraction runs on a bounded thread pool and results are persisted
+        in groups of `group_size` per transaction. Files already completed
+        under the same batch_id are skipped, so re-running an interrupted
+        batch resumes it; files from an earlier `save=False` run are
+        extracted again (usually from the cache) when `save` is on.
+        `progress` is called with each file's result.
+        """
+        batch_id = batch_id or os.path.basename(os.path.normpath(path))
+        return self.extract_sources(list_invoice_images(path), batch_id, max_workers=max_workers, save=save,
+                                    group_size=group_size, progress=progress)
+    
+    def extract_sources(self, sources: List[Tuple[str, Callable[[], bytes]]], batch_id: str, max_workers: int = None,
+                        save: bool = True, group_size: int = None, progress: Callable[[Dict], None] = None,
+                        on_extracted: Callable[[Dict], None] = None,
+                        source_file: Callable[[str, bytes], str] = None) -> Dict:
+        """Extract a batch of (name, loader) sources; see extract_batch.
+
+        `on_extracted` is called as soon as each file's extraction
+        finishes, before its group is persisted; `progress` is called once
+        the file's result has been saved. `source_file` maps a name and its
+        bytes to the recorded source path (default "<batch_id>/<name>").
+        """
+        max_workers = max_workers or Config.BATCH_MAX_WORKERS
+        group_size = group_size or Config.BATCH_GROUP_SIZE
+        started = time.monotonic()
+        
+        completed_files = self.get_completed_batch_files(batch_id, save)
+        pending = [(name, load) for name, load in sources if name not in completed_files]
+        logger.info(f"Batch {batch_id}: {len(sources)} images, {len(completed_files)} already done, {len(pending)} to extract")
+        
+        def extract(name, load):
+            file_started = time.monotonic()
+            result = {'file': name, 'status': 'failed', 'invoice_id': None, 'error': None}
+            try:
+                image_bytes = load()
+                source = source_file(name, image_bytes) if source_file else f"{batch_id}/{name}"
+                record = self.extract_record(image_bytes, source)
+                if record and record['processed_data']:
+                    result['status'] = 'completed'
+                    result['record'] = record
+                else:
+                    result['error'] = 'No invoice data extracted'
+            except Exception as e:
+                result['error'] = str(e)
+            result['duration_seconds'] = round(time.monotonic() - file_started, 3)
+            return result
+        
+        results = []
+        group = []
+        
+        def flush_group():
+            self._persist_batch_group(batch_id, group, save)
+            for result in group:
+                results.append(result)
+                if progress:
+                    progress(result)
+            group.clear()
+        
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='batch-extract') as executor:
+            futures = [executor.submit(extract, name, load) for name, load in pending]
+            for future in as_completed(futures):
+                group.append(future.result())
+                if on_extracted:
+                    on_extracted({key: value for key, value in group[-1].items() if key != 'record'})
+                if len(group) >= group_size:
+                    flush_group()
+        if group:
+            flush_group()
+        
+        elapsed = time.monotonic() - started
+        summary = {
+            'batch_id': batch_id,
+            'files': len(sources),
+            'skipped': len(completed_files & {name for name, _ in sources}),
+            'completed': sum(1 for result in results if result['status'] == 'completed'),
+            'failed': sum(1 for result in results if result['status'] == 'failed'),
+            'elapsed_seconds': round(elapsed, 3),
+            'files_per_second': round(len(results) / elapsed, 2) if elapsed > 0 else 0.0,
+            'results': sorted(results, key=lambda result: result['file'])
+        }
+        logger.info(
+            f"Batch {batch_id} finished: {summary['completed']} completed, {summary['failed']} failed, "
+            f"{summary['skipped']} skipped in {summary['elapsed_seconds']}s ({summary['files_per_second']} files/s)"
+        )
+        return summary
+    
+    def _get_query_schema(self) -> str:
+        """Compact description of the queryable tables, built once per extractor"""
+        if self._query_schema is None:
             conn = sqlite3.connect(self.db_file)
             cursor = conn.cursor()
             
-            # Get table schemas
-            cursor.execute("SELECT sql FROM sqlite_master WHERE type='table'")
-            schemas = cursor.fetchall()
-            
-            # Create prompt for SQL generation
-            prompt = f"""
-            Based on the following database schema:
-            {schemas}
-            
-            Generate a SQL query to answer this question: {query}
+            lines = []
+            for table in QUERYABLE_TABLES:
+                cursor.execute(f'PRAGMA table_info({table})')
+                columns = [f"{row[1]} {row[2]}".strip() for row in cursor.fetchall() if row[1] not in QUERY_HIDDEN_COLUMNS]
+                lines.append(f"{table}({', '.join(columns)})")
             
-            The database contains invoice data with tables: invoices, invoice_items, extracted_data
-            
-            Return ONLY the SQL query, no explanations.
-            """
-            
-            # Generate SQL query
-            response = self.openai_client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {"role": "system", "content": "You are a SQL expert. Generate only valid SQL queries."},
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=500,
-                temperature=0.1
-            )
+            conn.close()
+            self._query_schema = '\n'.join(lines)
+        return self._query_schema
+    
+    def _get_read_connection(self):
+        """Get this thread's reused read-only connection, opening it on first use.
+
+        Each thread has its own connection, so a slow generated query does
+        not hold up the summary or search running on other threads.
+        """
+        conn = getattr(self._read_local, 'conn', None)
+        if conn is None:
+            conn = self._read_local.conn = self._open_read_connection()
+        return conn
+    
+    def _open_read_connection(self):
+        """Open a read-only connection for running generated SQL.
+
+        Compressed extraction payloads are decompressed as rows are fetched.
+        """
+        conn = sqlite3.connect(f"file:{self.db_file}?mode=ro", uri=True, check_same_thread=False)
+        conn.execute('PRAGMA query_only = ON')
+        conn.row_factory = lambda cursor, row: tuple(
+            decompress_payload(value) if is_compressed_payload(value) else value for value in row
+        )
+        return conn
+    
+    def _generate_invoice_sql(self, query: str) -> str:
+        """Generate SQL for a question, reusing the SQL from an earlier identical question"""
+        cache_key = normalize_question(query)
+        with self._sql_cache_lock:
+            if cache_key in self._sql_cache:
+                self._sql_cache.move_to_end(cache_key)
+                logger.info("Using cached SQL for invoice query")
+                return self._sql_cache[cache_key]
+        
+        if not self.openai_client:
+            raise Exception("OpenAI API key not configured")
+        
+        # Create prompt for SQL generation
+        prompt = f"""
+        Based on the following SQLite tables:
+        {self._get_query_schema()}
+        
+        invoice_items.invoice_id references invoices.id.
+        
+        Generate a single SELECT query to answer this question: {query}
+        
+        Return ONLY the SQL query, no explanations.
+        """
+        
+        # Generate SQL query
+        response = self.openai_client.chat.completions.create(
+            model=OPENAI_MODEL_NAME,
+            messages=[
+                {"role": "system", "content": "You are a SQL expert. Generate only valid SQL queries."},
+                {"role": "user", "content": prompt}
+            ],
+            max_tokens=500,
+            temperature=0.1
+        )
+        
+        return clean_generated_sql(response.choices[0].message.content)
+    
+    def _cache_invoice_sql(self, query: str, sql_query: str):
+        """Remember SQL that ran successfully for a question"""
+        cache_key = normalize_question(query)
+        with self._sql_cache_lock:
+            self._sql_cache[cache_key] = sql_query
+            self._sql_cache.move_to_end(cache_key)
+            while len(self._sql_cache) > Config.INVOICE_QUERY_SQL_CACHE_SIZE:
+                self._sql_cache.popitem(last=False)
+    
+    def _run_read_query(self, sql_query: str, params: Tuple = (), max_rows: int = None) -> Tuple[List[str], List[tuple]]:
+        """Run SQL on this thread's read-only connection, returning (columns, rows).
+
+        At most `max_rows` rows are fetched, and the statement is interrupted
+        once it runs longer than INVOICE_QUERY_TIMEOUT_SECONDS.
+        """
+        conn = self._get_read_connection()
+        deadline = time.monotonic() + Config.INVOICE_QUERY_TIMEOUT_SECONDS
+        # Returning True from the progress handler interrupts the statement
+        conn.set_progress_handler(lambda: time.monotonic() > deadline, 10000)
+        try:
+            cursor = conn.execute(sql_query, params)
+            columns = [description[0] for description in cursor.description] if cursor.description else []
+            rows = cursor.fetchmany(max_rows) if max_rows else cursor.fetchall()
+            cursor.close()
+            return columns, rows
+        finally:
+            conn.set_progress_handler(None, 0)
+    
+    def query_invoice_data(self, query: str) -> List[Dict]:
+        """Query invoice data using natural language.
+
+        The generated SQL runs on a per-thread read-only connection, returns
+        at most INVOICE_QUERY_MAX_ROWS rows and is interrupted once it
+        runs longer than INVOICE_QUERY_TIMEOUT_SECONDS.
+        """
+        try:
+            sql_query = self._generate_invoice_sql(query)
+            if not READ_QUERY_PATTERN.match(sql_query):
+                raise Exception(f"Generated SQL is not a SELECT query: {sql_query}")
             
-            sql_query = response.choices[0].message.content.strip()
+            columns, results = self._run_read_query(sql_query, max_rows=Config.INVOICE_QUERY_MAX_ROWS + 1)
             
-            # Execute the query
-            cursor.execute(sql_query)
-            columns = [description[0] for description in cursor.description]
-            results = cursor.fetchall()
+            self._cache_invoice_sql(query, sql_query)
             
-            conn.close()
+            if len(results) > Config.INVOICE_QUERY_MAX_ROWS:
+                logger.warning(f"Invoice query returned more than {Config.INVOICE_QUERY_MAX_ROWS} rows; truncating")
+                results = results[:Config.INVOICE_QUERY_MAX_ROWS]
             
             # Convert to list of dictionaries
             return [dict(zip(columns, row)) for row in results]
             
+        except sqlite3.OperationalError as e:
+            if 'interrupted' in str(e):
+                logger.error(f"Invoice query exceeded {Config.INVOICE_QUERY_TIMEOUT_SECONDS}s and was interrupted")
+            else:
+                logger.error(f"Error querying invoice data: {str(e)}")
+            return []
         except Exception as e:
             logger.error(f"Error querying invoice data: {str(e)}")
             return []
     
-    def get_invoice_summary(self) -> Dict:
-        """Get summary statistics of invoice data"""
+    def query_invoice_page(self, query: str = None, cursor: str = None, per_page: int = None) -> Dict:
+        """One page of a natural language query's results.
+
+        The first page generates SQL for `query`; later pages pass the
+        returned `next_cursor`, which carries that SQL and the offset, so
+        paging never calls the model again. `next_cursor` is None on the
+        last page. Raises ValueError for an invalid cursor or page size.
+        """
+        # A LIMIT below zero means no limit to SQLite, so keep page sizes within 1..INVOICE_QUERY_MAX_ROWS
+        per_page = max(1, min(int(per_page or Config.INVOICE_QUERY_PAGE_SIZE), Config.INVOICE_QUERY_MAX_ROWS))
+        page = {'results': [], 'count': 0, 'next_cursor': None}
+        
+        sql_query, offset = decode_query_cursor(cursor) if cursor else (None, 0)
+        
         try:
+            sql_query = sql_query or self._generate_invoice_sql(query)
+            if not READ_QUERY_PATTERN.match(sql_query):
+                raise Exception(f"Generated SQL is not a SELECT query: {sql_query}")
+            
+            # One extra row tells us whether there is a next page
+            columns, rows = self._run_read_query(
+                f"SELECT * FROM ({sql_query.strip().rstrip(';')}) LIMIT ? OFFSET ?",
+                (per_page + 1, offset)
+            )
+            
+            if not cursor:
+                self._cache_invoice_sql(query, sql_query)
+            
+            if len(rows) > per_page:
+                rows = rows[:per_page]
+                page['next_cursor'] = encode_query_cursor(sql_query, offset + per_page)
+            
+            page['results'] = [dict(zip(columns, row)) for row in rows]
+            page['count'] = len(rows)
+            return page
+            
+        except Exception as e:
+            logger.error(f"Error querying invoice data page: {str(e)}")
+            return page
+    
+    def export_invoice_rows(self, query: str = None, table: str = None) -> Tuple[List[str], Iterator[List[tuple]]]:
+        """Stream every row of a natural language query or a queryable table.
+
+        Returns (columns, batches) where batches yields lists of at most
+        INVOICE_EXPORT_BATCH_ROWS rows read straight from the SQLite cursor,
+        so memory stays flat however large the export is. Each export uses
+        its own read-only connection, closed when the generator finishes.
+        There is no row limit; instead the statement is interrupted if no
+        batch is produced within INVOICE_QUERY_TIMEOUT_SECONDS.
+        """
+        if table:
+            if table not in QUERYABLE_TABLES:
+                raise ValueError(f"Unknown table: {table}")
             conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
+            table_columns = [row[1] for row in conn.execute(f'PRAGMA table_info({table})') if row[1] not in QUERY_HIDDEN_COLUMNS]
+            conn.close()
+            sql_query = f"SELECT {', '.join(table_columns)} FROM {table}"
+        else:
+            sql_query = self._generate_invoice_sql(query)
+            if not READ_QUERY_PATTERN.match(sql_query):
+                raise ValueError(f"Generated SQL is not a SELECT query: {sql_query}")
+        
+        conn = self._open_read_connection()
+        deadline = [time.monotonic() + Config.INVOICE_QUERY_TIMEOUT_SECONDS]
+        conn.set_progress_handler(lambda: time.monotonic() > deadline[0], 10000)
+        try:
+            cursor = conn.execute(sql_query)
+            columns = [description[0] for description in cursor.description] if cursor.description else []
+        except Exception:
+            conn.close()
+            raise
+        
+        if query:
+            self._cache_invoice_sql(query, sql_query)
+        
+        def batches():
+            exported = 0
+            try:
+                while True:
+                    deadline[0] = time.monotonic() + Config.INVOICE_QUERY_TIMEOUT_SECONDS
+                    rows = cursor.fetchmany(Config.INVOICE_EXPORT_BATCH_ROWS)
+                    if not rows:
+                        break
+                    exported += len(rows)
+                    # The client may take a while to read a batch; that time does not count
+                    deadline[0] = float('inf')
+                    yield rows
+            finally:
+                conn.close()
+                logger.info(f"Exported {exported} invoice rows")
+        
+        return columns, batches()
+    
+    def search_invoices(self, query: str, page: int = 1, per_page: int = 20) -> Dict:
+        """Full-text search over customers, addresses, notes and line items.
+
+        Every word in the query must match (as a prefix), so "sharma atta"
+        finds invoices from Sharma Traders that list atta. Results are
+        ranked by bm25 with customer name and item name matches weighted
+        highest, and paginated with page/per_page. Runs on the read-only
+        connection, so searches never wait behind batch-group commits.
+        """
+        # A LIMIT or OFFSET below zero means no limit to SQLite, so clamp both
+        page = max(1, int(page or 1))
+        per_page = max(1, min(int(per_page), SEARCH_MAX_PER_PAGE))
+        terms = SEARCH_TERM_PATTERN.findall(query or '')
+        result = {'query': query, 'page': page, 'per_page': per_page, 'total': 0, 'results': []}
+        if not terms or not self.search_enabled:
+            return result
+        
+        # Quote each term so user input is never parsed as FTS5 syntax
+        match = ' '.join(f'"{term}"*' for term in terms)
+        weights = ', '.join(str(SEARCH_COLUMN_WEIGHTS[column]) for column in SEARCH_COLUMNS)
+        
+        try:
+            _, rows = self._run_read_query("SELECT COUNT(*) FROM invoice_search WHERE invoice_search MATCH ?", (match,))
+            result['total'] = rows[0][0]
             
-            # Get total invoices
-            cursor.execute("SELECT COUNT(*) FROM invoices")
-            total_invoices = cursor.fetchone()[0]
+            _, rows = self._run_read_query(f"""
+                SELECT i.id, i.invoice_number, i.invoice_date, i.customer_name, i.total_amount,
+                       i.currency, i.payment_status,
+                       snippet(invoice_search, -1, '[', ']', '...', 12),
+                       bm25(invoice_search, 0, {weights}) AS score
+                FROM invoice_search
+                JOIN invoices i ON i.id = invoice_search.invoice_id
+                WHERE invoice_search MATCH ?
+                ORDER BY score
+                LIMIT ? OFFSET ?
+            """, (match, per_page, (page - 1) * per_page))
             
-            # Get total amount
-            cursor.execute("SELECT SUM(total_amount) FROM invoices")
-            total_amount = cursor.fetchone()[0] or 0
+            columns = ['invoice_id', 'invoice_number', 'invoice_date', 'customer_name', 'total_amount',
+                       'currency', 'payment_status', 'snippet', 'score']
+            result['results'] = [dict(zip(columns, row)) for row in rows]
+            for row in result['results']:
+                # bm25 is lower-is-better; flip it so higher means more relevant
+                row['score'] = -row['score']
+            return result
+            
+        except Exception as e:
+            logger.error(f"Error searching invoices: {str(e)}")
+            return result
+    
+    def get_invoice_summary(self) -> Dict:
+        """Get summary statistics of invoice data from the maintained counters.
+
+        Reads go through the read-only connection, so they never wait
+        behind a batch group's write transaction.
+        """
+        try:
+            # Get total invoices and total amount
+            _, rows = self._run_read_query("SELECT total_invoices, total_amount FROM invoice_summary WHERE id = 1")
+            total_invoices, total_amount = rows[0] if rows else (0, 0)
             
             # Get payment status distribution
-            cursor.execute("SELECT payment_status, COUNT(*) FROM invoices GROUP BY payment_status")
-            payment_status = dict(cursor.fetchall())
-            
-            # Get recent invoices
-            cursor.execute("""
-                SELECT invoice_number, customer_name, total_amount, payment_status, invoice_date 
-                FROM invoices 
-                ORDER BY invoice_date DESC 
+            _, rows = self._run_read_query(
+                "SELECT payment_status, invoice_count FROM invoice_status_counts WHERE invoice_count > 0"
+            )
+            payment_status = dict(rows)
+            
+            # Get recent invoices (walks the invoice_date index backwards)
+            columns, rows = self._run_read_query("""
+                SELECT invoice_number, customer_name, total_amount, payment_status, invoice_date
+                FROM invoices
+                ORDER BY invoice_date DESC
                 LIMIT 5
             """)
-            recent_invoices = cursor.fetchall()
-            
-            conn.close()
+            recent_invoices = [dict(zip(columns, row)) for row in rows]
             
             return {
                 "total_invoices": total_invoices,
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+WhatsApp Invoice Photo Ingestion
+Extracts supplier bills photographed and sent to the bot, saves them to
+the invoice database and messages the totals back to the owner.
+"""
+
+import os
+import logging
+import tempfile
+import threading
+from typing import Dict, Optional
+from config import Config
+from db import get_shop_id_by_phone
+from extraction_jobs import ExtractionJobQueue
+from item_reconciler import reconcile_invoice_items
+from voice_notes import download_media
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Replies sent once extraction finishes
+REPLY_MESSAGES = {
+    'en': {
+        'saved': "🧾 *Invoice saved*",
+        'number': "Invoice",
+        'billed_to': "Billed to",
+        'date': "Date",
+        'items': "Items",
+        'tax': "Tax",
+        'total': "Total",
+        'stock': "📦 Stock updated: {matched} items matched, {created} new items added",
+        'check': "⚠️ Please check: {issues}",
+        'failed': "Sorry, I couldn't read that invoice. Please send a clearer photo."
+    },
+    'hi': {
+        'saved': "🧾 *बिल सेव हो गया*",
+        'number': "बिल नंबर",
+        'billed_to': "किसके नाम",
+        'date': "तारीख",
+        'items': "आइटम",
+        'tax': "टैक्स",
+        'total': "कुल",
+        'stock': "📦 स्टॉक अपडेट: {matched} आइटम मिले, {created} नए आइटम जोड़े गए",
+        'check': "⚠️ कृपया जाँचें: {issues}",
+        'failed': "माफ़ करें, बिल पढ़ा नहीं जा सका। कृपया साफ़ फोटो भेजें।"
+    }
+}
+
+def format_amount(amount, currency: str = None) -> str:
+    """Format an amount with its currency for a WhatsApp message"""
+    if amount is None:
+        return '-'
+    try:
+        text = f"{float(amount):,.2f}"
+    except (TypeError, ValueError):
+        text = str(amount)
+    return f"{currency} {text}" if currency else text
+
+def format_invoice_reply(result: Dict, language: str = 'en') -> str:
+    """Summarise an extracted invoice for the owner"""
+    messages = REPLY_MESSAGES.get(language, REPLY_MESSAGES['en'])
+    invoice = result['extracted_data']
+    currency = invoice.get('currency')
+
+    lines = [messages['saved']]
+    # The schema has no vendor field; customer_name is the buyer, usually the shop itself
+    for key, field in (('number', 'invoice_number'), ('billed_to', 'customer_name'), ('date', 'invoice_date')):
+        if invoice.get(field):
+            lines.append(f"{messages[key]}: {invoice[field]}")
+    lines.append(f"{messages['items']}: {len(invoice.get('items') or [])}")
+    if invoice.get('tax_amount'):
+        lines.append(f"{messages['tax']}: {format_amount(invoice['tax_amount'], currency)}")
+    lines.append(f"*{messages['total']}: {format_amount(invoice.get('total_amount'), currency)}*")
+
+    reconciliation = result.get('reconciliation')
+    if reconciliation and reconciliation.get('lines'):
+        lines.append('')
+        lines.append(messages['stock'].format(**reconciliation))
+    if result.get('validation_issues'):
+        lines.append('')
+        lines.append(messages['check'].format(issues='; '.join(result['validation_issues'][:3])))
+    return '\n'.join(lines)
+
+class InvoicePhotoProcessor:
+    """Runs invoice extraction for WhatsApp photos on the extraction job queue.
+
+    submit() only queues a job, so the webhook reply never waits for a
+    vision call. The job downloads the photo, extracts and saves the
+    invoice, optionally applies its line items to the owner's catalog,
+    and its completion callback queues the totals on the outbox.
+    """
+
+    def __init__(self, outbox, extractor=None, jobs: ExtractionJobQueue = None):
+        self.outbox = outbox
+        self._extractor = extractor
+        self._extractor_lock = threading.Lock()
+        self.jobs = jobs or ExtractionJobQueue()
+
+    def get_extractor(self):
+        """Create the invoice extractor on first use, so the bot starts without it"""
+        with self._extractor_lock:
+            if self._extractor is None:
+                from invoice_extractor import InvoiceDataExtractor
+                self._extractor = InvoiceDataExtractor()
+            return self._extractor
+
+    def extract(self, phone_number: str, media_url: str, message_sid: str = None) -> Dict:
+        """Download, extract and save one invoice photo; raises if any step fails"""
+        with tempfile.TemporaryDirectory(prefix='invoice-photo-') as work_dir:
+            path = os.path.join(work_dir, 'photo')
+            download_media(media_url, path, max_bytes=Config.MAX_CONTENT_LENGTH)
+            with open(path, 'rb') as photo:
+                image_bytes = photo.read()
+
+        extractor = self.get_extractor()
+        source_file = f"whatsapp:{phone_number}:{message_sid or 'photo'}"
+        extraction = extractor.extract_record(image_bytes, source_file)
+        invoice_data = extraction['processed_data'] if extraction else None
+        if not invoice_data:
+            raise Exception("Failed to extract invoice data")
+
+        invoice_id = extractor.save_invoice_bundle(invoice_data, extraction)
+        if not invoice_id:
+            raise Exception("Failed to save invoice to database")
+
+        result = {
+            'invoice_id': invoice_id,
+            'extracted_data': invoice_data,
+            'confidence': extraction.get('confidence'),
+            'validation_issues': extraction.get('validation_issues') or [],
+            'reconciliation': None
+        }
+
+        # Apply the bill's line items to the owner's stock; the invoice is saved either way.
+        # A cache hit means this exact photo was extracted before, so its stock was already added
+        if Config.WHATSAPP_INVOICE_RECONCILE and extraction.get('cached'):
+            logger.info(f"Skipping stock update for repeated invoice photo from {phone_number}")
+        elif Config.WHATSAPP_INVOICE_RECONCILE:
+            try:
+                shop_id = get_shop_id_by_phone(phone_number)
+                if shop_id:
+                    result['reconciliation'] = reconcile_invoice_items(shop_id, invoice_ids=[invoice_id])
+            except Exception as e:
+                logger.error(f"Error reconciling invoice {invoice_id} for {phone_number}: {str(e)}")
+
+        return result
+
+    def _reply(self, job: Dict, phone_number: str, language: str) -> Optional[int]:
+        """Queue the extraction outcome for the owner"""
+        if job['status'] == 'succeeded':
+            body = format_invoice_reply(job['result'], language)
+        else:
+            body = REPLY_MESSAGES.get(language, REPLY_MESSAGES['en'])['failed']
+        return self.outbox.enqueue(phone_number, body)
+
+    def submit(self, phone_number: str, media_url: str, language: str = 'en', message_sid: str = None) -> str:
+        """Queue extraction of an invoice photo and return the job id; raises JobQueueFull when busy"""
+        return self.jobs.submit(
+            lambda: self.extract(phone_number, media_url, message_sid),
+            description=f"whatsapp:{phone_number}",
+            on_complete=lambda job: self._reply(job, phone_number, language)
+        )
@@ -0,0 +1,209 @@
+import re
+import json
+from typing import Dict
+
+# Invoice fields and their JSON types, shared by the prompt, provider schemas and validation
+INVOICE_FIELDS = {
+    "invoice_number": "string",
+    "invoice_date": "string",
+    "due_date": "string",
+    "customer_name": "string",
+    "customer_email": "string",
+    "customer_phone": "string",
+    "customer_address": "string",
+    "total_amount": "number",
+    "tax_amount": "number",
+    "discount_amount": "number",
+    "subtotal": "number",
+    "currency": "string",
+    "payment_status": "string",
+    "payment_method": "string",
+    "notes": "string"
+}
+
+ITEM_FIELDS = {
+    "item_name": "string",
+    "description": "string",
+    "quantity": "number",
+    "unit_price": "number",
+    "total_price": "number",
+    "tax_rate": "number",
+    "discount_rate": "number"
+}
+
+# Prompt shared by all extraction providers
+EXTRACTION_PROMPT = """
+Extract invoice data from this image and return it in the following JSON format:
+{
+    "invoice_number": "string",
+    "invoice_date": "YYYY-MM-DD",
+    "due_date": "YYYY-MM-DD",
+    "customer_name": "string",
+    "customer_email": "string",
+    "customer_phone": "string",
+    "customer_address": "string",
+    "total_amount": number,
+    "tax_amount": number,
+    "discount_amount": number,
+    "subtotal": number,
+    "currency": "string",
+    "payment_status": "string",
+    "payment_method": "string",
+    "notes": "string",
+    "items": [
+        {
+            "item_name": "string",
+            "description": "string",
+            "quantity": number,
+            "unit_price": number,
+            "total_price": number,
+            "tax_rate": number,
+            "discount_rate": number
+        }
+    ]
+}
+
+Extract all available information. If any field is not found, use null or empty string.
+"""
+
+def invoice_json_schema() -> Dict:
+    """Invoice schema in JSON Schema form, as used by OpenAI structured outputs"""
+    def properties(fields):
+        return {name: {"type": [json_type, "null"]} for name, json_type in fields.items()}
+
+    return {
+        "type": "object",
+        "properties": {
+            **properties(INVOICE_FIELDS),
+            "items": {
+                "type": "array",
+                "items": {"type": "object", "properties": properties(ITEM_FIELDS)}
+            }
+        }
+    }
+
+def invoice_gemini_schema() -> Dict:
+    """Invoice schema in the OpenAPI subset accepted by Gemini's response_schema"""
+    def properties(fields):
+        return {name: {"type": json_type, "nullable": True} for name, json_type in fields.items()}
+
+    return {
+        "type": "object",
+        "properties": {
+            **properties(INVOICE_FIELDS),
+            "items": {
+                "type": "array",
+                "items": {"type": "object", "properties": properties(ITEM_FIELDS)}
+            }
+        }
+    }
+
+def openai_response_format() -> Dict:
+    """response_format argument asking OpenAI for schema-shaped JSON"""
+    return {
+        "type": "json_schema",
+        "json_schema": {"name": "invoice", "schema": invoice_json_schema(), "strict": False}
+    }
+
+# Markdown code fences around model output
+_FENCE_PATTERN = re.compile(r"```(?:json|JSON)?\s*(.*?)(?:```|$)", re.DOTALL)
+# A closing bracket, possibly after whitespace
+_CLOSING_BRACKET_PATTERN = re.compile(r"\s*[}\]]")
+
+def _close_truncated_json(text: str) -> str:
+    """Close an unterminated string and any open objects or arrays"""
+    stack = []
+    in_string = False
+    escaped = False
+    for char in text:
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in '{[':
+            stack.append('}' if char == '{' else ']')
+        elif char in '}]' and stack:
+            stack.pop()
+
+    if in_string:
+        text += '"'
+    text = text.rstrip().rstrip(',')
+    if text.endswith(':'):
+        text += ' null'
+    return text + ''.join(reversed(stack))
+
+def _strip_trailing_commas(text: str) -> str:
+    """Remove commas directly before a closing bracket, leaving string contents alone"""
+    chars = []
+    in_string = False
+    escaped = False
+    for index, char in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char == ',' and _CLOSING_BRACKET_PATTERN.match(text, index + 1):
+            continue
+        chars.append(char)
+    return ''.join(chars)
+
+def parse_model_json(text: str) -> Dict:
+    """Parse JSON from a model response, repairing common problems locally.
+
+    Handles markdown fences, prose before or after the JSON, trailing
+    commas and output truncated mid-object. When a truncated tail cannot
+    be closed cleanly, trailing members are dropped until it parses.
+    Raises ValueError if no JSON object can be recovered.
+    """
+    if not text:
+        raise ValueError("Empty model response")
+
+    # A stray closing fence after bare JSON matches an empty block, so only use blocks holding JSON
+    fenced = _FENCE_PATTERN.search(text)
+    if fenced and ('{' in fenced.group(1) or '[' in fenced.group(1)):
+        text = fenced.group(1)
+
+    start = min((i for i in (text.find('{'), text.find('[')) if i != -1), default=-1)
+    if start == -1:
+        raise ValueError("No JSON object found in model response")
+    text = text[start:]
+
+    decoder = json.JSONDecoder()
+    # raw_decode ignores anything after the first complete value, such as trailing prose
+    try:
+        return decoder.raw_decode(text)[0]
+    except json.JSONDecodeError:
+        pass
+
+    candidate = _strip_trailing_commas(text)
+    while candidate:
+        try:
+            return decoder.raw_decode(_close_truncated_json(candidate))[0]
+        except json.JSONDecodeError:
+            # Drop the last, partially written member and try again
+            cut = max(candidate.rfind(','), candidate.rfind('{', 0, len(candidate) - 1), candidate.rfind('[', 0, len(candidate) - 1))
+            if cut < 0:
+                break
+            candidate = candidate[:cut] if candidate[cut] == ',' else candidate[:cut + 1]
+
+    raise ValueError("Could not repair JSON in model response")
+
+def normalize_invoice_shape(data) -> Dict:
+    """Check that a parsed extraction is an invoice object and keep only its object line items.
+
+    Raises ValueError when the model returned something other than a JSON object.
+    """
+    if not isinstance(data, dict):
+        raise ValueError(f"Expected a JSON object for the invoice, got {type(data).__name__}")
+    items = data.get('items')
+    return {**data, 'items': [item for item in items if isinstance(item, dict)] if isinstance(items, list) else []}
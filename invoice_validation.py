@@ -0,0 +1,158 @@
+import re
+import json
+import logging
+from typing import Dict, List, Optional
+from config import Config
+from invoice_schema import INVOICE_FIELDS, ITEM_FIELDS
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Fields that make an extraction usable; each missing one lowers confidence
+KEY_FIELDS = ['invoice_number', 'invoice_date', 'customer_name', 'total_amount']
+
+# Characters stripped from amounts such as "$1,234.50" or "Rs. 99"
+_AMOUNT_NOISE = re.compile(r"[^0-9.\-]")
+
+def to_number(value) -> Optional[float]:
+    """Parse an extracted amount, tolerating currency symbols and thousands separators"""
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    cleaned = _AMOUNT_NOISE.sub('', str(value))
+    try:
+        return float(cleaned) if cleaned else None
+    except ValueError:
+        return None
+
+def amounts_match(actual: float, expected: float) -> bool:
+    """Compare amounts within the configured absolute and relative tolerance"""
+    tolerance = max(Config.INVOICE_VALIDATION_TOLERANCE, abs(expected) * Config.INVOICE_VALIDATION_RELATIVE_TOLERANCE)
+    return abs(actual - expected) <= tolerance
+
+def _line_candidates(quantity: float, unit_price: float, item: Dict) -> List[float]:
+    """Possible line totals, with and without the line's discount and tax"""
+    gross = quantity * unit_price
+    discount_rate = to_number(item.get('discount_rate')) or 0.0
+    tax_rate = to_number(item.get('tax_rate')) or 0.0
+    discounted = gross * (1 - discount_rate / 100)
+    return [gross, discounted, discounted * (1 + tax_rate / 100)]
+
+def validate_invoice(invoice_data: Dict) -> Dict:
+    """Check an extraction's line and total arithmetic and score its confidence.
+
+    Runs three kinds of check: quantity x unit_price against each item's
+    total_price, the item totals against subtotal, and subtotal, tax and
+    discount against total_amount. Returns the checks, the issues found,
+    the fields implicated in failed checks and a confidence score in
+    [0, 1] combining arithmetic consistency with key-field completeness.
+    """
+    checks = []
+    failed_fields = []
+
+    def record(name, passed, fields, message):
+        checks.append({'check': name, 'passed': passed, 'message': None if passed else message})
+        if not passed:
+            failed_fields.extend(field for field in fields if field not in failed_fields)
+
+    items = invoice_data.get('items') or []
+    line_totals = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            continue
+        quantity = to_number(item.get('quantity'))
+        unit_price = to_number(item.get('unit_price'))
+        total_price = to_number(item.get('total_price'))
+        if total_price is not None:
+            line_totals.append(total_price)
+        if quantity is None or unit_price is None or total_price is None:
+            continue
+
+        candidates = _line_candidates(quantity, unit_price, item)
+        record(
+            f"items[{index}].total_price",
+            any(amounts_match(total_price, expected) for expected in candidates),
+            [f"items[{index}].quantity", f"items[{index}].unit_price", f"items[{index}].total_price"],
+            f"Item {index + 1}: {quantity:g} x {unit_price:.2f} = {candidates[0]:.2f}, but total_price is {total_price:.2f}"
+        )
+
+    subtotal = to_number(invoice_data.get('subtotal'))
+    tax_amount = to_number(invoice_data.get('tax_amount')) or 0.0
+    discount_amount = to_number(invoice_data.get('discount_amount')) or 0.0
+    total_amount = to_number(invoice_data.get('total_amount'))
+
+    if subtotal is not None and line_totals and len(line_totals) == len(items):
+        items_total = sum(line_totals)
+        record(
+            'subtotal',
+            amounts_match(subtotal, items_total),
+            ['subtotal'],
+            f"Item totals add up to {items_total:.2f}, but subtotal is {subtotal:.2f}"
+        )
+
+    if total_amount is not None:
+        base = subtotal if subtotal is not None else (sum(line_totals) if line_totals and len(line_totals) == len(items) else None)
+        if base is not None:
+            # Tax may already be included in the subtotal
+            candidates = [base + tax_amount - discount_amount, base - discount_amount]
+            record(
+                'total_amount',
+                any(amounts_match(total_amount, expected) for expected in candidates),
+                ['total_amount', 'tax_amount', 'discount_amount'] + (['subtotal'] if subtotal is not None else []),
+                f"Subtotal {base:.2f} + tax {tax_amount:.2f} - discount {discount_amount:.2f} = {candidates[0]:.2f}, "
+                f"but total_amount is {total_amount:.2f}"
+            )
+
+    present = sum(1 for field in KEY_FIELDS if invoice_data.get(field) not in (None, ''))
+    completeness = (present + (1 if items else 0)) / (len(KEY_FIELDS) + 1)
+    # With nothing to cross-check, arithmetic neither adds nor removes confidence
+    consistency = sum(check['passed'] for check in checks) / len(checks) if checks else 0.5
+    confidence = round(0.4 * completeness + 0.6 * consistency, 3)
+
+    return {
+        'valid': all(check['passed'] for check in checks),
+        'confidence': confidence,
+        'checks': checks,
+        'issues': [check['message'] for check in checks if not check['passed']],
+        'failed_fields': failed_fields
+    }
+
+def build_field_prompt(invoice_data: Dict, failed_fields: List[str], issues: List[str]) -> str:
+    """Prompt asking a provider to re-read only the fields that failed validation"""
+    current = {}
+    for path in failed_fields:
+        match = re.match(r"items\[(\d+)\]\.(\w+)", path)
+        if match:
+            item = invoice_data.get('items', [])[int(match.group(1))]
+            current[path] = {'item_name': item.get('item_name'), 'value': item.get(match.group(2))}
+        else:
+            current[path] = {'value': invoice_data.get(path)}
+
+    return f"""
+A previous read of this invoice image produced amounts that do not add up:
+{chr(10).join('- ' + issue for issue in issues)}
+
+Look at the image again and read ONLY these fields. Current values:
+{json.dumps(current, indent=2)}
+
+Return a JSON object whose keys are exactly the field paths above and whose
+values are the numbers printed on the invoice, e.g. {{"subtotal": 120.5, "items[0].quantity": 2}}.
+Use null if a value is not printed on the invoice.
+"""
+
+def apply_field_corrections(invoice_data: Dict, corrections: Dict, allowed_fields: List[str]) -> Dict:
+    """Return a copy of the invoice with corrected values for the requested field paths"""
+    corrected = {**invoice_data, 'items': [dict(item) for item in invoice_data.get('items') or []]}
+    for path, value in corrections.items():
+        if path not in allowed_fields or value is None:
+            continue
+        match = re.match(r"items\[(\d+)\]\.(\w+)", path)
+        if match:
+            index, field = int(match.group(1)), match.group(2)
+            if index < len(corrected['items']) and field in ITEM_FIELDS:
+                corrected['items'][index][field] = value
+        elif path in INVOICE_FIELDS:
+            corrected[path] = value
+    return corrected
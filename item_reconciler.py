@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+Invoice Item Reconciler
+Maps extracted invoice line items onto a shop's catalog in the items table
+and applies their cost prices and quantities.
+"""
+
+import json
+import math
+import time
+import uuid
+import logging
+import sqlite3
+import argparse
+import unicodedata
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Tuple
+from config import Config
+from db import get_shop_id_by_phone, get_shop_catalog, get_reconciled_invoice_item_ids, apply_catalog_updates
+from invoice_validation import to_number
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Database written by InvoiceDataExtractor
+INVOICE_DATABASE_FILE = 'invoice_data.db'
+
+# Catalog entries verified per lookup, taken in order of shared rare trigrams
+MATCH_CANDIDATES = 32
+
+def normalize_item_name(name: str) -> str:
+    """Casefold an item name and collapse punctuation and whitespace.
+
+    Letters, digits and combining marks of any script are kept, so
+    Devanagari names keep their vowel signs, which \\W would split on.
+    """
+    text = unicodedata.normalize('NFKC', str(name or '')).casefold()
+    return ' '.join(''.join(ch if unicodedata.category(ch)[0] in 'LNM' else ' ' for ch in text).split())
+
+def name_ngrams(normalized: str, n: int = 3) -> frozenset:
+    """Character n-grams of a normalized name, padded so word edges count"""
+    padded = f"  {normalized} "
+    return frozenset(padded[i:i + n] for i in range(len(padded) - n + 1))
+
+class ItemMatcher:
+    """Fuzzy name lookup over a catalog using an inverted trigram index.
+
+    Similarity is the Dice coefficient of the two names' trigram sets.
+    Lookups use prefix filtering: only catalog entries sharing one of the
+    query's rarest trigrams can reach `min_score`, so just those postings
+    are counted, and the MATCH_CANDIDATES entries sharing the most of
+    them are scored instead of the whole catalog.
+    """
+
+    def __init__(self, catalog: List[Tuple[str, str]], min_score: float = None):
+        self.min_score = Config.RECONCILE_MIN_SCORE if min_score is None else min_score
+        self.item_ids = []
+        self.names = []
+        self.grams = []
+        self.postings = defaultdict(list)
+        self.exact = {}
+        for item_id, name in catalog:
+            self.add(item_id, name)
+
+    def __len__(self):
+        return len(self.item_ids)
+
+    def add(self, item_id: str, name: str):
+        """Add a catalog item to the index"""
+        normalized = normalize_item_name(name)
+        if not normalized:
+            return
+
+        index = len(self.item_ids)
+        grams = name_ngrams(normalized)
+        self.item_ids.append(item_id)
+        self.names.append(name)
+        self.grams.append(grams)
+        for gram in grams:
+            self.postings[gram].append(index)
+        self.exact.setdefault(normalized, index)
+
+    def match(self, name: str) -> Optional[Tuple[str, str, float]]:
+        """Return (item_id, catalog_name, score) for the best match at or above min_score"""
+        normalized = normalize_item_name(name)
+        if not normalized:
+            return None
+
+        index = self.exact.get(normalized)
+        if index is not None:
+            return self.item_ids[index], self.names[index], 1.0
+
+        query = name_ngrams(normalized)
+        # Dice >= t needs at least t*|Q|/(2-t) shared grams, so one of the
+        # |Q| - that + 1 rarest grams must be shared by any viable candidate
+        required = max(1, math.ceil(self.min_score * len(query) / (2 - self.min_score)))
+        rarest = sorted(query, key=lambda gram: len(self.postings.get(gram, ())))
+
+        shared = Counter()
+        for gram in rarest[:len(query) - required + 1]:
+            shared.update(self.postings.get(gram, ()))
+
+        best_index, best_score = None, 0.0
+        for candidate, _ in shared.most_common(MATCH_CANDIDATES):
+            grams = self.grams[candidate]
+            score = 2 * len(query & grams) / (len(query) + len(grams))
+            if score > best_score:
+                best_index, best_score = candidate, score
+
+        if best_index is None or best_score < self.min_score:
+            return None
+        return self.item_ids[best_index], self.names[best_index], round(best_score, 4)
+
+def get_invoice_line_items(invoice_ids: List[str] = None) -> List[Dict]:
+    """Read line items from the invoice database, optionally for specific invoices"""
+    try:
+        conn = sqlite3.connect(INVOICE_DATABASE_FILE)
+        cursor = conn.cursor()
+
+        query = 'SELECT id, invoice_id, item_name, quantity, unit_price, total_price FROM invoice_items'
+        params = []
+        if invoice_ids:
+            query += f" WHERE invoice_id IN ({', '.join('?' * len(invoice_ids))})"
+            params = list(invoice_ids)
+
+        cursor.execute(query, params)
+        columns = [description[0] for description in cursor.description]
+        results = [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+        conn.close()
+        return results
+
+    except Exception as e:
+        logger.error(f"Error reading invoice line items: {str(e)}")
+        return []
+
+def line_cost_price(line: Dict) -> Optional[float]:
+    """Unit cost of an invoice line, falling back to total_price / quantity"""
+    unit_price = to_number(line.get('unit_price'))
+    if unit_price:
+        return unit_price
+    quantity = to_number(line.get('quantity'))
+    total_price = to_number(line.get('total_price'))
+    if quantity and total_price:
+        return round(total_price / quantity, 2)
+    return None
+
+def reconcile_invoice_items(shop_id: str, invoice_ids: List[str], min_score: float = None,
+                            create_missing: bool = None) -> Dict:
+    """Apply the line items of the given invoices to a shop's catalog.
+
+    The invoice database is not scoped by shop, so the caller names the
+    invoices that belong to it. Each unreconciled line is matched to a
+    catalog item by name. Matched items get the line's cost price and
+    have its quantity added to stock_quantity; unmatched lines become new
+    catalog items when `create_missing` is on. All writes happen in one
+    transaction, and a line changes stock only if its ledger row is
+    inserted there, so re-runs and concurrent runs skip applied lines.
+    Returns a summary with throughput in line items per second.
+    """
+    if not invoice_ids:
+        raise ValueError("invoice_ids is required; the invoice database holds every shop's invoices")
+    create_missing = Config.RECONCILE_CREATE_MISSING if create_missing is None else create_missing
+    started = time.perf_counter()
+
+    matcher = ItemMatcher(get_shop_catalog(shop_id), min_score=min_score)
+    index_ms = (time.perf_counter() - started) * 1000
+
+    already_applied = get_reconciled_invoice_item_ids(shop_id)
+    all_lines = get_invoice_line_items(invoice_ids)
+    lines = [line for line in all_lines if line['id'] not in already_applied]
+
+    new_items = {}
+    matches = []
+    unmatched = []
+    match_started = time.perf_counter()
+
+    for line in lines:
+        if not line.get('item_name'):
+            unmatched.append(line)
+            continue
+
+        match = matcher.match(line['item_name'])
+        if match is None and create_missing:
+            # Later lines for the same product should match the new item
+            item_id = str(uuid.uuid4())
+            matcher.add(item_id, line['item_name'])
+            new_items[item_id] = line['item_name']
+            match = (item_id, line['item_name'], 1.0)
+        if match is None:
+            unmatched.append(line)
+            continue
+
+        item_id, _, score = match
+        matches.append((line['id'], item_id, score, line_cost_price(line), to_number(line.get('quantity')) or 0.0))
+
+    match_seconds = time.perf_counter() - match_started
+
+    # Lines are applied only if this run records them in the ledger first, so a concurrent run cannot double stock
+    applied = apply_catalog_updates(shop_id, list(new_items.items()), matches)
+    applied_ids = set(applied or ())
+    applied_matches = [match for match in matches if match[0] in applied_ids]
+    created = {item_id for _, item_id, *_ in applied_matches if item_id in new_items}
+
+    elapsed = time.perf_counter() - started
+    summary = {
+        "shop_id": shop_id,
+        "catalog_items": len(matcher) - len(new_items),
+        "lines": len(lines),
+        "skipped": len(all_lines) - len(lines) + len(matches) - len(applied_matches),
+        "matched": len(applied_matches) - sum(1 for _, item_id, *_ in applied_matches if item_id in new_items),
+        "created": len(created),
+        "unmatched": [line.get('item_name') for line in unmatched],
+        "applied": applied is not None,
+        "index_build_ms": round(index_ms, 2),
+        "avg_lookup_us": round(match_seconds / len(lines) * 1e6, 1) if lines else 0.0,
+        "elapsed_seconds": round(elapsed, 3),
+        "items_per_second": round(len(lines) / elapsed, 1) if elapsed > 0 else 0.0
+    }
+    logger.info(
+        f"Reconciled {summary['lines']} invoice lines for shop {shop_id}: {summary['matched']} matched, "
+        f"{summary['created']} created, {len(unmatched)} unmatched ({summary['items_per_second']} items/s)"
+    )
+    return summary
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Apply extracted invoice line items to a shop's catalog")
+    shop = parser.add_mutually_exclusive_group(required=True)
+    shop.add_argument('--shop-id')
+    shop.add_argument('--shop-phone', help="Owner phone number, e.g. +1234567890")
+    parser.add_argument('--invoice-id', action='append', required=True,
+                        help="Invoice belonging to the shop to reconcile (repeatable)")
+    parser.add_argument('--min-score', type=float, help="Minimum trigram similarity for a match (0-1)")
+    parser.add_argument('--no-create', action='store_true', help="Do not add unmatched lines as new items")
+    args = parser.parse_args()
+
+    shop_id = args.shop_id or get_shop_id_by_phone(args.shop_phone)
+    if not shop_id:
+        parser.error(f"No shop found for {args.shop_phone}")
+
+    summary = reconcile_invoice_items(
+        shop_id,
+        invoice_ids=args.invoice_id,
+        min_score=args.min_score,
+        create_missing=False if args.no_create else None
+    )
+    print(json.dumps(summary, indent=2))
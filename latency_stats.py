@@ -0,0 +1,15 @@
+"""
+Latency Statistics
+Percentile helper shared by the extraction job queue and the load and
+benchmark drivers, kept free of their heavier imports.
+"""
+
+import math
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = math.ceil(pct / 100.0 * len(ordered))
+    return ordered[max(0, min(len(ordered), rank) - 1)]
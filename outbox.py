@@ -0,0 +1,403 @@
+import time
+import logging
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from config import Config
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# HTTP status codes from Twilio that are worth retrying
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+
+class OutboxSendError(Exception):
+    """Raised when the messaging provider rejects or fails a send"""
+
+    def __init__(self, message, retryable=True):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class RateLimiter:
+    """Thread-safe token bucket limiting calls to `rate` per second"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst or max(1, rate))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available"""
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class MessageOutbox:
+    """SQLite-backed outbox for outbound WhatsApp messages.
+
+    Producers call enqueue() which is a single INSERT. A background sender
+    thread claims due messages, delivers them through a pool of keep-alive
+    HTTP sessions, retries failures with exponential backoff and moves
+    messages that keep failing to the dead-letter state.
+    """
+
+    def __init__(self, db_file=None, max_workers=None, max_attempts=None,
+                 backoff_base=None, backoff_max=None, poll_interval=None, rate_limit=None):
+        self.db_file = db_file or Config.OUTBOX_DATABASE_FILE
+        self.max_workers = max_workers or Config.OUTBOX_MAX_WORKERS
+        self.max_attempts = max_attempts or Config.OUTBOX_MAX_ATTEMPTS
+        self.backoff_base = backoff_base or Config.OUTBOX_BACKOFF_BASE
+        self.backoff_max = backoff_max or Config.OUTBOX_BACKOFF_MAX
+        self.poll_interval = poll_interval or Config.OUTBOX_POLL_INTERVAL
+
+        # Shared by every sender thread so the provider limit holds process-wide
+        self.rate_limiter = RateLimiter(
+            rate_limit if rate_limit is not None else Config.TWILIO_MAX_MESSAGES_PER_SECOND
+        )
+
+        self.api_url = (
+            f"{Config.TWILIO_API_BASE_URL.rstrip('/')}/2010-04-01/Accounts/"
+            f"{Config.TWILIO_ACCOUNT_SID}/Messages.json"
+        )
+
+        self._local = threading.local()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._executor = None
+
+        self.create_outbox_table()
+
+    def _connect(self):
+        """Open a connection to the outbox database"""
+        conn = sqlite3.connect(self.db_file, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def create_outbox_table(self):
+        """Create the outbox table and its indexes"""
+        try:
+            conn = self._connect()
+            # WAL lets request handlers enqueue while the sender is updating rows
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS outbox_messages (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    to_number TEXT NOT NULL,
+                    body TEXT NOT NULL,
+                    status TEXT DEFAULT 'pending',
+                    attempts INTEGER DEFAULT 0,
+                    next_attempt_at REAL DEFAULT 0,
+                    last_error TEXT,
+                    provider_sid TEXT,
+                    created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                    sent_at TEXT
+                )
+            ''')
+            conn.execute('''
+                CREATE INDEX IF NOT EXISTS idx_outbox_due
+                ON outbox_messages (status, next_attempt_at)
+            ''')
+            conn.commit()
+            conn.close()
+        except Exception as e:
+            logger.error(f"Error creating outbox table: {str(e)}")
+
+    def enqueue(self, to_number, body):
+        """Queue a message for delivery and return its outbox id"""
+        conn = self._connect()
+        try:
+            cursor = conn.execute(
+                'INSERT INTO outbox_messages (to_number, body, next_attempt_at) VALUES (?, ?, ?)',
+                (to_number, body, time.time())
+            )
+            conn.commit()
+            message_id = cursor.lastrowid
+        finally:
+            conn.close()
+
+        self._wakeup.set()
+        logger.info(f"Queued message {message_id} for {to_number}")
+        return message_id
+
+    def send_now(self, to_number, body):
+        """Record a message and try to deliver it immediately from the calling thread.
+
+        The message is written to the outbox first, so a failed attempt is
+        retried by the background sender. Returns (message_id, status) where
+        status is 'sent', 'queued' for a retry in the background, or 'dead'
+        when the provider rejected it with a non-retryable error.
+        """
+        conn = self._connect()
+        try:
+            cursor = conn.execute(
+                "INSERT INTO outbox_messages (to_number, body, status, next_attempt_at) VALUES (?, ?, 'sending', ?)",
+                (to_number, body, time.time())
+            )
+            conn.commit()
+            message_id = cursor.lastrowid
+        finally:
+            conn.close()
+
+        status = self._process_message({'id': message_id, 'to_number': to_number, 'body': body, 'attempts': 0})
+        if status == 'queued':
+            self._wakeup.set()
+        return message_id, status
+
+    def get_message(self, message_id):
+        """Get a single outbox message as a dictionary"""
+        conn = self._connect()
+        try:
+            row = conn.execute('SELECT * FROM outbox_messages WHERE id = ?', (message_id,)).fetchone()
+            return dict(row) if row else None
+        finally:
+            conn.close()
+
+    def get_dead_letters(self, limit=100):
+        """Get messages that exhausted their retries"""
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT * FROM outbox_messages WHERE status = 'dead' ORDER BY id DESC LIMIT ?",
+                (limit,)
+            ).fetchall()
+            return [dict(row) for row in rows]
+        finally:
+            conn.close()
+
+    def requeue_dead_letters(self):
+        """Move all dead-lettered messages back to pending"""
+        conn = self._connect()
+        try:
+            cursor = conn.execute(
+                "UPDATE outbox_messages SET status = 'pending', attempts = 0, next_attempt_at = ? "
+                "WHERE status = 'dead'",
+                (time.time(),)
+            )
+            conn.commit()
+            count = cursor.rowcount
+        finally:
+            conn.close()
+
+        self._wakeup.set()
+        return count
+
+    def _claim_due_messages(self, limit):
+        """Atomically mark up to `limit` due messages as sending and return them"""
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            rows = conn.execute(
+                "SELECT id, to_number, body, attempts FROM outbox_messages "
+                "WHERE status = 'pending' AND next_attempt_at <= ? "
+                "ORDER BY next_attempt_at LIMIT ?",
+                (time.time(), limit)
+            ).fetchall()
+            conn.executemany(
+                "UPDATE outbox_messages SET status = 'sending' WHERE id = ?",
+                [(row['id'],) for row in rows]
+            )
+            conn.commit()
+            return [dict(row) for row in rows]
+        finally:
+            conn.close()
+
+    def _next_due_in(self):
+        """Seconds until the next pending message is due, or None if the outbox is empty"""
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT MIN(next_attempt_at) FROM outbox_messages WHERE status = 'pending'"
+            ).fetchone()
+        finally:
+            conn.close()
+
+        if row[0] is None:
+            return None
+        return max(0.0, row[0] - time.time())
+
+    def _get_session(self):
+        """Get this thread's keep-alive HTTP session"""
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            session.auth = (Config.TWILIO_ACCOUNT_SID, Config.TWILIO_AUTH_TOKEN)
+            session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=1))
+            session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=1))
+            self._local.session = session
+        return session
+
+    def deliver(self, to_number, body):
+        """Send one message through the Twilio REST API and return its SID"""
+        self.rate_limiter.acquire()
+        try:
+            response = self._get_session().post(
+                self.api_url,
+                data={
+                    'From': f'whatsapp:{Config.TWILIO_WHATSAPP_NUMBER}',
+                    'To': f'whatsapp:{to_number}',
+                    'Body': body
+                },
+                timeout=Config.OUTBOX_REQUEST_TIMEOUT
+            )
+        except requests.RequestException as e:
+            raise OutboxSendError(f"Request to messaging provider failed: {str(e)}")
+
+        if response.status_code >= 400:
+            raise OutboxSendError(
+                f"Messaging provider returned {response.status_code}: {response.text[:200]}",
+                retryable=response.status_code in RETRYABLE_STATUS_CODES
+            )
+
+        return response.json().get('sid')
+
+    def _backoff_delay(self, attempts):
+        """Exponential backoff delay in seconds for the given attempt count"""
+        return min(self.backoff_max, self.backoff_base * (2 ** (attempts - 1)))
+
+    def _process_message(self, message):
+        """Deliver a claimed message, record the outcome and return 'sent', 'queued' or 'dead'"""
+        attempts = message['attempts'] + 1
+        try:
+            sid = self.deliver(message['to_number'], message['body'])
+        except OutboxSendError as e:
+            return self._record_failure(message['id'], attempts, str(e), e.retryable)
+        except Exception as e:
+            return self._record_failure(message['id'], attempts, str(e), True)
+
+        conn = self._connect()
+        try:
+            conn.execute(
+                "UPDATE outbox_messages SET status = 'sent', attempts = ?, provider_sid = ?, "
+                "last_error = NULL, sent_at = CURRENT_TIMESTAMP WHERE id = ?",
+                (attempts, sid, message['id'])
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+        logger.info(f"Sent outbox message {message['id']} to {message['to_number']} (SID: {sid})")
+        return 'sent'
+
+    def _record_failure(self, message_id, attempts, error, retryable):
+        """Reschedule a failed message with backoff or dead-letter it, returning 'queued' or 'dead'"""
+        conn = self._connect()
+        try:
+            status = 'queued' if retryable and attempts < self.max_attempts else 'dead'
+            if status == 'queued':
+                delay = self._backoff_delay(attempts)
+                conn.execute(
+                    "UPDATE outbox_messages SET status = 'pending', attempts = ?, last_error = ?, "
+                    "next_attempt_at = ? WHERE id = ?",
+                    (attempts, error, time.time() + delay, message_id)
+                )
+                logger.warning(f"Outbox message {message_id} failed (attempt {attempts}), retrying in {delay:.1f}s: {error}")
+            else:
+                conn.execute(
+                    "UPDATE outbox_messages SET status = 'dead', attempts = ?, last_error = ? WHERE id = ?",
+                    (attempts, error, message_id)
+                )
+                logger.error(f"Outbox message {message_id} dead-lettered after {attempts} attempts: {error}")
+            conn.commit()
+        finally:
+            conn.close()
+        return status
+
+    def drain(self):
+        """Deliver every message that is currently due and return the number processed"""
+        processed = 0
+        executor = self._executor or ThreadPoolExecutor(max_workers=self.max_workers)
+        try:
+            while True:
+                batch = self._claim_due_messages(self.max_workers * 4)
+                if not batch:
+                    break
+                list(executor.map(self._process_message, batch))
+                processed += len(batch)
+        finally:
+            if executor is not self._executor:
+                executor.shutdown(wait=True)
+        return processed
+
+    def _run(self):
+        """Background sender loop"""
+        logger.info("Outbox sender started")
+        while not self._stopping.is_set():
+            try:
+                self.drain()
+                wait = self._next_due_in()
+            except Exception as e:
+                logger.error(f"Error in outbox sender: {str(e)}")
+                wait = self.poll_interval
+
+            # Sleep until the next retry is due or a producer wakes us up
+            if wait is None or wait > self.poll_interval:
+                wait = self.poll_interval
+            self._wakeup.wait(wait)
+            self._wakeup.clear()
+        logger.info("Outbox sender stopped")
+
+    def start(self):
+        """Start the background sender thread"""
+        if self._thread and self._thread.is_alive():
+            return
+
+        # Messages left in 'sending' by a crashed worker are retried
+        conn = self._connect()
+        try:
+            conn.execute("UPDATE outbox_messages SET status = 'pending' WHERE status = 'sending'")
+            conn.commit()
+        finally:
+            conn.close()
+
+        self._stopping.clear()
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='outbox')
+        self._thread = threading.Thread(target=self._run, name='outbox-sender', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=10):
+        """Stop the background sender thread"""
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+        if self._executor:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+# Shared outbox used by the app and the expiry alerts
+_default_outbox = None
+_default_outbox_lock = threading.Lock()
+
+
+def get_outbox():
+    """Get the process-wide message outbox"""
+    global _default_outbox
+    with _default_outbox_lock:
+        if _default_outbox is None:
+            _default_outbox = MessageOutbox()
+        return _default_outbox
+
+
+def enqueue_message(to_number, body):
+    """Queue a WhatsApp message on the shared outbox"""
+    return get_outbox().enqueue(to_number, body)
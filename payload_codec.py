@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+Extraction Payload Codec
+Compresses the raw_data and processed_data columns of extracted_data and
+migrates existing rows to the compressed format.
+"""
+
+import json
+import time
+import zlib
+import logging
+import sqlite3
+import argparse
+from typing import Dict, Optional, Union
+from config import Config
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Database written by InvoiceDataExtractor
+INVOICE_DATABASE_FILE = 'invoice_data.db'
+
+# Blob layout: MAGIC, FORMAT_VERSION byte, codec byte, then the (compressed) UTF-8 text
+MAGIC = b'XP'
+FORMAT_VERSION = 1
+CODEC_IDS = {'none': 0, 'zlib': 1, 'zstd': 2}
+CODEC_NAMES = {codec_id: name for name, codec_id in CODEC_IDS.items()}
+HEADER_SIZE = len(MAGIC) + 2
+
+def active_codec() -> str:
+    """Codec used for new payloads, falling back to zlib when zstandard is not installed"""
+    codec = Config.EXTRACTION_PAYLOAD_CODEC.lower()
+    if codec == 'zstd' and zstandard is None:
+        return 'zlib'
+    return codec if codec in CODEC_IDS else 'zlib'
+
+def compress_payload(text: Optional[str], codec: str = None) -> Optional[bytes]:
+    """Encode text as a versioned, compressed blob.
+
+    Text that does not get smaller is stored uncompressed under the
+    'none' codec, so short payloads never grow by more than the header.
+    """
+    if text is None:
+        return None
+
+    codec = codec or active_codec()
+    data = text.encode('utf-8')
+    level = Config.EXTRACTION_PAYLOAD_COMPRESSION_LEVEL
+
+    if codec == 'zstd':
+        compressed = zstandard.ZstdCompressor(level=level).compress(data)
+    elif codec == 'zlib':
+        compressed = zlib.compress(data, level)
+    else:
+        compressed = data
+
+    if len(compressed) >= len(data):
+        codec, compressed = 'none', data
+    return MAGIC + bytes([FORMAT_VERSION, CODEC_IDS[codec]]) + compressed
+
+def is_compressed_payload(value) -> bool:
+    """Check if a column value is in the compressed blob format"""
+    return isinstance(value, bytes) and value[:len(MAGIC)] == MAGIC
+
+def decompress_payload(value: Union[str, bytes, None]) -> Optional[str]:
+    """Decode a column value to text; legacy TEXT values are returned unchanged"""
+    if value is None or isinstance(value, str):
+        return value
+    if not is_compressed_payload(value):
+        return value.decode('utf-8')
+
+    version, codec_id = value[len(MAGIC)], value[len(MAGIC) + 1]
+    if version != FORMAT_VERSION:
+        raise ValueError(f"Unsupported payload format version {version}")
+
+    body = value[HEADER_SIZE:]
+    codec = CODEC_NAMES.get(codec_id)
+    if codec == 'zlib':
+        body = zlib.decompress(body)
+    elif codec == 'zstd':
+        if zstandard is None:
+            raise ValueError("Payload is zstd-compressed but zstandard is not installed")
+        body = zstandard.ZstdDecompressor().decompress(body)
+    elif codec != 'none':
+        raise ValueError(f"Unknown payload codec {codec_id}")
+    return body.decode('utf-8')
+
+def load_json_payload(value: Union[str, bytes, None]):
+    """Decode a processed_data column value to its JSON object"""
+    text = decompress_payload(value)
+    return json.loads(text) if text is not None else None
+
+def payload_size(value) -> int:
+    """Stored size in bytes of a column value"""
+    if value is None:
+        return 0
+    return len(value) if isinstance(value, bytes) else len(value.encode('utf-8'))
+
+def migrate_extracted_data(db_file: str = INVOICE_DATABASE_FILE, batch_size: int = 500,
+                           vacuum: bool = False) -> Dict:
+    """Compress raw_data and processed_data of rows still stored as text.
+
+    Rows are rewritten in batches of `batch_size`, one transaction each, so
+    an interrupted migration resumes where it stopped. SQLite only returns
+    freed pages to the filesystem on VACUUM, which `vacuum` runs at the end.
+    Returns the payload and file size reduction.
+    """
+    started = time.perf_counter()
+    codec = active_codec()
+    conn = sqlite3.connect(db_file, timeout=30)
+    cursor = conn.cursor()
+    file_bytes_before = _database_file_size(cursor)
+
+    rows_migrated = 0
+    bytes_before = 0
+    bytes_after = 0
+    last_rowid = 0
+    while True:
+        cursor.execute('''
+            SELECT rowid, raw_data, processed_data FROM extracted_data
+            WHERE rowid > ? AND (typeof(raw_data) = 'text' OR typeof(processed_data) = 'text')
+            ORDER BY rowid
+            LIMIT ?
+        ''', (last_rowid, batch_size))
+        rows = cursor.fetchall()
+        if not rows:
+            break
+
+        updates = []
+        for rowid, raw_data, processed_data in rows:
+            new_raw = raw_data if is_compressed_payload(raw_data) else compress_payload(decompress_payload(raw_data), codec)
+            new_processed = processed_data if is_compressed_payload(processed_data) else compress_payload(decompress_payload(processed_data), codec)
+            bytes_before += payload_size(raw_data) + payload_size(processed_data)
+            bytes_after += payload_size(new_raw) + payload_size(new_processed)
+            updates.append((new_raw, new_processed, rowid))
+
+        with conn:
+            cursor.executemany('UPDATE extracted_data SET raw_data = ?, processed_data = ? WHERE rowid = ?', updates)
+        rows_migrated += len(rows)
+        last_rowid = rows[-1][0]
+
+    if vacuum and rows_migrated:
+        conn.execute('VACUUM')
+    file_bytes_after = _database_file_size(cursor)
+    conn.close()
+
+    summary = {
+        'codec': codec,
+        'rows_migrated': rows_migrated,
+        'payload_bytes_before': bytes_before,
+        'payload_bytes_after': bytes_after,
+        'payload_bytes_saved': bytes_before - bytes_after,
+        'payload_ratio': round(bytes_before / bytes_after, 2) if bytes_after else 0.0,
+        'file_bytes_before': file_bytes_before,
+        'file_bytes_after': file_bytes_after,
+        'vacuumed': bool(vacuum and rows_migrated),
+        'elapsed_seconds': round(time.perf_counter() - started, 3)
+    }
+    logger.info(
+        f"Compressed {rows_migrated} extraction rows with {codec}: {bytes_before} -> {bytes_after} payload bytes "
+        f"({summary['payload_ratio']}x)"
+    )
+    return summary
+
+def _database_file_size(cursor) -> int:
+    cursor.execute('PRAGMA page_count')
+    page_count = cursor.fetchone()[0]
+    cursor.execute('PRAGMA page_size')
+    return page_count * cursor.fetchone()[0]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compress stored extraction payloads in the invoice database")
+    parser.add_argument('--db', default=INVOICE_DATABASE_FILE, help="Invoice database file")
+    parser.add_argument('--batch-size', type=int, default=500, help="Rows rewritten per transaction")
+    parser.add_argument('--vacuum', action='store_true', help="VACUUM afterwards to shrink the database file")
+    args = parser.parse_args()
+
+    print(json.dumps(migrate_extracted_data(args.db, batch_size=args.batch_size, vacuum=args.vacuum), indent=2))
@@ -1,17 +1,21 @@
+import sys
 import requests
+from config import Config
 
-url = "https://api.sarvam.ai/speech-to-text"
+url = f"{Config.SARVAM_API_BASE_URL.rstrip('/')}/speech-to-text"
 payload = {
-    'model': 'saarika:v1',
+    'model': Config.SARVAM_STT_MODEL,
     'language_code': 'hi-IN',
     'with_timestamps': 'false'
 }
-files = [
-    ('file', ('audio.wav', open('Recording (8).wav', 'rb'), 'audio/wav'))
-]
+audio_path = sys.argv[1] if len(sys.argv) > 1 else 'Recording (8).wav'
 headers = {
-    'api-subscription-key': 'sk_xwpyz1yp_ai9KCro5vn7r15YtStWA6lpg'
+    'api-subscription-key': Config.SARVAM_API_KEY
 }
 
-response = requests.post(url, headers=headers, data=payload, files=files)
+with open(audio_path, 'rb') as audio_file:
+    files = [
+        ('file', ('audio.wav', audio_file, 'audio/wav'))
+    ]
+    response = requests.post(url, headers=headers, data=payload, files=files)
 print(response.text)
@@ -1,12 +1,15 @@
 #!/usr/bin/env python3
 """
 Upload Invoice Image Script
-Uploads image.png to the invoice extraction API
+Uploads image.png to the invoice extraction API, or many images, folders
+and zip archives in one request: python upload_invoice.py a.png invoices/ batch.zip
 """
 
 import requests
 import json
+import sys
 import os
+from contextlib import ExitStack
 
 def upload_invoice_image():
     """Upload invoice image to the API"""
@@ -45,6 +48,82 @@ def upload_invoice_image():
     except Exception as e:
         print(f"❌ Error: {str(e)}")
 
+def read_events(response):
+    """Yield (event, data) pairs from a server-sent event stream"""
+    event, data = 'message', []
+    for line in response.iter_lines(decode_unicode=True):
+        if not line:
+            if data:
+                yield event, json.loads('\n'.join(data))
+            event, data = 'message', []
+        elif line.startswith('event:'):
+            event = line[6:].strip()
+        elif line.startswith('data:'):
+            data.append(line[5:].strip())
+
+def list_upload_files(paths):
+    """Expand folders into the files they contain"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                files.extend(os.path.join(root, name) for name in sorted(names))
+        else:
+            files.append(path)
+    return files
+
+def upload_invoice_batch(paths, batch_id=None):
+    """Upload many invoice images or zip archives in one request and print progress as it streams back"""
+    
+    url = "http://localhost:5002/upload-invoices"
+    
+    files = list_upload_files(paths)
+    missing = [path for path in files if not os.path.exists(path)]
+    if missing:
+        print(f"❌ Error: {', '.join(missing)} not found")
+        return
+    
+    print(f"📤 Uploading {len(files)} files to invoice extraction API...")
+    
+    try:
+        with ExitStack() as stack:
+            upload = [
+                ('files', (os.path.basename(path), stack.enter_context(open(path, 'rb'))))
+                for path in files
+            ]
+            data = {'batch_id': batch_id} if batch_id else {}
+            response = requests.post(url, files=upload, data=data, stream=True)
+            
+            if response.status_code != 200:
+                print(f"❌ Upload failed with status {response.status_code}")
+                print(f"Error: {response.text}")
+                return
+            
+            saved = 0
+            for event, payload in read_events(response):
+                if event == 'start':
+                    print(f"🗂️  Batch {payload['batch_id']}: {payload['files']} images")
+                    for name in payload['ignored']:
+                        print(f"   ⏭️  Ignored {name}")
+                elif event == 'extracted':
+                    mark = '🔍' if payload['status'] == 'completed' else '❌'
+                    print(f"   {mark} {payload['file']} ({payload['duration_seconds']}s) {payload['error'] or ''}")
+                elif event == 'saved' and payload['status'] == 'completed':
+                    saved += 1
+                    print(f"   ✅ {payload['file']} → invoice {payload['invoice_id']} ({saved} saved)")
+                elif event == 'done':
+                    print(f"\n🎯 Done: {payload['completed']} completed, {payload['failed']} failed, "
+                          f"{payload['skipped']} skipped in {payload['elapsed_seconds']}s")
+                    return payload
+                elif event == 'error':
+                    print(f"❌ Batch failed: {payload['error']}")
+            
+    except requests.exceptions.ConnectionError:
+        print("❌ Error: Could not connect to API server")
+        print("Make sure the invoice API is running on http://localhost:5002")
+    except Exception as e:
+        print(f"❌ Error: {str(e)}")
+
 def get_invoice_summary():
     """Get invoice summary from database"""
     
@@ -65,8 +144,11 @@ if __name__ == "__main__":
     print("=== INVOICE UPLOAD SCRIPT ===")
     print()
     
-    # Upload the invoice
-    upload_invoice_image()
+    # Upload the invoice, or everything named on the command line in one batch
+    if len(sys.argv) > 1:
+        upload_invoice_batch(sys.argv[1:])
+    else:
+        upload_invoice_image()
     
     print("\n" + "="*50)
     
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+Content-Addressed Upload Store
+Keeps archived invoice uploads under their SHA-256 hash in sharded
+directories and removes files no extraction needs any more.
+"""
+
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+import sqlite3
+import argparse
+import tempfile
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Dict
+from config import Config
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Database written by InvoiceDataExtractor, whose extracted_data.source_file references stored files
+INVOICE_DATABASE_FILE = 'invoice_data.db'
+
+# Names the store itself creates: shard directories, stored files and in-flight temp files
+_SHARD_PATTERN = re.compile(r'^[0-9a-f]{2}$')
+_HASH_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+_TEMP_PREFIX = '.upload-'
+
+class UploadStore:
+    """Upload files stored as <root>/<hash[:2]>/<hash[2:4]>/<hash>.
+
+    Identical content maps to the same path, so storing a duplicate is a
+    stat instead of a write, and uploads can never overwrite each other.
+    A file's references are the extracted_data rows whose source_file is
+    its path; collect_garbage() deletes files nothing references and
+    files whose newest reference is past the retention period.
+    """
+
+    def __init__(self, root: str = None, db_file: str = INVOICE_DATABASE_FILE):
+        self.root = root or Config.UPLOAD_STORE_DIR
+        self.db_file = db_file
+        self._gc_lock = threading.Lock()
+        self._last_gc = 0.0
+        os.makedirs(self.root, exist_ok=True)
+
+    def path_for(self, content_hash: str) -> str:
+        """Sharded path for a content hash"""
+        return os.path.join(self.root, content_hash[:2], content_hash[2:4], content_hash)
+
+    def store(self, data: bytes) -> str:
+        """Store bytes under their content hash and return the path"""
+        path = self.path_for(hashlib.sha256(data).hexdigest())
+
+        if os.path.exists(path):
+            # Refresh mtime so the GC grace period restarts for the new upload
+            os.utime(path)
+            logger.info(f"Upload already stored at {path}")
+        else:
+            directory = os.path.dirname(path)
+            os.makedirs(directory, exist_ok=True)
+            # Write to a temporary file and rename, so readers never see a partial file
+            fd, temp_path = tempfile.mkstemp(dir=directory, prefix=_TEMP_PREFIX)
+            try:
+                with os.fdopen(fd, 'wb') as temp_file:
+                    temp_file.write(data)
+                os.replace(temp_path, path)
+            except Exception:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                raise
+            logger.info(f"Stored upload at {path} ({len(data)} bytes)")
+
+        self.maybe_collect_garbage()
+        return path
+
+    def _get_references(self) -> Dict[str, str]:
+        """Map each referenced path under the store root to its newest extraction date"""
+        if not os.path.exists(self.db_file):
+            return {}
+
+        conn = sqlite3.connect(self.db_file)
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            SELECT source_file, MAX(extraction_date)
+            FROM extracted_data
+            WHERE source_file LIKE ?
+            GROUP BY source_file
+        ''', (os.path.join(self.root, '') + '%',))
+        results = {os.path.normpath(source_file): newest for source_file, newest in cursor.fetchall()}
+
+        conn.close()
+        return results
+
+    def _iter_store_files(self):
+        """Yield (path, stat) for files in the <aa>/<bb>/<hash> layout and the store's temp files.
+
+        Anything else under the root, such as uploads saved before the
+        content-addressed layout, is not the store's to manage and is
+        never yielded.
+        """
+        for first in sorted(os.listdir(self.root)):
+            first_dir = os.path.join(self.root, first)
+            if not _SHARD_PATTERN.match(first) or not os.path.isdir(first_dir):
+                continue
+            for second in sorted(os.listdir(first_dir)):
+                second_dir = os.path.join(first_dir, second)
+                if not _SHARD_PATTERN.match(second) or not os.path.isdir(second_dir):
+                    continue
+                for filename in os.listdir(second_dir):
+                    is_stored = _HASH_PATTERN.match(filename) and filename.startswith(first + second)
+                    if not (is_stored or filename.startswith(_TEMP_PREFIX)):
+                        continue
+                    path = os.path.normpath(os.path.join(second_dir, filename))
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        # Renamed or removed by a concurrent store() or GC
+                        continue
+                    yield path, stat
+
+    def collect_garbage(self, dry_run: bool = False) -> Dict:
+        """Delete unreferenced and expired uploads, then trim to UPLOAD_STORE_MAX_BYTES.
+
+        Unreferenced files younger than UPLOAD_GC_GRACE_SECONDS are kept,
+        since their extraction may still be running. A file expires when
+        both its newest reference and its mtime, which store() refreshes
+        on a duplicate upload, are past UPLOAD_RETENTION_DAYS. If the
+        store is still over its size cap, files are removed oldest first.
+        """
+        with self._gc_lock:
+            self._last_gc = time.time()
+            started = time.perf_counter()
+            references = self._get_references()
+            now = time.time()
+            retention_cutoff = (datetime.now(timezone.utc) - timedelta(days=Config.UPLOAD_RETENTION_DAYS)).strftime('%Y-%m-%d %H:%M:%S')
+
+            kept = []
+            removed = []
+            for path, stat in self._iter_store_files():
+                newest = references.get(path)
+
+                if newest is None:
+                    # Unreferenced: keep during the grace period, and clean up stale temp files after it
+                    if now - stat.st_mtime < Config.UPLOAD_GC_GRACE_SECONDS:
+                        kept.append(('', path, stat.st_size))
+                        continue
+                    removed.append((path, stat.st_size, 'unreferenced'))
+                    continue
+
+                # A re-upload refreshes mtime, so the file lives as long as the later of the two
+                touched = datetime.fromtimestamp(stat.st_mtime, timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+                last_used = max(newest, touched)
+                if last_used < retention_cutoff:
+                    removed.append((path, stat.st_size, 'expired'))
+                else:
+                    kept.append((last_used, path, stat.st_size))
+
+            kept_bytes = sum(size for _, _, size in kept)
+            if kept_bytes > Config.UPLOAD_STORE_MAX_BYTES:
+                # Empty newest marks files still in their grace period; sort them last
+                for newest, path, size in sorted(kept, key=lambda entry: entry[0] or '~'):
+                    if kept_bytes <= Config.UPLOAD_STORE_MAX_BYTES:
+                        break
+                    removed.append((path, size, 'over_capacity'))
+                    kept_bytes -= size
+
+            if not dry_run:
+                for path, _, _ in removed:
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+                self._remove_empty_shards()
+
+            summary = {
+                'dry_run': dry_run,
+                'removed_files': len(removed),
+                'removed_bytes': sum(size for _, size, _ in removed),
+                'removed_by_reason': {
+                    reason: sum(1 for _, _, r in removed if r == reason)
+                    for reason in ('unreferenced', 'expired', 'over_capacity')
+                },
+                'kept_files': len(kept) - sum(1 for _, _, r in removed if r == 'over_capacity'),
+                'kept_bytes': kept_bytes,
+                'elapsed_seconds': round(time.perf_counter() - started, 3)
+            }
+            logger.info(f"Upload store GC: removed {summary['removed_files']} files ({summary['removed_bytes']} bytes)")
+            return summary
+
+    def maybe_collect_garbage(self):
+        """Run GC in the background at most once per UPLOAD_GC_INTERVAL_SECONDS"""
+        if time.time() - self._last_gc < Config.UPLOAD_GC_INTERVAL_SECONDS or self._gc_lock.locked():
+            return
+        self._last_gc = time.time()
+        threading.Thread(target=self._collect_quietly, name='upload-gc', daemon=True).start()
+
+    def _collect_quietly(self):
+        try:
+            self.collect_garbage()
+        except Exception as e:
+            logger.error(f"Error collecting upload garbage: {str(e)}")
+
+    def _remove_empty_shards(self):
+        """Remove shard directories left empty by GC"""
+        for first in os.listdir(self.root):
+            first_dir = os.path.join(self.root, first)
+            if not _SHARD_PATTERN.match(first) or not os.path.isdir(first_dir):
+                continue
+            for second in os.listdir(first_dir):
+                second_dir = os.path.join(first_dir, second)
+                if _SHARD_PATTERN.match(second) and os.path.isdir(second_dir) and not os.listdir(second_dir):
+                    try:
+                        os.rmdir(second_dir)
+                    except OSError:
+                        pass
+            try:
+                if not os.listdir(first_dir):
+                    os.rmdir(first_dir)
+            except OSError:
+                pass
+
+    def stats(self) -> Dict:
+        """File count, bytes and referenced files in the store"""
+        references = self._get_references()
+        files = 0
+        total_bytes = 0
+        referenced = 0
+        for path, stat in self._iter_store_files():
+            files += 1
+            total_bytes += stat.st_size
+            referenced += path in references
+        return {'root': self.root, 'files': files, 'bytes': total_bytes, 'referenced_files': referenced}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect or garbage-collect the invoice upload store")
+    parser.add_argument('command', choices=['gc', 'stats'])
+    parser.add_argument('--dry-run', action='store_true', help="Report what gc would delete without deleting")
+    args = parser.parse_args()
+
+    store = UploadStore()
+    if args.command == 'gc':
+        print(json.dumps(store.collect_garbage(dry_run=args.dry_run), indent=2))
+    else:
+        print(json.dumps(store.stats(), indent=2))
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+WhatsApp Voice Note Pipeline
+Downloads voice notes sent to the bot, transcribes them with Sarvam
+speech-to-text and answers the transcribed question through the outbox.
+"""
+
+import os
+import json
+import wave
+import shutil
+import hashlib
+import logging
+import sqlite3
+import argparse
+import tempfile
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+import requests
+from requests.adapters import HTTPAdapter
+from config import Config
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Sarvam language codes for the bot's languages
+STT_LANGUAGE_CODES = {'en': 'en-IN', 'hi': 'hi-IN'}
+
+# Audio Sarvam accepts without transcoding
+WAV_CONTENT_TYPES = {'audio/wav', 'audio/x-wav', 'audio/wave', 'audio/vnd.wave'}
+
+class VoiceNoteError(Exception):
+    """Raised when a voice note cannot be downloaded, transcoded or transcribed"""
+
+def download_media(url: str, destination: str, max_bytes: int = None) -> Tuple[str, int]:
+    """Stream a media file to disk and return (sha256, size).
+
+    The body is written in chunks and hashed on the way, so a long note is
+    never held in memory. Twilio media URLs take the account credentials.
+    """
+    max_bytes = max_bytes or Config.VOICE_NOTE_MAX_BYTES
+    auth = (Config.TWILIO_ACCOUNT_SID, Config.TWILIO_AUTH_TOKEN) if Config.TWILIO_ACCOUNT_SID else None
+    digest = hashlib.sha256()
+    size = 0
+
+    with requests.get(url, auth=auth, stream=True, timeout=Config.VOICE_NOTE_DOWNLOAD_TIMEOUT) as response:
+        if response.status_code >= 400:
+            raise VoiceNoteError(f"Media download returned {response.status_code}")
+        with open(destination, 'wb') as media_file:
+            for chunk in response.iter_content(chunk_size=64 * 1024):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise VoiceNoteError(f"Voice note is larger than {max_bytes} bytes")
+                digest.update(chunk)
+                media_file.write(chunk)
+
+    return digest.hexdigest(), size
+
+def split_wav(path: str, out_dir: str, chunk_seconds: float = None) -> List[str]:
+    """Split a WAV file into chunks of at most `chunk_seconds` without re-encoding"""
+    chunk_seconds = chunk_seconds or Config.VOICE_NOTE_CHUNK_SECONDS
+    chunks = []
+
+    with wave.open(path, 'rb') as source:
+        params = source.getparams()
+        frames_per_chunk = max(1, int(params.framerate * chunk_seconds))
+        while True:
+            frames = source.readframes(frames_per_chunk)
+            if not frames:
+                break
+            chunk_path = os.path.join(out_dir, f"chunk{len(chunks):03d}.wav")
+            with wave.open(chunk_path, 'wb') as chunk:
+                chunk.setparams(params)
+                chunk.writeframes(frames)
+            chunks.append(chunk_path)
+
+    return chunks
+
+def transcode_and_chunk(path: str, content_type: str, out_dir: str, chunk_seconds: float = None) -> List[str]:
+    """Convert a voice note to 16 kHz mono WAV chunks ready for speech-to-text.
+
+    WhatsApp voice notes are OGG/Opus, which needs ffmpeg; WAV input is
+    split directly when ffmpeg is not installed.
+    """
+    chunk_seconds = chunk_seconds or Config.VOICE_NOTE_CHUNK_SECONDS
+    ffmpeg = shutil.which(Config.FFMPEG_BINARY)
+
+    if ffmpeg is None:
+        if content_type.split(';')[0].strip() in WAV_CONTENT_TYPES:
+            return split_wav(path, out_dir, chunk_seconds)
+        raise VoiceNoteError(f"ffmpeg is required to transcode {content_type} voice notes")
+
+    result = subprocess.run(
+        [
+            ffmpeg, '-hide_banner', '-loglevel', 'error', '-i', path,
+            '-ac', '1', '-ar', '16000', '-c:a', 'pcm_s16le',
+            '-f', 'segment', '-segment_time', str(chunk_seconds),
+            os.path.join(out_dir, 'chunk%03d.wav')
+        ],
+        capture_output=True,
+        timeout=Config.VOICE_NOTE_TRANSCODE_TIMEOUT
+    )
+    if result.returncode != 0:
+        raise VoiceNoteError(f"ffmpeg failed: {result.stderr.decode(errors='replace')[:200]}")
+
+    return sorted(os.path.join(out_dir, name) for name in os.listdir(out_dir) if name.startswith('chunk'))
+
+class SpeechToTextClient:
+    """Sarvam speech-to-text client with one keep-alive session per thread"""
+
+    def __init__(self, base_url: str = None, api_key: str = None, model: str = None):
+        self.url = f"{(base_url or Config.SARVAM_API_BASE_URL).rstrip('/')}/speech-to-text"
+        self.api_key = api_key or Config.SARVAM_API_KEY
+        self.model = model or Config.SARVAM_STT_MODEL
+        self._local = threading.local()
+
+    def _get_session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            session.headers['api-subscription-key'] = self.api_key or ''
+            session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=1))
+            session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=1))
+            self._local.session = session
+        return session
+
+    def transcribe(self, wav_path: str, language_code: str) -> str:
+        """Transcribe one WAV file"""
+        if not self.api_key:
+            raise VoiceNoteError("SARVAM_API_KEY not configured")
+
+        with open(wav_path, 'rb') as audio_file:
+            response = self._get_session().post(
+                self.url,
+                data={'model': self.model, 'language_code': language_code, 'with_timestamps': 'false'},
+                files=[('file', (os.path.basename(wav_path), audio_file, 'audio/wav'))],
+                timeout=Config.VOICE_NOTE_STT_TIMEOUT
+            )
+
+        if response.status_code >= 400:
+            raise VoiceNoteError(f"Speech-to-text returned {response.status_code}: {response.text[:200]}")
+        return response.json().get('transcript', '').strip()
+
+class TranscriptCache:
+    """Transcripts keyed by audio hash and language, so a forwarded note is transcribed once"""
+
+    def __init__(self, db_file: str = None):
+        self.db_file = db_file or Config.VOICE_NOTE_DATABASE_FILE
+        self.create_table()
+
+    def create_table(self):
+        try:
+            conn = sqlite3.connect(self.db_file, timeout=30)
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS voice_transcripts (
+                    audio_hash TEXT NOT NULL,
+                    language_code TEXT NOT NULL,
+                    transcript TEXT NOT NULL,
+                    chunks INTEGER,
+                    audio_bytes INTEGER,
+                    created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (audio_hash, language_code)
+                ) WITHOUT ROWID
+            ''')
+            conn.commit()
+            conn.close()
+        except Exception as e:
+            logger.error(f"Error creating transcript cache table: {str(e)}")
+
+    def get(self, audio_hash: str, language_code: str) -> Optional[str]:
+        try:
+            conn = sqlite3.connect(self.db_file, timeout=30)
+            row = conn.execute(
+                'SELECT transcript FROM voice_transcripts WHERE audio_hash = ? AND language_code = ?',
+                (audio_hash, language_code)
+            ).fetchone()
+            conn.close()
+            return row[0] if row else None
+        except Exception as e:
+            logger.error(f"Error reading transcript cache: {str(e)}")
+            return None
+
+    def put(self, audio_hash: str, language_code: str, transcript: str, chunks: int, audio_bytes: int):
+        try:
+            conn = sqlite3.connect(self.db_file, timeout=30)
+            conn.execute('''
+                INSERT OR REPLACE INTO voice_transcripts (audio_hash, language_code, transcript, chunks, audio_bytes)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (audio_hash, language_code, transcript, chunks, audio_bytes))
+            conn.commit()
+            conn.close()
+        except Exception as e:
+            logger.error(f"Error writing transcript cache: {str(e)}")
+
+class VoiceNoteProcessor:
+    """Answers voice notes in the background.
+
+    submit() returns straight away so the webhook can acknowledge the
+    note. A worker then downloads the audio, transcribes its chunks
+    concurrently, runs the transcript through the query processor and
+    queues the answer on the outbox.
+    """
+
+    def __init__(self, query_processor, outbox, stt_client: SpeechToTextClient = None,
+                 cache: TranscriptCache = None, max_workers: int = None, stt_concurrency: int = None):
+        self.query_processor = query_processor
+        self.outbox = outbox
+        self.stt_client = stt_client or SpeechToTextClient()
+        self.cache = cache or TranscriptCache()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers or Config.VOICE_NOTE_WORKERS,
+                                            thread_name_prefix='voice-note')
+        self._stt_executor = ThreadPoolExecutor(max_workers=stt_concurrency or Config.VOICE_NOTE_STT_CONCURRENCY,
+                                                thread_name_prefix='voice-stt')
+
+    def transcribe_file(self, path: str, content_type: str, language: str = 'en') -> Dict:
+        """Transcribe a local audio file, using the cache when the same audio was seen before"""
+        # Hash in chunks; hashlib.file_digest needs Python 3.11
+        digest = hashlib.sha256()
+        with open(path, 'rb') as audio_file:
+            for chunk in iter(lambda: audio_file.read(64 * 1024), b''):
+                digest.update(chunk)
+        audio_hash = digest.hexdigest()
+        return self._transcribe(path, content_type, language, audio_hash, os.path.getsize(path))
+
+    def transcribe_media(self, media_url: str, content_type: str, language: str = 'en') -> Dict:
+        """Download a voice note and transcribe it"""
+        with tempfile.TemporaryDirectory(prefix='voice-note-') as work_dir:
+            path = os.path.join(work_dir, 'note')
+            audio_hash, size = download_media(media_url, path)
+            return self._transcribe(path, content_type, language, audio_hash, size)
+
+    def _transcribe(self, path: str, content_type: str, language: str, audio_hash: str, size: int) -> Dict:
+        language_code = STT_LANGUAGE_CODES.get(language, 'en-IN')
+        cached = self.cache.get(audio_hash, language_code)
+        if cached is not None:
+            logger.info(f"Using cached transcript for voice note {audio_hash[:12]}")
+            return {'transcript': cached, 'audio_hash': audio_hash, 'chunks': 0, 'cached': True}
+
+        with tempfile.TemporaryDirectory(prefix='voice-chunks-') as chunk_dir:
+            chunks = transcode_and_chunk(path, content_type, chunk_dir)
+            if not chunks:
+                raise VoiceNoteError("Voice note contains no audio")
+            # map keeps chunk order, so the pieces stitch back in sequence
+            pieces = list(self._stt_executor.map(lambda chunk: self.stt_client.transcribe(chunk, language_code), chunks))
+
+        transcript = ' '.join(piece for piece in pieces if piece)
+        if not transcript:
+            raise VoiceNoteError("No speech recognised in voice note")
+
+        self.cache.put(audio_hash, language_code, transcript, len(chunks), size)
+        logger.info(f"Transcribed voice note {audio_hash[:12]} in {len(chunks)} chunks")
+        return {'transcript': transcript, 'audio_hash': audio_hash, 'chunks': len(chunks), 'cached': False}
+
+    def answer(self, phone_number: str, media_url: str, content_type: str, language: str = 'en',
+               error_message: str = None) -> Optional[int]:
+        """Transcribe a voice note, answer it and queue the reply; returns the outbox id"""
+        try:
+            transcript = self.transcribe_media(media_url, content_type, language)['transcript']
+            logger.info(f"Voice note from {phone_number}: {transcript}")
+            response = self.query_processor.process_query(transcript, language, phone_number)
+            return self.outbox.enqueue(phone_number, f"🎤 _{transcript}_\n\n{response}")
+        except Exception as e:
+            logger.error(f"Error answering voice note from {phone_number}: {str(e)}")
+            if error_message:
+                return self.outbox.enqueue(phone_number, error_message)
+            return None
+
+    def submit(self, phone_number: str, media_url: str, content_type: str, language: str = 'en',
+               error_message: str = None):
+        """Answer a voice note on a background worker"""
+        return self._executor.submit(self.answer, phone_number, media_url, content_type, language, error_message)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Transcribe a voice note with Sarvam speech-to-text")
+    parser.add_argument('audio_file')
+    parser.add_argument('--content-type', default='audio/ogg', help="MIME type of the audio, e.g. audio/wav")
+    parser.add_argument('--language', choices=list(STT_LANGUAGE_CODES), default='hi')
+    args = parser.parse_args()
+
+    processor = VoiceNoteProcessor(query_processor=None, outbox=None)
+    print(json.dumps(processor.transcribe_file(args.audio_file, args.content_type, args.language), indent=2, ensure_ascii=False))
@@ -0,0 +1,380 @@
+#!/usr/bin/env python3
+"""
+WhatsApp Bot Benchmark Suite
+Drives whatsapp_webhook in-process through the Flask test client with the
+LLM, vision and Twilio layers stubbed, and records latency percentiles and
+throughput per scenario and per pipeline stage.
+
+Results are written as JSON to bench_results/ so runs can be compared
+between commits:
+
+    python webhook_bench.py --requests 500 --concurrency 8
+    python webhook_bench.py --compare bench_results/<earlier run>.json
+
+To load test a running server over HTTP use webhook_load.py instead.
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import sqlite3
+import logging
+import platform
+import argparse
+import tempfile
+import threading
+import subprocess
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List
+from latency_stats import percentile
+from webhook_load import DEFAULT_PHONES, build_webhook_params
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Where result files are written, relative to the directory the suite is started from
+RESULTS_DIR = 'bench_results'
+
+# Questions sent in the query scenario, with the SQL the stubbed model returns for each
+CANNED_SQL = {
+    "Which item sold the most last week?": """
+        SELECT i.name, SUM(s.quantity_sold) AS total_sold
+        FROM sales s JOIN items i ON s.item_id = i.id JOIN shops sh ON i.shop_id = sh.id
+        WHERE sh.owner_phone = '{phone}' AND s.sale_date >= date('now', '-7 days')
+        GROUP BY i.name ORDER BY total_sold DESC LIMIT 1
+    """,
+    "What is the total profit for this month?": """
+        SELECT SUM(s.profit) AS total_profit
+        FROM sales s JOIN items i ON s.item_id = i.id JOIN shops sh ON i.shop_id = sh.id
+        WHERE sh.owner_phone = '{phone}' AND strftime('%Y-%m', s.sale_date) = strftime('%Y-%m', 'now')
+    """,
+    "What are the top 5 selling items?": """
+        SELECT i.name, SUM(s.quantity_sold) AS total_sold
+        FROM sales s JOIN items i ON s.item_id = i.id JOIN shops sh ON i.shop_id = sh.id
+        WHERE sh.owner_phone = '{phone}'
+        GROUP BY i.name ORDER BY total_sold DESC LIMIT 5
+    """,
+    "Which items will expire in the next 3 days?": """
+        SELECT i.name, i.expiry_date
+        FROM items i JOIN shops sh ON i.shop_id = sh.id
+        WHERE sh.owner_phone = '{phone}' AND i.expiry_date BETWEEN date('now') AND date('now', '+3 days')
+    """
+}
+
+# Form fields each scenario adds to a Twilio webhook post
+SCENARIOS = {
+    'menu': lambda: {"Body": random.choice(["help", "examples", "language", "1"])},
+    'query': lambda: {"Body": random.choice(list(CANNED_SQL))},
+    'voice': lambda: {"Body": "", "NumMedia": "1", "MediaUrl0": "http://bench.invalid/note.ogg",
+                      "MediaContentType0": "audio/ogg"},
+    'photo': lambda: {"Body": "", "NumMedia": "1", "MediaUrl0": "http://bench.invalid/bill.jpg",
+                      "MediaContentType0": "image/jpeg"}
+}
+
+class StageTimer:
+    """Collects durations per stage from any thread"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.durations = defaultdict(list)
+
+    def record(self, stage: str, seconds: float):
+        with self._lock:
+            self.durations[stage].append(seconds * 1000)
+
+    def wrap(self, stage: str, function: Callable) -> Callable:
+        """Return `function` with each call's duration recorded under `stage`"""
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.record(stage, time.perf_counter() - started)
+        return timed
+
+    def reset(self) -> Dict[str, List[float]]:
+        """Return the collected durations and start over"""
+        with self._lock:
+            durations, self.durations = dict(self.durations), defaultdict(list)
+            return durations
+
+class BackgroundTracker:
+    """Counts background work handed off by the webhook so a scenario can wait for it"""
+
+    def __init__(self):
+        self._changed = threading.Condition()
+        self.submitted = 0
+        self.finished = 0
+
+    def track_submit(self, submit: Callable) -> Callable:
+        def tracked(*args, **kwargs):
+            result = submit(*args, **kwargs)
+            with self._changed:
+                self.submitted += 1
+            return result
+        return tracked
+
+    def track_finish(self, function: Callable) -> Callable:
+        def tracked(*args, **kwargs):
+            try:
+                return function(*args, **kwargs)
+            finally:
+                with self._changed:
+                    self.finished += 1
+                    self._changed.notify_all()
+        return tracked
+
+    def wait(self, timeout: float = 60.0) -> bool:
+        """Block until everything submitted so far has finished"""
+        with self._changed:
+            return self._changed.wait_for(lambda: self.finished >= self.submitted, timeout)
+
+def latency_summary(latencies: List[float]) -> Dict:
+    """p50/p95/p99/max of a list of millisecond latencies"""
+    return {
+        "count": len(latencies),
+        "p50": round(percentile(latencies, 50), 3),
+        "p95": round(percentile(latencies, 95), 3),
+        "p99": round(percentile(latencies, 99), 3),
+        "max": round(max(latencies), 3) if latencies else 0.0
+    }
+
+def seed_sales(database_file: str, extra_sales: int):
+    """Add synthetic sales for the sample shops so the query stage has data to scan"""
+    if extra_sales <= 0:
+        return
+    conn = sqlite3.connect(database_file)
+    item_ids = [row[0] for row in conn.execute('SELECT id FROM items')]
+    today = datetime.now(timezone.utc).date()
+    rows = [
+        (str(uuid.uuid4()), random.choice(item_ids), random.randint(1, 10), round(random.uniform(1, 50), 2),
+         (today - timedelta(days=random.randint(0, 90))).isoformat())
+        for _ in range(extra_sales)
+    ]
+    conn.executemany('INSERT INTO sales (id, item_id, quantity_sold, profit, sale_date) VALUES (?, ?, ?, ?, ?)', rows)
+    conn.commit()
+    conn.close()
+
+def setup_app(timer: StageTimer, tracker: BackgroundTracker, llm_latency_ms: float, vision_latency_ms: float,
+              extra_sales: int):
+    """Import the bot against scratch databases and stub its external calls.
+
+    Must run with the scratch directory as the working directory, since
+    every database path in the app is relative.
+    """
+    import db
+    db.create_database_schema()
+    seed_sales(db.DATABASE_FILE, extra_sales)
+
+    import ai
+    from config import Config
+    # Replies must stay in the outbox, so the app's sender and scheduler are not started
+    Config.BACKGROUND_WORKERS = False
+    import app as bot
+
+    # LLM: canned SQL after the configured model latency
+    def generate_sql(query, language='en', phone_number=None):
+        time.sleep(llm_latency_ms / 1000.0)
+        return CANNED_SQL[query].format(phone=phone_number)
+
+    bot.ai_processor.generate_sql = timer.wrap('llm', generate_sql)
+    ai.execute_query = timer.wrap('db_query', ai.execute_query)
+    bot.ai_processor._format_results = timer.wrap('format', bot.ai_processor._format_results)
+
+    # Twilio: replies are written to the outbox, whose sender is not started
+    bot.message_outbox.enqueue = timer.wrap('outbox_enqueue', bot.message_outbox.enqueue)
+
+    # Speech-to-text: the background answer skips download and transcription
+    def answer_voice_note(phone_number, media_url, content_type, language='en', error_message=None):
+        response = bot.ai_processor.process_query(random.choice(list(CANNED_SQL)), language, phone_number)
+        return bot.message_outbox.enqueue(phone_number, response)
+
+    bot.voice_notes.answer = tracker.track_finish(timer.wrap('voice_answer', answer_voice_note))
+    bot.voice_notes.submit = tracker.track_submit(bot.voice_notes.submit)
+
+    # Vision: a canned invoice after the configured vision latency
+    def extract_invoice(phone_number, media_url, message_sid=None):
+        time.sleep(vision_latency_ms / 1000.0)
+        return {
+            'invoice_id': str(uuid.uuid4()),
+            'extracted_data': {'invoice_number': 'BENCH-1', 'customer_name': 'Bench Supplier', 'currency': 'INR',
+                               'total_amount': 1180.0, 'tax_amount': 180.0, 'items': [{'item_name': 'Milk'}]},
+            'confidence': 1.0,
+            'validation_issues': [],
+            'reconciliation': None
+        }
+
+    bot.invoice_photos.extract = timer.wrap('photo_extract', extract_invoice)
+    bot.invoice_photos._reply = tracker.track_finish(bot.invoice_photos._reply)
+    bot.invoice_photos.submit = tracker.track_submit(bot.invoice_photos.submit)
+    return bot
+
+def run_scenario(bot, timer: StageTimer, tracker: BackgroundTracker, scenario: str, requests_count: int,
+                 concurrency: int) -> Dict:
+    """Send `requests_count` webhook posts for one scenario from `concurrency` closed-loop workers"""
+    local = threading.local()
+    latencies = []
+    errors = defaultdict(int)
+    results_lock = threading.Lock()
+
+    def get_client():
+        client = getattr(local, 'client', None)
+        if client is None:
+            client = local.client = bot.app.test_client()
+        return client
+
+    def fire(index):
+        params = build_webhook_params(DEFAULT_PHONES[index % len(DEFAULT_PHONES)], "", index)
+        params.update(SCENARIOS[scenario]())
+        started = time.perf_counter()
+        try:
+            response = get_client().post('/whatsapp', data=params)
+            body = response.get_data(as_text=True)
+            outcome = None if response.status_code == 200 and '<Response>' in body else f"HTTP {response.status_code}"
+        except Exception as e:
+            outcome = type(e).__name__
+        elapsed_ms = (time.perf_counter() - started) * 1000
+
+        with results_lock:
+            if outcome:
+                errors[outcome] += 1
+            else:
+                latencies.append(elapsed_ms)
+
+    timer.reset()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(fire, range(requests_count)))
+    elapsed = time.perf_counter() - started
+
+    # Background replies belong to the scenario that queued them
+    if not tracker.wait():
+        logger.warning(f"Background work for {scenario} did not finish")
+    jobs = bot.invoice_photos.jobs.stats() if scenario == 'photo' else None
+    stages = {stage: latency_summary(durations) for stage, durations in sorted(timer.reset().items())}
+    stages = {"webhook": latency_summary(latencies), **stages}
+
+    return {
+        "requests": requests_count,
+        "concurrency": concurrency,
+        "succeeded": len(latencies),
+        "errors": dict(errors),
+        "duration_seconds": round(elapsed, 3),
+        "requests_per_second": round(len(latencies) / elapsed, 2) if elapsed > 0 else 0.0,
+        "stages": stages,
+        "job_queue": jobs
+    }
+
+def git_commit() -> str:
+    """Short hash of the checked-out commit, with '+dirty' for uncommitted changes"""
+    try:
+        root = os.path.dirname(os.path.abspath(__file__))
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=root,
+                                capture_output=True, text=True, timeout=10).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=root,
+                               capture_output=True, text=True, timeout=10).stdout.strip()
+        return f"{commit}+dirty" if commit and dirty else (commit or 'unknown')
+    except Exception:
+        return 'unknown'
+
+def compare_results(current: Dict, baseline: Dict, max_regression: float) -> List[str]:
+    """Print p95 changes against a baseline run and return the stages that regressed"""
+    regressions = []
+    print(f"\n=== COMPARED WITH {baseline.get('commit')} ({baseline.get('started_at')}) ===")
+    for scenario, result in current['scenarios'].items():
+        previous = baseline.get('scenarios', {}).get(scenario)
+        if not previous:
+            continue
+        for stage, summary in result['stages'].items():
+            before = previous['stages'].get(stage, {}).get('p95')
+            if not before:
+                continue
+            change = (summary['p95'] - before) / before
+            flag = ' <-- regression' if change > max_regression else ''
+            print(f"{scenario:>6} {stage:<15} p95 {before:9.3f} -> {summary['p95']:9.3f} ms ({change:+.1%}){flag}")
+            if flag:
+                regressions.append(f"{scenario}/{stage}")
+        before_rps = previous.get('requests_per_second')
+        if before_rps:
+            print(f"{scenario:>6} {'throughput':<15} {before_rps:9.2f} -> {result['requests_per_second']:9.2f} req/s "
+                  f"({(result['requests_per_second'] - before_rps) / before_rps:+.1%})")
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the WhatsApp webhook in-process with stubbed LLM and Twilio")
+    parser.add_argument('--scenario', action='append', choices=list(SCENARIOS), help="Scenario to run (repeatable, default all)")
+    parser.add_argument('--requests', type=int, default=500, help="Webhook posts per scenario")
+    parser.add_argument('--concurrency', type=int, default=8, help="Concurrent clients")
+    parser.add_argument('--llm-latency-ms', type=float, default=0.0, help="Simulated SQL generation latency")
+    parser.add_argument('--vision-latency-ms', type=float, default=0.0, help="Simulated invoice extraction latency")
+    parser.add_argument('--extra-sales', type=int, default=20000, help="Synthetic sales rows added to the sample data")
+    parser.add_argument('--output-dir', default=RESULTS_DIR, help="Directory for the JSON result file")
+    parser.add_argument('--compare', help="Earlier result file to compare p95 latencies against")
+    parser.add_argument('--max-regression', type=float, default=0.2, help="p95 increase that counts as a regression (0.2 = 20%%)")
+    parser.add_argument('--seed', type=int, default=1, help="Random seed for message and data choice")
+    parser.add_argument('--verbose', action='store_true', help="Keep the app's INFO logging")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    output_dir = os.path.abspath(args.output_dir)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+
+    # Request logging would dominate the measurements
+    if not args.verbose:
+        logging.disable(logging.INFO)
+
+    started_at = datetime.now(timezone.utc)
+    timer = StageTimer()
+    tracker = BackgroundTracker()
+    original_dir = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix='webhook-bench-') as scratch_dir:
+        # Every database the bot opens is a relative path, so this keeps the real ones untouched
+        os.chdir(scratch_dir)
+        try:
+            bot = setup_app(timer, tracker, args.llm_latency_ms, args.vision_latency_ms, args.extra_sales)
+            scenarios = {}
+            for scenario in args.scenario or list(SCENARIOS):
+                print(f"Running {scenario}: {args.requests} requests at concurrency {args.concurrency}...")
+                scenarios[scenario] = run_scenario(bot, timer, tracker, scenario, args.requests, args.concurrency)
+        finally:
+            os.chdir(original_dir)
+
+    results = {
+        "suite": "webhook",
+        "commit": git_commit(),
+        "started_at": started_at.isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": {key: value for key, value in vars(args).items() if key not in ('compare', 'verbose', 'output_dir')},
+        "scenarios": scenarios
+    }
+
+    os.makedirs(output_dir, exist_ok=True)
+    output_file = os.path.join(output_dir, f"webhook-{started_at.strftime('%Y%m%dT%H%M%SZ')}-{results['commit']}.json")
+    with open(output_file, 'w') as result_file:
+        json.dump(results, result_file, indent=2)
+
+    print(f"\n=== WEBHOOK BENCHMARK ({results['commit']}) ===")
+    for scenario, result in scenarios.items():
+        print(f"\n{scenario}: {result['requests_per_second']} req/s, {result['succeeded']}/{result['requests']} ok, errors {result['errors']}")
+        if result['job_queue']:
+            print(f"  job queue: {result['job_queue']['succeeded']} extracted, {result['job_queue']['rejected']} rejected as busy")
+        for stage, summary in result['stages'].items():
+            print(f"  {stage:<15} n={summary['count']:<6} p50 {summary['p50']:8.3f}  p95 {summary['p95']:8.3f}  "
+                  f"p99 {summary['p99']:8.3f}  max {summary['max']:8.3f} ms")
+    print(f"\nResults written to {output_file}")
+
+    if baseline:
+        regressed = compare_results(results, baseline, args.max_regression)
+        if regressed:
+            print(f"\n{len(regressed)} stages regressed by more than {args.max_regression:.0%}: {', '.join(regressed)}")
+            sys.exit(1)
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+WhatsApp Webhook Load Driver
+Fires Twilio-style signed form posts at the /whatsapp webhook at a target rate
+and reports latency percentiles and throughput.
+"""
+
+import time
+import json
+import random
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from twilio.request_validator import RequestValidator
+from config import Config
+from latency_stats import percentile
+
+# Messages sent by the simulated shop owners
+DEFAULT_MESSAGES = [
+    "help",
+    "examples",
+    "1",
+    "Which item sold the most last week?",
+    "What is the total profit for this month?",
+    "What are the top 5 selling items?"
+]
+
+# Owner numbers from the sample data in db.py
+DEFAULT_PHONES = ["+1234567890", "+9876543210", "+1122334455"]
+
+def build_webhook_params(phone, body, index):
+    """Build the form fields Twilio posts for an incoming WhatsApp message"""
+    return {
+        "MessageSid": f"SMload{index:010d}",
+        "AccountSid": Config.TWILIO_ACCOUNT_SID or "ACloadtest",
+        "From": f"whatsapp:{phone}",
+        "To": f"whatsapp:{Config.TWILIO_WHATSAPP_NUMBER}",
+        "Body": body,
+        "NumMedia": "0"
+    }
+
+def run_load(url, rate, duration, concurrency, messages=None, phones=None, auth_token=None):
+    """Post to the webhook at `rate` requests per second for `duration` seconds.
+
+    Latency is measured from each request's scheduled send time, so time
+    spent waiting for a free worker once all `concurrency` are busy is
+    counted instead of hidden (coordinated omission). Service time, from
+    the actual send, is reported separately.
+    """
+    messages = messages or DEFAULT_MESSAGES
+    phones = phones or DEFAULT_PHONES
+    validator = RequestValidator(auth_token or Config.TWILIO_AUTH_TOKEN or "loadtest")
+
+    local = threading.local()
+    latencies = []
+    service_times = []
+    errors = {}
+    results_lock = threading.Lock()
+
+    def get_session():
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = requests.Session()
+        return session
+
+    def fire(index, scheduled):
+        params = build_webhook_params(random.choice(phones), random.choice(messages), index)
+        headers = {"X-Twilio-Signature": validator.compute_signature(url, params)}
+        started = time.perf_counter()
+        try:
+            response = get_session().post(url, data=params, headers=headers, timeout=30)
+            outcome = None if response.status_code == 200 else f"HTTP {response.status_code}"
+        except requests.RequestException as e:
+            outcome = type(e).__name__
+        finished = time.perf_counter()
+
+        with results_lock:
+            if outcome:
+                errors[outcome] = errors.get(outcome, 0) + 1
+            else:
+                latencies.append((finished - scheduled) * 1000)
+                service_times.append((finished - started) * 1000)
+
+    total = int(rate * duration)
+    interval = 1.0 / rate
+    started = time.perf_counter()
+
+    # Open-loop schedule: requests go out on time even if earlier ones are slow
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for index in range(total):
+            scheduled = started + index * interval
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            executor.submit(fire, index, scheduled)
+
+    elapsed = time.perf_counter() - started
+    completed = len(latencies)
+    return {
+        "url": url,
+        "target_rps": rate,
+        "duration_seconds": round(elapsed, 3),
+        "requests": total,
+        "succeeded": completed,
+        "errors": errors,
+        "achieved_rps": round(completed / elapsed, 2) if elapsed > 0 else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50), 2),
+            "p95": round(percentile(latencies, 95), 2),
+            "p99": round(percentile(latencies, 99), 2),
+            "max": round(max(latencies), 2) if latencies else 0.0
+        },
+        "service_ms": {
+            "p50": round(percentile(service_times, 50), 2),
+            "p95": round(percentile(service_times, 95), 2),
+            "p99": round(percentile(service_times, 99), 2),
+            "max": round(max(service_times), 2) if service_times else 0.0
+        }
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the WhatsApp webhook with Twilio-style posts")
+    parser.add_argument('--url', default="http://localhost:5001/whatsapp")
+    parser.add_argument('--rate', type=float, default=10.0, help="Target requests per second")
+    parser.add_argument('--duration', type=float, default=30.0, help="Test duration in seconds")
+    parser.add_argument('--concurrency', type=int, default=32, help="Maximum requests in flight")
+    parser.add_argument('--message', action='append', help="Message body to send (repeatable)")
+    args = parser.parse_args()
+
+    print(f"=== WEBHOOK LOAD TEST: {args.rate} req/s for {args.duration}s ===")
+    report = run_load(args.url, args.rate, args.duration, args.concurrency, messages=args.message)
+    print(json.dumps(report, indent=2))